@@ -0,0 +1,104 @@
+"""
+Search-page fixtures for the replay server.
+
+Recorded pages live in benchmarks/fixtures/<name>/page-NNN.html.gz (see record_fixtures.py).
+When no recording is given, synthetic pages are generated with the same shape as the live site:
+a few hundred KB of markup and scripts around a __NEXT_DATA__ payload of 20 listings.
+"""
+import glob
+import gzip
+import json
+import os
+import random
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PER_PAGE = 20
+
+_FILLER_SCRIPT = "<script>" + "self.__next_f.push([1,\"" + "x" * 2000 + "\"]);" * 40 + "</script>\n"
+_FILLER_MARKUP = "".join(
+    f'<div class="card"><a href="/en/plp/buy/{i}.html"><img src="/img/{i}.jpg" alt="listing {i}"></a>'
+    f'<span class="price">{i * 1000} AED</span></div>\n'
+    for i in range(400)
+)
+
+
+def _listing(rng, listing_id):
+    return {
+        "id": str(listing_id),
+        "title": f"Spacious apartment {listing_id} with sea view",
+        "property_type": rng.choice(["Apartment", "Villa", "Townhouse", "Penthouse"]),
+        "price": {"value": rng.randrange(40_000, 5_000_000, 1000), "currency": "AED", "period": "yearly"},
+        "bedrooms": str(rng.randint(0, 6)),
+        "bathrooms": str(rng.randint(1, 7)),
+        "size": {"value": rng.randrange(400, 8000), "unit": "sqft"},
+        "furnished": rng.choice(["YES", "NO", "PARTLY"]),
+        "listed_date": f"2026-{rng.randint(1, 9):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:15:00Z",
+        "rera": f"{rng.randrange(10**9):09d}",
+        "location": {
+            "full_name": "Dubai Marina, Dubai",
+            "coordinates": {"lat": round(rng.uniform(24.8, 25.4), 6), "lon": round(rng.uniform(55.0, 55.6), 6)},
+        },
+        "share_url": f"https://www.propertyfinder.ae/en/plp/buy/apartment-{listing_id}.html",
+        "images": [{"medium": f"https://static.propertyfinder.ae/{listing_id}/{n}.jpg"} for n in range(8)],
+        "agent": {"name": "Agent Name", "email": "agent@example.com", "is_super_agent": rng.random() < 0.3},
+        "broker": {"name": "Broker LLC", "email": "broker@example.com", "phone": "+97140000000"},
+        "description": "\n".join(f"- feature line {n} of listing {listing_id}" for n in range(rng.randint(5, 25))),
+    }
+
+
+def synthetic_page(page, total_results, seed=0):
+    """HTML bytes for one search page of a result set of total_results listings."""
+    rng = random.Random(seed * 100_003 + page)
+    page_count = max(1, -(-total_results // PER_PAGE))
+    first = (page - 1) * PER_PAGE
+    count = max(0, min(PER_PAGE, total_results - first))
+    next_data = {
+        "props": {"pageProps": {"searchResult": {
+            "meta": {"page": page, "per_page": PER_PAGE, "total_count": total_results, "page_count": page_count},
+            "properties": [_listing(rng, 1_000_000 + first + n) for n in range(count)],
+        }}},
+        "page": "/[locale]/search",
+    }
+    payload = json.dumps(next_data).replace("</", "<\\/")
+    return (
+        "<!DOCTYPE html><html><head><title>Property Finder</title>\n" + _FILLER_SCRIPT * 2
+        + "</head><body>\n" + _FILLER_MARKUP
+        + f'<script id="__NEXT_DATA__" type="application/json">{payload}</script>\n'
+        + _FILLER_SCRIPT + "</body></html>"
+    ).encode("utf-8")
+
+
+class FixtureSet:
+    """Serves page bodies either from a recording directory or synthetically."""
+
+    def __init__(self, recording=None, total_results=600, seed=0):
+        self.total_results = total_results
+        self.seed = seed
+        self.recorded = []
+        if recording:
+            path = recording if os.path.isdir(recording) else os.path.join(FIXTURES_DIR, recording)
+            for file in sorted(glob.glob(os.path.join(path, "page-*.html*"))):
+                with open(file, "rb") as f:
+                    body = f.read()
+                self.recorded.append(gzip.decompress(body) if file.endswith(".gz") else body)
+            if not self.recorded:
+                raise FileNotFoundError(f"No page-*.html fixtures in {path}")
+            self.total_results = len(self.recorded) * PER_PAGE
+        self._cache = {}
+
+    @property
+    def page_count(self):
+        return len(self.recorded) or max(1, -(-self.total_results // PER_PAGE))
+
+    def page(self, page):
+        if self.recorded:
+            # Past the recording, answer like the site does for an out-of-range page: no listings
+            return self.recorded[page - 1] if page <= len(self.recorded) else synthetic_page(page, 0, self.seed)
+        body = self._cache.get(page)
+        if body is None:
+            body = self._cache[page] = synthetic_page(page, self.total_results, self.seed)
+        return body
+
+    def bodies(self):
+        """Every page body with listings, for the CPU micro-benchmarks."""
+        return [self.page(page) for page in range(1, self.page_count + 1)]
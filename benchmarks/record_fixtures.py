@@ -0,0 +1,48 @@
+"""
+Record live search pages as replay fixtures (the only part of the benchmark that needs the network).
+
+    python -m benchmarks.record_fixtures dubai-rent --country ae --location 1 --pages 10
+
+Pages are saved gzipped as benchmarks/fixtures/<name>/page-NNN.html.gz; replay them with
+python -m benchmarks.run_bench --recording <name>.
+"""
+import argparse
+import gzip
+import os
+import time
+
+from benchmarks.fixtures import FIXTURES_DIR
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Save live search pages as benchmark fixtures")
+    parser.add_argument("name", help="fixture directory name under benchmarks/fixtures")
+    parser.add_argument("--country", default="ae")
+    parser.add_argument("--location", type=int, default=1)
+    parser.add_argument("--category", type=int, default=1)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--delay", type=float, default=1.0, help="seconds between requests")
+    return parser.parse_args()
+
+
+def main(args):
+    import requests
+    from requestmask import build_search_url, build_url, get_random_headers
+    from search_options import DEFAULT_QUERY
+
+    query = {**DEFAULT_QUERY, "country": args.country, "location": args.location, "category": args.category}
+    directory = os.path.join(FIXTURES_DIR, args.name)
+    os.makedirs(directory, exist_ok=True)
+
+    for page in range(1, args.pages + 1):
+        response = requests.get(build_url(build_search_url(query, page)), headers=get_random_headers(), timeout=30)
+        response.raise_for_status()
+        with open(os.path.join(directory, f"page-{page:03d}.html.gz"), "wb") as f:
+            f.write(gzip.compress(response.content))
+        print(f"  page {page}: {len(response.content) / 1000:.0f} KB")
+        time.sleep(args.delay)
+    print(f"✔ {args.pages} pages saved to {directory}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,157 @@
+import json
+import multiprocessing
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class ReplayConfig:
+    """Fault injection for the replay server; rates are probabilities per request."""
+
+    def __init__(self, latency=0.05, jitter=0.02, throttle_rate=0.0, retry_after=1, truncate_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.truncate_rate = truncate_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def roll(self):
+        """Return (delay, throttle, truncate) for one request."""
+        with self.lock:
+            return (
+                self.latency + self.rng.uniform(0, self.jitter),
+                self.rng.random() < self.throttle_rate,
+                self.rng.random() < self.truncate_rate,
+            )
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real site
+
+    def do_GET(self):
+        server = self.server
+        if self.path == "/__stats":
+            self._send_json(server.take_stats())
+            return
+        delay, throttle, truncate = server.config.roll()
+        time.sleep(delay)
+        server.count("requests")
+
+        if throttle:
+            server.count("throttled")
+            self.send_response(429)
+            self.send_header("Retry-After", str(server.config.retry_after))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        query = parse_qs(urlsplit(self.path).query)
+        page = int(query.get("page", ["1"])[0])
+        body = server.fixtures.page(page)
+        if truncate:
+            # Cut the page inside its __NEXT_DATA__ payload, as a dropped proxy connection would
+            server.count("truncated")
+            body = body[: body.find(b"__NEXT_DATA__") + 4096]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        server.count("bytes", len(body))
+
+    def _send_json(self, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """Local HTTP server answering /<country>/en/search?...&page=N from a FixtureSet."""
+
+    daemon_threads = True
+
+    def __init__(self, fixtures, config=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), _ReplayHandler)
+        self.fixtures = fixtures
+        self.config = config or ReplayConfig()
+        self.stats = {"requests": 0, "throttled": 0, "truncated": 0, "bytes": 0}
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    def count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def take_stats(self):
+        """Return the counters since the last call and reset them."""
+        with self._stats_lock:
+            stats, self.stats = self.stats, dict.fromkeys(self.stats, 0)
+        return stats
+
+    @property
+    def base_url(self):
+        """Value for SEARCH_BASE_URL so build_search_url points here."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/{{country}}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def _serve(fixture_kwargs, config_kwargs, conn):
+    from benchmarks.fixtures import FixtureSet
+
+    fixtures = FixtureSet(**fixture_kwargs)
+    fixtures.bodies()  # build every page up front so serving does no generation work
+    server = ReplayServer(fixtures, ReplayConfig(**config_kwargs))
+    conn.send(server.base_url)
+    server.serve_forever()
+
+
+class ReplayProcess:
+    """
+    Runs a ReplayServer in a child process so its CPU time and memory are not
+    counted against the scraper being measured. Use as a context manager.
+    """
+
+    def __init__(self, fixture_kwargs, config_kwargs):
+        self.fixture_kwargs = fixture_kwargs
+        self.config_kwargs = config_kwargs
+        self.base_url = None
+        self._process = None
+
+    def __enter__(self):
+        parent, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self.fixture_kwargs, self.config_kwargs, child), daemon=True
+        )
+        self._process.start()
+        self.base_url = parent.recv()
+        return self
+
+    def take_stats(self):
+        from urllib.request import urlopen
+
+        with urlopen(self.base_url.replace("/{country}", "/__stats")) as response:
+            return json.loads(response.read())
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        self._process.join()
@@ -0,0 +1,292 @@
+"""
+Offline benchmark: drives the real scrapers against a local replay server.
+
+    python -m benchmarks.run_bench
+    python -m benchmarks.run_bench --latency 0.2 --throttle-rate 0.05 --truncate-rate 0.02
+    python -m benchmarks.run_bench --compare benchmarks/results/bench-20260101-120000.json
+
+Each scenario crawls one query through main.crawl_query or crawler.crawl_query with the
+network pointed at the replay server, the response cache disabled and ScraperAPI off.
+Results are written as JSON to benchmarks/results/ so runs can be compared over time.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.replay_server import ReplayProcess
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+SCENARIOS = ("sync-sequential", "sync", "async-fixed", "async-adaptive", "async-pipeline")
+QUERY = {"country": "ae", "location": 1, "category": 1, "furnishing": 0, "rental_period": "y", "sort_by": "mr"}
+
+
+def load_scrapers(base_url):
+    """Import both scrapers with every search URL pointed at the replay server."""
+    # settings reads SEARCH_BASE_URL once at import, so it has to be set before the first import
+    os.environ["SEARCH_BASE_URL"] = base_url
+    import crawler
+    import http_cache
+    import main
+    import requestmask
+
+    requestmask.USE_SCRAPER_API = False  # never send replay traffic through the proxy
+    http_cache.CACHE_ENABLED = False  # every page must come from the server
+    return main, crawler
+
+
+def _timed(fn, samples):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+    return wrapper
+
+
+def _timed_async(fn, samples):
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+    return wrapper
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return None
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[pct - 1]
+
+
+def _crawl(scenario, main, crawler, sink, args):
+    """Run one crawl of QUERY; returns the number of listings written."""
+    # Every crawl starts without pooled connections, sized for its own scenario
+    main.reset_session()
+    if scenario == "sync-sequential":
+        return main.crawl_query(QUERY, sink, prefetch=0)
+    if scenario == "sync":
+        return main.crawl_query(QUERY, sink)
+
+    import httpx
+    from parse_pipeline import ParsePipeline
+    from rate_limit import AdaptiveLimiter
+
+    async def run():
+        if scenario == "async-fixed":
+            semaphore = asyncio.Semaphore(crawler.CONCURRENT_REQUESTS)
+            slots = crawler.CONCURRENT_REQUESTS
+        else:
+            semaphore = AdaptiveLimiter(
+                initial=crawler.CONCURRENT_REQUESTS, max_limit=crawler.MAX_CONCURRENT_REQUESTS
+            )
+            slots = crawler.MAX_CONCURRENT_REQUESTS
+        async with httpx.AsyncClient() as client:
+            if scenario != "async-pipeline":
+                return await crawler.crawl_query(QUERY, client, semaphore, sink=sink)
+            pipeline = ParsePipeline(
+                lambda page, limiter: crawler.fetch_page_bytes(QUERY, page, client, limiter),
+                crawler.parse_page_bytes,
+                workers=args.parse_workers,
+                download_semaphore=semaphore,
+                download_slots=slots,
+            )
+            async with pipeline:
+                return await crawler.crawl_query(QUERY, client, semaphore, pipeline=pipeline, sink=sink)
+
+    return asyncio.run(run())
+
+
+def run_scenario(scenario, main, crawler, server, args):
+    """Crawl once for throughput and latency; crawl again under tracemalloc for peak memory."""
+    from sinks import ResultSink
+
+    class CountingSink(ResultSink):
+        name = "count"
+
+        def _write(self, records):
+            pass
+
+    samples = []
+    originals = (main.fetch_properties, crawler.fetch_properties, crawler.fetch_page_bytes)
+    main.fetch_properties = _timed(originals[0], samples)
+    crawler.fetch_properties = _timed_async(originals[1], samples)
+    crawler.fetch_page_bytes = _timed_async(originals[2], samples)
+    server.take_stats()
+    try:
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        listings = _crawl(scenario, main, crawler, CountingSink(), args)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+    finally:
+        main.fetch_properties, crawler.fetch_properties, crawler.fetch_page_bytes = originals
+    served = server.take_stats()
+
+    result = {
+        "pages": len(samples),
+        "listings": listings,
+        "wall_s": round(wall, 3),
+        "pages_per_s": round(len(samples) / wall, 2) if wall else None,
+        # Per page fetch including retries and backoff; parse time is in cpu_per_page_ms
+        "latency_p50_ms": _ms(_percentile(samples, 50)),
+        "latency_p99_ms": _ms(_percentile(samples, 99)),
+        # Pool workers are separate processes and are not included here
+        "cpu_ms_per_page": _ms(cpu / len(samples)) if samples else None,
+        "server": served,
+    }
+
+    if not args.no_memory:
+        tracemalloc.start()
+        try:
+            _crawl(scenario, main, crawler, CountingSink(), args)
+            result["peak_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / 1_000_000, 2)
+        finally:
+            tracemalloc.stop()
+        server.take_stats()
+    return result
+
+
+def measure_cpu(bodies, repeat):
+    """CPU milliseconds per page for each extraction path and for building Listings."""
+    import next_data
+    from listing import extract_listings
+
+    payloads = [next_data.extract_next_data(body)[0] for body in bodies]
+    steps = {
+        "parse_fast": lambda: [next_data.extract_next_data(body) for body in bodies],
+        "parse_stream": lambda: [
+            next_data.extract_next_data_stream(body[i:i + 65536] for i in range(0, len(body), 65536))
+            for body in bodies
+        ],
+        "extract": lambda: [extract_listings(payload) for payload in payloads],
+    }
+    try:
+        import bs4  # noqa: F401
+        steps["parse_bs4"] = lambda: [next_data._bs4_extract(body) for body in bodies]
+    except ImportError:
+        pass
+
+    timings = {}
+    for name, step in steps.items():
+        best = None
+        for _ in range(repeat):
+            start = time.process_time()
+            step()
+            elapsed = time.process_time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = _ms(best / len(bodies))
+    return timings
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(RESULTS_DIR),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    """Print each scenario metric next to the one from an earlier run."""
+    print(f"\nCompared with {old.get('timestamp')} ({old.get('git_commit')}):")
+    sections = [("cpu", old.get("cpu_per_page_ms", {}), new["cpu_per_page_ms"])]
+    sections += [(name, old.get("scenarios", {}).get(name, {}), metrics) for name, metrics in new["scenarios"].items()]
+    for section, before, after in sections:
+        for key, value in after.items():
+            previous = before.get(key)
+            if not isinstance(value, (int, float)) or not isinstance(previous, (int, float)):
+                continue
+            change = f"{(value - previous) / previous:+.1%}" if previous else "n/a"
+            print(f"  {section:15} {key:16} {previous:>10} -> {value:<10} {change}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the scrapers against a local replay server")
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--recording", help="fixture directory (or name under benchmarks/fixtures); synthetic pages if omitted")
+    parser.add_argument("--total-results", type=int, default=600, help="listings in the synthetic result set")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.02, help="random extra latency, up to this many seconds")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with each 429")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="share of pages cut off mid-payload")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--parse-workers", type=int, default=2, help="process pool size for async-pipeline")
+    parser.add_argument("--cpu-repeat", type=int, default=5, help="repetitions of the CPU micro-benchmarks (best is kept)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--out", help=f"result file (default: {RESULTS_DIR}/bench-<timestamp>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="earlier result file to compare against")
+    return parser.parse_args()
+
+
+def main(args):
+    fixture_kwargs = {"recording": args.recording, "total_results": args.total_results, "seed": args.seed}
+    config_kwargs = {
+        "latency": args.latency, "jitter": args.jitter, "throttle_rate": args.throttle_rate,
+        "retry_after": args.retry_after, "truncate_rate": args.truncate_rate, "seed": args.seed,
+    }
+
+    from benchmarks.fixtures import FixtureSet
+
+    bodies = FixtureSet(**fixture_kwargs).bodies()
+    print(f"⏳ CPU micro-benchmarks over {len(bodies)} pages...")
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {**fixture_kwargs, **config_kwargs, "parse_workers": args.parse_workers},
+        "cpu_per_page_ms": measure_cpu(bodies, args.cpu_repeat),
+        "scenarios": {},
+    }
+    del bodies
+
+    with ReplayProcess(fixture_kwargs, config_kwargs) as server:
+        main_sync, main_async = load_scrapers(server.base_url)
+        for scenario in args.scenario:
+            print(f"⏳ {scenario}...")
+            metrics = run_scenario(scenario, main_sync, main_async, server, args)
+            result["scenarios"][scenario] = metrics
+            print(
+                f"  {metrics['pages']} pages, {metrics['listings']} listings in {metrics['wall_s']}s — "
+                f"{metrics['pages_per_s']} pages/s, p50 {metrics['latency_p50_ms']} ms, "
+                f"p99 {metrics['latency_p99_ms']} ms, peak {metrics.get('peak_memory_mb', '-')} MB"
+            )
+    # ru_maxrss is KB on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["max_rss_mb"] = round(maxrss / (1_000_000 if sys.platform == "darwin" else 1000), 1)
+
+    for name, value in result["cpu_per_page_ms"].items():
+        print(f"  CPU {name}: {value} ms/page")
+
+    path = args.out or os.path.join(RESULTS_DIR, f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"✔ Results written to {path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,98 @@
+"""
+Cold-start benchmark: how long importing each entry point (and building the first request
+headers) takes in a fresh interpreter.
+
+    python -m benchmarks.startup_bench
+    python -m benchmarks.startup_bench --compare-rev HEAD~1   # same measurement on an older commit
+
+Each measurement runs in a new process, so nothing is shared with the interpreter running the
+benchmark. --compare-rev extracts that commit with git archive into a temporary directory.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TARGETS = {
+    "main": "import main",
+    "main_asyncio": "import main_asyncio",
+    "jobs": "import jobs",
+    "first_headers": "import requestmask; requestmask.get_random_headers()",
+}
+
+_PROBE = (
+    "import time; _start = time.perf_counter()\n"
+    "{statement}\n"
+    "print(time.perf_counter() - _start)"
+)
+
+
+def measure(directory, statement, runs):
+    """Median seconds for statement in a fresh interpreter started in directory, or None if it fails."""
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(statement=statement)],
+            cwd=directory, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            error = result.stderr.strip().splitlines()
+            print(f"  ⚠ {statement!r} failed: {error[-1] if error else result.returncode}")
+            return None
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+
+def measure_all(directory, runs):
+    return {name: measure(directory, statement, runs) for name, statement in TARGETS.items()}
+
+
+def checkout(rev, directory):
+    """Extract rev's tree into directory."""
+    archive = subprocess.run(["git", "archive", rev], cwd=ROOT, capture_output=True, check=True).stdout
+    subprocess.run(["tar", "-x", "-C", directory], input=archive, check=True)
+    # .env is not in git; the old tree needs it to load settings the same way
+    env = os.path.join(ROOT, ".env")
+    if os.path.exists(env):
+        with open(env, "rb") as src, open(os.path.join(directory, ".env"), "wb") as dst:
+            dst.write(src.read())
+
+
+def _format(seconds):
+    return "  failed" if seconds is None else f"{seconds * 1000:7.0f} ms"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure cold-start import time of the scrapers")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per target (median is reported)")
+    parser.add_argument("--compare-rev", metavar="REV", help="git revision to measure as the baseline")
+    parser.add_argument("--out", help="also write the results to this JSON file")
+    return parser.parse_args()
+
+
+def main(args):
+    results = {"current": measure_all(ROOT, args.runs)}
+    if args.compare_rev:
+        with tempfile.TemporaryDirectory() as directory:
+            checkout(args.compare_rev, directory)
+            results[args.compare_rev] = measure_all(directory, args.runs)
+
+    columns = list(results)
+    print(f"{'target':15}" + "".join(f"{column:>14}" for column in columns))
+    for name in TARGETS:
+        row = "".join(f"{_format(results[column][name]):>14}" for column in columns)
+        if args.compare_rev and results["current"][name] and results[args.compare_rev][name]:
+            row += f"   {results[args.compare_rev][name] / results['current'][name]:.1f}x faster"
+        print(f"{name:15}{row}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"runs": args.runs, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(parse_args())
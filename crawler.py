@@ -0,0 +1,329 @@
+"""
+The async search crawl shared by main_asyncio.py, jobs.py, sharding.py and work_queue.py:
+page fetching with retries and the response cache, page parsing, and crawl_query.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+import httpx
+
+from http_cache import ResponseCache, get_response_cache
+from listing import extract_listings
+from metrics import HttpxTrace, StreamTimer, stage_metrics
+from next_data import (
+    NextDataScanner, extract_next_data, extract_next_data_async, extract_search_meta, extract_stats, is_truncated,
+)
+from rate_limit import (
+    RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, backoff_delay, is_retryable, parse_retry_after, record_outcome,
+)
+from requestmask import build_search_url, build_url, get_random_headers, request_route
+from sinks import ListSink, OrderedPageWriter
+
+# Config
+MAX_PROPERTIES_PER_PAGE = 20
+MAX_PAGES = 100 # adjust as needed based on expected total results and rate limits
+CONCURRENT_REQUESTS = 3  # starting concurrency; the adaptive limiter moves it between 1 and MAX_CONCURRENT_REQUESTS
+MAX_CONCURRENT_REQUESTS = 16
+REQUEST_DELAY = 0  # seconds
+INCREMENTAL_WINDOW = 2  # pages fetched ahead in a --new-only crawl
+
+# Retries and pages given up on during this process
+retry_stats = Counter()
+
+
+async def fetch_properties(query, page, client, semaphore):
+    """
+    Asynchronously fetch property data with concurrency control.
+    429/5xx responses, transport errors (timeouts, resets) and bodies cut off inside the
+    __NEXT_DATA__ payload are retried with jittered exponential backoff, honouring Retry-After;
+    each outcome is fed back to an adaptive semaphore.
+    """
+    search_url = build_search_url(query, page)
+    target_url = build_url(search_url)
+    route = request_route()
+
+    # Serve from the local cache when fresh; a stale entry turns the request into a revalidation
+    cache = get_response_cache()
+    entry = cache.lookup(search_url, query.get("cache_ttl")) if cache else None
+    if entry is not None and entry.fresh:
+        stage_metrics.count("cache_hits")
+        with stage_metrics.time("parse", page, source="cache"):
+            return page, extract_next_data(entry.body)[0]
+
+    for attempt in range(RETRY_ATTEMPTS):
+        retry_after = None
+        # The slot is only held for the request itself, never during the backoff sleep
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                headers = get_random_headers(ResponseCache.conditional_headers(entry))
+                stage_metrics.count("requests")
+                trace = HttpxTrace(stage_metrics, page, via=route)
+                # Stream the body and stop reading once the __NEXT_DATA__ script is complete
+                async with client.stream(
+                    "GET", target_url, headers=headers, timeout=10, extensions={"trace": trace}
+                ) as response:
+                    if entry is not None and response.status_code == 304:
+                        record_outcome(semaphore, time.perf_counter() - start, ok=True)
+                        with stage_metrics.time("parse", page, source="cache"):
+                            return page, extract_next_data(cache.revalidated(entry, response.headers))[0]
+                    if is_retryable(response.status_code):
+                        stage_metrics.count("throttled")
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        record_outcome(semaphore, time.perf_counter() - start, ok=False, retry_after=retry_after)
+                    else:
+                        response.raise_for_status()
+                        scanner = NextDataScanner()
+                        timer = StreamTimer()
+                        body_start = time.perf_counter()
+                        json_data, _ = await extract_next_data_async(timer.wrap_async(response.aiter_bytes()), scanner)
+                        stage_metrics.observe("download", timer.read_seconds, page, via=route)
+                        stage_metrics.observe(
+                            "parse", time.perf_counter() - body_start - timer.read_seconds, page, source="stream"
+                        )
+                        stage_metrics.count("bytes_downloaded", timer.bytes)
+                        if scanner.truncated:
+                            stage_metrics.count("truncated")
+                            record_outcome(semaphore, time.perf_counter() - start, ok=False)
+                        else:
+                            record_outcome(semaphore, time.perf_counter() - start, ok=True)
+                            if cache is not None and json_data:
+                                cache.store(search_url, scanner.buffer, response.headers)
+                            return page, json_data
+            except httpx.TransportError:
+                stage_metrics.count("request_errors")
+                record_outcome(semaphore, time.perf_counter() - start, ok=False)
+            except httpx.HTTPError:
+                return page, None
+            except Exception:
+                return page, None
+
+        if attempt + 1 < RETRY_ATTEMPTS:
+            retry_stats["retries"] += 1
+            stage_metrics.count("retries")
+            await asyncio.sleep(backoff_delay(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY, retry_after))
+    retry_stats["gave_up"] += 1
+    logging.warning(f"Page {page} failed after {RETRY_ATTEMPTS} attempts")
+    return page, None
+
+
+async def fetch_page_bytes(query, page, client, limiter=None):
+    """
+    Download the raw search page body only; the pipeline parses it.
+    Retries like fetch_properties (cut-off bodies included), holding limiter (if given) for each request but not the
+    backoff between them, and reports outcomes to it when it is adaptive.
+    """
+    search_url = build_search_url(query, page)
+    target_url = build_url(search_url)
+    route = request_route()
+
+    cache = get_response_cache()
+    entry = cache.lookup(search_url, query.get("cache_ttl")) if cache else None
+    if entry is not None and entry.fresh:
+        stage_metrics.count("cache_hits")
+        return entry.body
+
+    for attempt in range(RETRY_ATTEMPTS):
+        retry_after = None
+        try:
+            headers = get_random_headers(ResponseCache.conditional_headers(entry))
+            stage_metrics.count("requests")
+            trace = HttpxTrace(stage_metrics, page, via=route)
+            async with limiter if limiter is not None else nullcontext():
+                start = time.perf_counter()
+                response = await client.get(target_url, headers=headers, timeout=10, extensions={"trace": trace})
+            if entry is not None and response.status_code == 304:
+                record_outcome(limiter, time.perf_counter() - start, ok=True)
+                return cache.revalidated(entry, response.headers)
+            if is_retryable(response.status_code):
+                stage_metrics.count("throttled")
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                record_outcome(limiter, time.perf_counter() - start, ok=False, retry_after=retry_after)
+            else:
+                response.raise_for_status()
+                if trace.headers_at is not None:
+                    stage_metrics.observe("download", time.perf_counter() - trace.headers_at, page, via=route)
+                stage_metrics.count("bytes_downloaded", len(response.content))
+                if is_truncated(response.content):
+                    stage_metrics.count("truncated")
+                    record_outcome(limiter, time.perf_counter() - start, ok=False)
+                else:
+                    record_outcome(limiter, time.perf_counter() - start, ok=True)
+                    if cache is not None and b"__NEXT_DATA__" in response.content:
+                        cache.store(search_url, response.content, response.headers)
+                    return response.content
+        except httpx.TransportError:
+            stage_metrics.count("request_errors")
+            record_outcome(limiter, time.perf_counter() - start, ok=False)
+        except Exception:
+            return None
+
+        if attempt + 1 < RETRY_ATTEMPTS:
+            retry_stats["retries"] += 1
+            stage_metrics.count("retries")
+            await asyncio.sleep(backoff_delay(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY, retry_after))
+    retry_stats["gave_up"] += 1
+    logging.warning(f"Page {page} failed after {RETRY_ATTEMPTS} attempts")
+    return None
+
+
+def parse_page_bytes(content, with_meta=False):
+    """
+    Process-pool worker: HTML bytes -> (properties, search meta, extraction path, (parse s, extract s)).
+    Timings are returned because the worker cannot record into the parent's stage_metrics.
+    """
+    if not content:
+        return [], None, None, (0.0, 0.0)
+    start = time.perf_counter()
+    json_data, path = extract_next_data(content)
+    meta = extract_search_meta(json_data) if with_meta else None
+    parsed = time.perf_counter()
+    properties = extract_property_data(json_data)
+    return properties, meta, path, (parsed - start, time.perf_counter() - parsed)
+
+
+def extract_property_data(json_data):
+    """Extract typed Listings from JSON string (formatting for display happens in the sinks)."""
+    return extract_listings(json_data)
+
+
+def plan_last_page(meta, first_page_properties):
+    """Work out the last page to fetch from page 1's searchResult metadata, capped at MAX_PAGES."""
+    if len(first_page_properties) < MAX_PROPERTIES_PER_PAGE:
+        return 1
+    if not meta or not meta["page_count"]:
+        # No usable metadata: fall back to the old upper bound, short pages still stop the crawl
+        return MAX_PAGES
+    return max(1, min(meta["page_count"], MAX_PAGES))
+
+
+async def crawl_query(query, client, semaphore, pbar=None, pipeline=None, sink=None, watermark=None, journal=None):
+    """
+    Fetch page 1, size the crawl from its metadata, then fetch exactly the remaining pages.
+    Tasks past the first short or empty page are cancelled.
+    Pages are written to sink in page order as they complete (only out-of-order pages are held),
+    and the number of properties written is returned; without a sink the properties are
+    returned as a list. With a ParsePipeline, pages are parsed in its process pool.
+    With a Watermark (incremental crawl, newest first) only INCREMENTAL_WINDOW pages are fetched
+    ahead, only listings earlier runs have not returned are written, and the first page with
+    none of them ends the crawl.
+    With a RunJournal, pages it already holds are read from it instead of fetched, and every
+    fetched page is saved to it. The sink's finish_crawl() is told whether the crawl got every
+    page to the end of the result set (not when it failed a page or stopped at MAX_PAGES).
+    """
+    collected = ListSink() if sink is None else None
+    writer = OrderedPageWriter(sink or collected, MAX_PROPERTIES_PER_PAGE)
+    added_count = 0
+    failed_pages = []
+
+    async def load_page(page):
+        """Return (page, properties, search meta for page 1, whether a payload was found)."""
+        if journal is not None and journal.has(page):
+            return (page, *journal.load(page), True)
+        if pipeline is not None:
+            properties, meta, path, (parse_time, extract_time) = await pipeline.process(page)
+            extract_stats[path or "missing"] += 1
+            if path is not None:
+                stage_metrics.observe("parse", parse_time, page, source="pool")
+                stage_metrics.observe("extract", extract_time, page)
+            found = path is not None
+        else:
+            _, json_data = await fetch_properties(query, page, client, semaphore)
+            meta = extract_search_meta(json_data) if page == 1 else None
+            with stage_metrics.time("extract", page):
+                properties = extract_property_data(json_data)
+            found = json_data is not None
+        if journal is not None:
+            if found:
+                journal.record(page, properties, meta)
+            else:
+                journal.fail(page)
+        return page, properties, meta, found
+
+    def record(page, properties, found):
+        """Write a page and return its size for end-of-results detection (0 once nothing is new)."""
+        nonlocal added_count
+        size = raw_size = len(properties)
+        if not found:
+            failed_pages.append(page)
+        if watermark is not None and properties:
+            watermark.observe(properties)
+            properties = watermark.new_listings(properties)
+            size = size if properties else 0
+        writer.add(page, properties, size)
+        added_count += len(properties)
+        if pbar is not None:
+            if properties:
+                status = "added"
+            elif raw_size:
+                status = "caught up"
+            else:
+                status = "empty" if found else "no data"
+            pbar.set_postfix(added=added_count, status=status, window=writer.window)
+            pbar.update(1)
+        return size
+
+    _, first_page, meta, found = await load_page(1)
+    last_page = plan_last_page(meta, first_page)
+    if record(1, first_page, found) < MAX_PROPERTIES_PER_PAGE:
+        last_page = 1
+    await writer.sink.drain()
+    if pbar is not None:
+        pbar.total = last_page
+        pbar.refresh()
+
+    # Lowest page known to end the result set; nothing past it is needed
+    stop_page = last_page
+    # Incremental crawls look only a few pages ahead so a caught-up run stops after one or two requests
+    window = INCREMENTAL_WINDOW if watermark is not None else last_page
+    next_page = 2
+    tasks = {}
+    pending = set()
+
+    def schedule():
+        nonlocal next_page
+        while next_page <= stop_page and len(pending) < window:
+            task = asyncio.ensure_future(load_page(next_page))
+            tasks[task] = next_page
+            pending.add(task)
+            next_page += 1
+
+    try:
+        schedule()
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                page, properties, _, found = task.result()
+                if page > stop_page:
+                    continue
+                if record(page, properties, found) < MAX_PROPERTIES_PER_PAGE:
+                    stop_page = min(stop_page, page)
+            # A sink that writes in the background (EnrichingSink) can hold back new requests here
+            await writer.sink.drain()
+
+            beyond = {task for task in pending if tasks[task] > stop_page}
+            for task in beyond:
+                task.cancel()
+            pending -= beyond
+            if beyond and pbar is not None:
+                pbar.total = max(pbar.n, stop_page)
+                pbar.refresh()
+            schedule()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    complete = not any(page <= stop_page for page in failed_pages)
+    # The end of the results is a short page, or a last page the metadata puts within MAX_PAGES
+    page_count = meta["page_count"] if meta else None
+    reached_end = complete and (writer.last_page is not None or bool(page_count and page_count <= MAX_PAGES))
+    writer.sink.finish_crawl(reached_end)
+    if watermark is not None:
+        watermark.complete = complete
+    if journal is not None:
+        journal.finish_crawl(complete, reached_end)
+    return collected.records if sink is None else writer.written
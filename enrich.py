@@ -0,0 +1,247 @@
+"""
+Detail-page enrichment: full description, every image, amenities and the agent's profile from
+each listing's own page (listing_url), merged into the records on their way to the outputs.
+
+Detail pages are fetched with their own concurrency cap and token bucket, separate from the
+search crawl, and parsed with the same __NEXT_DATA__ extraction. Results are kept in their own
+SQLite cache keyed by listing ID together with a fingerprint of the listing's search-page data;
+a listing whose fingerprint is unchanged and whose entry is younger than DETAIL_CACHE_TTL is
+not fetched again.
+
+The detail payload layout (pageProps.propertyResult.property) is read defensively: missing
+parts leave the corresponding field empty rather than failing the listing.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import Counter, deque
+from dataclasses import replace
+
+import httpx
+
+from metrics import stage_metrics
+from next_data import NextDataScanner, extract_next_data_async
+from rate_limit import (
+    RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, HostRateLimiter, backoff_delay, is_retryable, parse_retry_after,
+    record_outcome,
+)
+from requestmask import build_url, get_random_headers
+from settings import DETAIL_CACHE_PATH, DETAIL_CACHE_TTL
+from sinks import ResultSink
+
+# Config
+DETAIL_CONCURRENCY = 4  # detail pages in flight, on top of the search crawl's own requests
+DETAIL_RATE = 2.0  # detail requests per second
+DETAIL_BURST = 4
+ENRICH_WINDOW_PAGES = 8  # pages waiting for enrichment before the crawl is held back
+
+AGENT_PROFILE_KEYS = (
+    "id", "name", "email", "phone", "whatsapp", "position", "nationality", "languages", "bio",
+    "license_number", "years_of_experience", "image", "is_super_agent", "profile_url",
+)
+_FINGERPRINT_FIELDS = ("listing_url", "price", "title", "description", "listed_date", "image_url", "agent_name")
+
+
+def parse_details(json_data):
+    """Detail fields from a listing page's __NEXT_DATA__ JSON, or None if it holds no property."""
+    if not json_data:
+        return None
+    try:
+        page_props = json.loads(json_data)["props"]["pageProps"]
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return None
+    prop = (page_props.get("propertyResult") or {}).get("property") or page_props.get("property")
+    if not isinstance(prop, dict):
+        return None
+
+    images = []
+    for image in prop.get("images") or ():
+        url = image.get("full") or image.get("large") or image.get("medium") if isinstance(image, dict) else image
+        if url:
+            images.append(url)
+    amenities = [
+        amenity.get("name") if isinstance(amenity, dict) else amenity
+        for amenity in prop.get("amenities") or prop.get("amenity_names") or ()
+    ]
+    agent = prop.get("agent") if isinstance(prop.get("agent"), dict) else {}
+    profile = {key: agent[key] for key in AGENT_PROFILE_KEYS if agent.get(key) is not None}
+    return {
+        "description": prop.get("description"),
+        "images": images,
+        "amenities": [amenity for amenity in amenities if amenity],
+        "agent_profile": profile or None,
+    }
+
+
+def fingerprint(listing):
+    """Hash of the search-page fields that change when a listing is edited."""
+    data = listing.as_dict()
+    payload = json.dumps([data[name] for name in _FINGERPRINT_FIELDS], default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class DetailCache:
+    """Parsed detail fields per listing ID, with the fingerprint they were fetched for."""
+
+    def __init__(self, path=DETAIL_CACHE_PATH, ttl=DETAIL_CACHE_TTL):
+        self.ttl = ttl
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS details (id TEXT PRIMARY KEY, fingerprint TEXT NOT NULL,"
+            " fetched_at REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        self._db.commit()
+
+    def get(self, listing_id, listing_fingerprint):
+        """Cached details if they were fetched for this fingerprint within the TTL, else None."""
+        row = self._db.execute(
+            "SELECT data FROM details WHERE id = ? AND fingerprint = ? AND fetched_at >= ?",
+            (listing_id, listing_fingerprint, time.time() - self.ttl),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, listing_id, listing_fingerprint, details):
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO details (id, fingerprint, fetched_at, data) VALUES (?, ?, ?, ?)",
+                (listing_id, listing_fingerprint, time.time(), json.dumps(details, ensure_ascii=False)),
+            )
+
+    def close(self):
+        self._db.close()
+
+
+async def fetch_detail(url, client, gate):
+    """A detail page's __NEXT_DATA__ JSON, retried on 429/5xx, transport errors and cut-off bodies; None on failure."""
+    target_url = build_url(url)
+    for attempt in range(RETRY_ATTEMPTS):
+        retry_after = None
+        async with gate:
+            start = time.perf_counter()
+            try:
+                stage_metrics.count("detail_requests")
+                async with client.stream("GET", target_url, headers=get_random_headers(), timeout=15) as response:
+                    if is_retryable(response.status_code):
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        record_outcome(gate, time.perf_counter() - start, ok=False, retry_after=retry_after)
+                    else:
+                        response.raise_for_status()
+                        scanner = NextDataScanner()
+                        json_data, _ = await extract_next_data_async(response.aiter_bytes(), scanner)
+                        if scanner.truncated:
+                            record_outcome(gate, time.perf_counter() - start, ok=False)
+                        else:
+                            record_outcome(gate, time.perf_counter() - start, ok=True)
+                            stage_metrics.observe("detail", time.perf_counter() - start)
+                            return json_data
+            except httpx.TransportError:
+                record_outcome(gate, time.perf_counter() - start, ok=False)
+            except httpx.HTTPError:
+                return None
+        if attempt + 1 < RETRY_ATTEMPTS:
+            await asyncio.sleep(backoff_delay(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY, retry_after))
+    return None
+
+
+class Enricher:
+    """Adds detail-page fields to Listings, from the cache when the listing is unchanged."""
+
+    def __init__(self, client, concurrency=DETAIL_CONCURRENCY, rate=DETAIL_RATE, burst=DETAIL_BURST, cache=None):
+        self.client = client
+        self.limiter = HostRateLimiter(rate, burst, concurrency)
+        self.cache = cache or DetailCache()
+        self.stats = Counter()
+
+    async def enrich(self, listings):
+        return await asyncio.gather(*(self._enrich_one(listing) for listing in listings))
+
+    async def _enrich_one(self, listing):
+        if not listing.listing_url or not listing.id:
+            return listing
+        key = fingerprint(listing)
+        details = self.cache.get(listing.id, key)
+        if details is not None:
+            self.stats["cached"] += 1
+        else:
+            details = parse_details(await fetch_detail(listing.listing_url, self.client, self.limiter.gate(listing.listing_url)))
+            if details is None:
+                self.stats["failed"] += 1
+                return listing
+            self.cache.put(listing.id, key, details)
+            self.stats["fetched"] += 1
+        return replace(
+            listing,
+            description=details["description"] or listing.description,
+            images=details["images"],
+            amenities=details["amenities"],
+            agent_profile=details["agent_profile"],
+        )
+
+    def format_stats(self):
+        return (f"Detail pages: {self.stats['fetched']} fetched, {self.stats['cached']} from cache, "
+                f"{self.stats['failed']} failed")
+
+    def close(self):
+        self.cache.close()
+
+
+class EnrichingSink(ResultSink):
+    """
+    Passes pages to sink after enriching them. write() only schedules the work, so the search
+    crawl goes on while detail pages are fetched, until more than window pages are waiting:
+    then drain() holds the crawl back until the oldest of them is written. Pages reach sink in
+    the order they were written. Use as an async context manager: leaving it waits for the
+    remaining pages (or cancels them on an error). It does not close sink.
+    """
+
+    def __init__(self, sink, enricher, window=ENRICH_WINDOW_PAGES):
+        super().__init__()
+        self.sink = sink
+        self.name = sink.name
+        self.enricher = enricher
+        self.window = window
+        self._tasks = deque()  # one per page not yet collected by drain(), oldest first
+
+    def write(self, records):
+        if records:
+            previous = self._tasks[-1] if self._tasks else None
+            self._tasks.append(asyncio.ensure_future(self._enrich_and_write(list(records), previous)))
+            self.count += len(records)
+
+    async def _enrich_and_write(self, records, previous):
+        enriched = await self.enricher.enrich(records)
+        if previous is not None:
+            await previous  # keep page order; an earlier failure propagates from here
+        self.sink.write(enriched)
+
+    async def drain(self):
+        # Pages finish in order, so finished ones are always at the front; a failed page raises here
+        while self._tasks and (self._tasks[0].done() or len(self._tasks) > self.window):
+            await self._tasks.popleft()
+
+    def finish_crawl(self, reached_end):
+        super().finish_crawl(reached_end)
+        self.sink.finish_crawl(reached_end)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, *exc):
+        try:
+            if exc_type is not None:
+                for task in self._tasks:
+                    task.cancel()
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            elif self._tasks:
+                await self._tasks[-1]
+        finally:
+            self.enricher.close()
+
+    def summary(self):
+        return self.sink.summary()
@@ -0,0 +1,360 @@
+"""
+In-memory spatial index over listing coordinates: radius, bounding-box and nearest-neighbour
+queries and per-cell price aggregates, vectorized with NumPy.
+
+    python geo_index.py near 25.0800 55.1400 --km 2
+    python geo_index.py nearest 25.0800 55.1400 -k 10 --category 2
+    python geo_index.py bbox 25.05 55.10 25.12 55.20
+    python geo_index.py cells --cell-km 0.5 --min-count 10 --location Dubai
+    python geo_index.py near 25.08 55.14 --km 1 --ndjson listings.ndjson
+    python geo_index.py nearest 25.08 55.14 --index dubai.npz      # saved by --output geo:dubai.npz
+
+Points sit in a grid of square cells (cell_km on a side, measured in latitude degrees) and are
+kept ordered by cell code, so a query only reads the cells its area overlaps: one binary search
+per row of cells, then an exact haversine or box test on the candidates. add() appends a page at
+a time. Merging new points into the order rewrites the ordered arrays, so it waits until
+GEO_MERGE_ROWS of them have piled up; until then queries test the new points' cells directly.
+GeoIndexSink feeds a crawl's pages into an index as they are written (--output geo:<path> saves
+it when the crawl ends). Longitude ranges are not wrapped across the antimeridian.
+"""
+import argparse
+import json
+import math
+import sys
+
+from listing_store import ListingStore
+from settings import LISTING_STORE_PATH
+from sinks import ResultSink
+
+# Config
+GEO_CELL_KM = 1.0  # grid cell size; queries read every cell their area touches
+GEO_MERGE_ROWS = 50_000  # points added before they are merged into the cell order (scanned by every query until then)
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_KM / 360
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("The spatial index needs numpy: pip install numpy") from None
+    return numpy
+
+
+class GeoIndex:
+    """Listing IDs, coordinates and prices in growable NumPy arrays with a grid-cell order."""
+
+    def __init__(self, cell_km=GEO_CELL_KM, capacity=1024):
+        np = self._np = _numpy()
+        self.cell_km = cell_km
+        self._cell_deg = cell_km / KM_PER_DEGREE
+        self._columns = math.ceil(360 / self._cell_deg) + 1
+        self._size = 0
+        self._ids = np.empty(capacity, dtype=object)
+        self._lat = np.empty(capacity)
+        self._lon = np.empty(capacity)
+        self._price = np.empty(capacity)
+        self._codes = np.empty(capacity, dtype=np.int64)
+        self._order = np.empty(0, dtype=np.int64)  # row numbers sorted by cell code
+        self._sorted = np.empty(0, dtype=np.int64)  # their cell codes
+        self._indexed = 0  # rows already merged into _order
+
+    def __len__(self):
+        return self._size
+
+    def add(self, listings):
+        """Add Listings (or dicts) that have coordinates; returns how many were added. Call once per page."""
+        ids, lat, lon, price = [], [], [], []
+        for listing in listings:
+            if isinstance(listing, dict):
+                values = listing.get("id"), listing.get("lat"), listing.get("lon"), listing.get("price")
+            else:
+                values = listing.id, listing.lat, listing.lon, listing.price
+            if values[1] is None or values[2] is None:
+                continue
+            ids.append(values[0])
+            lat.append(values[1])
+            lon.append(values[2])
+            price.append(math.nan if values[3] is None else values[3])
+        return self.add_arrays(ids, lat, lon, price)
+
+    def add_arrays(self, ids, lat, lon, price=None):
+        np = self._np
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        count = len(lat)
+        if not count:
+            return 0
+        end = self._size + count
+        if end > len(self._lat):
+            self._grow(max(end, 2 * len(self._lat)))
+        self._ids[self._size:end] = ids
+        self._lat[self._size:end] = lat
+        self._lon[self._size:end] = lon
+        self._price[self._size:end] = math.nan if price is None else np.asarray(price, dtype=float)
+        self._codes[self._size:end] = self._cell_codes(lat, lon, self._cell_deg, self._columns)
+        self._size = end
+        return count
+
+    def save(self, path):
+        """Write the points to an .npz file that load_npz() reads back."""
+        np = self._np
+        size = self._size
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f, id=np.asarray(["" if value is None else str(value) for value in self._ids[:size]], dtype=str),
+                lat=self._lat[:size], lon=self._lon[:size], price=self._price[:size],
+            )
+
+    def _grow(self, capacity):
+        for name in ("_ids", "_lat", "_lon", "_price", "_codes"):
+            old = getattr(self, name)
+            new = self._np.empty(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def _cell_codes(self, lat, lon, cell_deg, columns):
+        np = self._np
+        rows = np.floor((np.clip(lat, -90, 90) + 90) / cell_deg).astype(np.int64)
+        cols = np.floor((np.clip(lon, -180, 180) + 180) / cell_deg).astype(np.int64)
+        return rows * columns + cols
+
+    def _merge_pending(self):
+        """Sort rows added since the last merge and merge them into the cell order."""
+        np = self._np
+        if self._indexed == self._size:
+            return
+        rows = np.arange(self._indexed, self._size)
+        codes = self._codes[self._indexed:self._size]
+        by_code = np.argsort(codes, kind="stable")
+        rows, codes = rows[by_code], codes[by_code]
+        positions = np.searchsorted(self._sorted, codes, side="right")
+        self._sorted = np.insert(self._sorted, positions, codes)
+        self._order = np.insert(self._order, positions, rows)
+        self._indexed = self._size
+
+    def _candidates(self, south, west, north, east):
+        """Row numbers of every point in the cells overlapping the box."""
+        np = self._np
+        if self._size - self._indexed >= GEO_MERGE_ROWS:
+            self._merge_pending()
+        first_row, last_row = (int((min(max(lat, -90), 90) + 90) // self._cell_deg) for lat in (south, north))
+        first_col, last_col = (int((min(max(lon, -180), 180) + 180) // self._cell_deg) for lon in (west, east))
+        row_codes = np.arange(first_row, last_row + 1, dtype=np.int64) * self._columns
+        starts = np.searchsorted(self._sorted, row_codes + first_col, side="left")
+        ends = np.searchsorted(self._sorted, row_codes + last_col, side="right")
+        parts = [self._order[start:end] for start, end in zip(starts, ends)]
+        if self._indexed < self._size:
+            # Points not merged yet: test their cells one by one
+            rows, cols = np.divmod(self._codes[self._indexed:self._size], self._columns)
+            inside = (rows >= first_row) & (rows <= last_row) & (cols >= first_col) & (cols <= last_col)
+            parts.append(np.flatnonzero(inside) + self._indexed)
+        return np.concatenate(parts or [np.empty(0, np.int64)])
+
+    def _distances(self, rows, lat, lon):
+        """Haversine distance in km from (lat, lon) to each row."""
+        np = self._np
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        lat2, lon2 = np.radians(self._lat[rows]), np.radians(self._lon[rows])
+        a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def _result(self, rows, distances=None):
+        result = {"id": self._ids[rows], "lat": self._lat[rows], "lon": self._lon[rows], "price": self._price[rows]}
+        if distances is not None:
+            result["distance_km"] = distances
+        return result
+
+    def within(self, lat, lon, km):
+        """Points within km of (lat, lon), nearest first, as a dict of arrays (id, lat, lon, price, distance_km)."""
+        np = self._np
+        lat_span = km / KM_PER_DEGREE
+        cos_lat = math.cos(math.radians(min(abs(lat) + lat_span, 90)))
+        lon_span = km / (KM_PER_DEGREE * cos_lat) if cos_lat > 1e-9 else 360
+        rows = self._candidates(lat - lat_span, lon - lon_span, lat + lat_span, lon + lon_span)
+        distances = self._distances(rows, lat, lon)
+        keep = distances <= km
+        rows, distances = rows[keep], distances[keep]
+        by_distance = np.argsort(distances, kind="stable")
+        return self._result(rows[by_distance], distances[by_distance])
+
+    def bbox(self, south, west, north, east):
+        """Points inside the box, as a dict of arrays (id, lat, lon, price)."""
+        rows = self._candidates(south, west, north, east)
+        lat, lon = self._lat[rows], self._lon[rows]
+        return self._result(rows[(lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)])
+
+    def nearest(self, lat, lon, k=10):
+        """The k points nearest (lat, lon), nearest first; the search radius doubles until k are inside it."""
+        km = self.cell_km
+        while True:
+            result = self.within(lat, lon, km)
+            if len(result["id"]) >= k or len(result["id"]) == self._size or km > math.pi * EARTH_RADIUS_KM:
+                return {name: values[:k] for name, values in result.items()}
+            km *= 2
+
+    def cell_stats(self, cell_km=None, min_count=1):
+        """
+        Price statistics per grid cell (cell_km on a side, default the index's) over points with a
+        price: cell centre lat/lon, count, median and mean price, as a dict of arrays by count, largest first.
+        """
+        np = self._np
+        cell_deg = (cell_km or self.cell_km) / KM_PER_DEGREE
+        columns = math.ceil(360 / cell_deg) + 1
+        priced = ~np.isnan(self._price[:self._size])
+        prices = self._price[:self._size][priced]
+        codes = self._cell_codes(self._lat[:self._size][priced], self._lon[:self._size][priced], cell_deg, columns)
+        by_cell = np.lexsort((prices, codes))
+        prices, codes = prices[by_cell], codes[by_cell]
+        cells, starts, counts = np.unique(codes, return_index=True, return_counts=True)
+        if not len(cells):
+            empty = np.empty(0)
+            return {"lat": empty, "lon": empty, "count": empty.astype(np.int64), "median_price": empty, "mean_price": empty}
+        # Prices are sorted within each cell, so the median is the middle element (or the middle two)
+        median = (prices[starts + (counts - 1) // 2] + prices[starts + counts // 2]) / 2
+        mean = np.add.reduceat(prices, starts) / counts
+        keep = counts >= min_count
+        cells, counts, median, mean = cells[keep], counts[keep], median[keep], mean[keep]
+        largest = np.argsort(-counts, kind="stable")
+        return {
+            "lat": (cells[largest] // columns + 0.5) * cell_deg - 90,
+            "lon": (cells[largest] % columns + 0.5) * cell_deg - 180,
+            "count": counts[largest],
+            "median_price": median[largest],
+            "mean_price": mean[largest],
+        }
+
+
+class GeoIndexSink(ResultSink):
+    """
+    Adds each page a crawl writes to a GeoIndex (a new one, or index); query it through .index.
+    With a path (--output geo:<path>), closing the sink saves the index there for load_npz().
+    """
+
+    kind = "geo"
+
+    def __init__(self, index=None, cell_km=GEO_CELL_KM, path=None):
+        super().__init__()
+        self.name = path or "geo index"
+        self.path = path
+        self.index = GeoIndex(cell_km) if index is None else index
+
+    def _write(self, records):
+        self.index.add(records)
+
+    def _close(self):
+        if self.path:
+            self.index.save(self.path)
+
+    def summary(self):
+        return f"{super().summary()} ({len(self.index)} with coordinates)"
+
+
+def load_store(path=LISTING_STORE_PATH, cell_km=GEO_CELL_KM, chunk_rows=50_000, **filters):
+    """A GeoIndex of the listing store's active listings that have coordinates."""
+    index = GeoIndex(cell_km)
+    with ListingStore(path) as store:
+        cursor = store.located_listings(**filters)
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                return index
+            ids, lat, lon, price = zip(*rows)
+            index.add_arrays(ids, lat, lon, [math.nan if value is None else value for value in price])
+
+
+def load_ndjson(path, cell_km=GEO_CELL_KM, chunk_rows=50_000):
+    """A GeoIndex of the listings in an NDJSON output file."""
+    index = GeoIndex(cell_km)
+    with open(path, encoding="utf-8") as f:
+        chunk = []
+        for line in f:
+            chunk.append(json.loads(line))
+            if len(chunk) >= chunk_rows:
+                index.add(chunk)
+                chunk = []
+        index.add(chunk)
+    return index
+
+
+def load_npz(path, cell_km=GEO_CELL_KM):
+    """A GeoIndex of the points a GeoIndex.save() (or an --output geo:<path> crawl) wrote."""
+    index = GeoIndex(cell_km)
+    with _numpy().load(path, allow_pickle=False) as data:
+        index.add_arrays([value or None for value in data["id"].tolist()], data["lat"], data["lon"], data["price"])
+    return index
+
+
+def _print_columns(result, fmt):
+    names = list(result)
+    # Missing prices are NaN in the arrays
+    rows = ([None if value != value else value for value in row] for row in zip(*(v.tolist() for v in result.values())))
+    if fmt == "ndjson":
+        for row in rows:
+            print(json.dumps(dict(zip(names, row)), ensure_ascii=False))
+        return
+    separator = "," if fmt == "csv" else "\t"
+    print(separator.join(names))
+    count = 0
+    for row in rows:
+        print(separator.join("" if value is None else f"{value:.6g}" if isinstance(value, float) else str(value)
+                             for value in row))
+        count += 1
+    if fmt == "table":
+        print(f"({count} rows)", file=sys.stderr)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Radius, box and nearest-listing queries over listing coordinates")
+    parser.add_argument("--db", default=LISTING_STORE_PATH, help=f"listing store to index (default: {LISTING_STORE_PATH})")
+    parser.add_argument("--ndjson", metavar="PATH", help="index an NDJSON output file instead of the store (the filters apply to the store only)")
+    parser.add_argument("--index", metavar="PATH", help="query an index saved by --output geo:<path> instead of the store")
+    parser.add_argument("--cell-km", type=float, default=GEO_CELL_KM, help=f"grid cell size (default: {GEO_CELL_KM})")
+    parser.add_argument("--country")
+    parser.add_argument("--location", help="location name substring")
+    parser.add_argument("--category", type=int)
+    parser.add_argument("--min-price", type=float)
+    parser.add_argument("--max-price", type=float)
+    parser.add_argument("--format", choices=("table", "csv", "ndjson"), default="table")
+    commands = parser.add_subparsers(dest="command", required=True)
+    near = commands.add_parser("near", help="listings within a radius, nearest first")
+    near.add_argument("lat", type=float)
+    near.add_argument("lon", type=float)
+    near.add_argument("--km", type=float, default=1.0)
+    nearest = commands.add_parser("nearest", help="the k nearest listings")
+    nearest.add_argument("lat", type=float)
+    nearest.add_argument("lon", type=float)
+    nearest.add_argument("-k", type=int, default=10)
+    bbox = commands.add_parser("bbox", help="listings inside a box")
+    for name in ("south", "west", "north", "east"):
+        bbox.add_argument(name, type=float)
+    commands.add_parser("cells", help="listing count and median/mean price per grid cell").add_argument(
+        "--min-count", type=int, default=1, help="skip cells with fewer priced listings"
+    )
+    return parser.parse_args()
+
+
+def main(args):
+    if args.index:
+        index = load_npz(args.index, args.cell_km)
+    elif args.ndjson:
+        index = load_ndjson(args.ndjson, args.cell_km)
+    else:
+        filters = {"country": args.country, "location": args.location, "category": args.category,
+                   "min_price": args.min_price, "max_price": args.max_price}
+        index = load_store(args.db, args.cell_km, **filters)
+    print(f"Indexed {len(index)} listings with coordinates", file=sys.stderr)
+
+    if args.command == "near":
+        result = index.within(args.lat, args.lon, args.km)
+    elif args.command == "nearest":
+        result = index.nearest(args.lat, args.lon, args.k)
+    elif args.command == "bbox":
+        result = index.bbox(args.south, args.west, args.north, args.east)
+    else:
+        result = index.cell_stats(min_count=args.min_count)
+    _print_columns(result, args.format)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -1,31 +1,510 @@
-import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from settings import GOOGLE_SHEET_ID
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from metrics import stage_metrics
+from rate_limit import backoff_delay, parse_retry_after
+from settings import (
+    GOOGLE_SHEET_ID, SHEET_INCREMENTAL, SHEET_INDEX_DIR, SHEET_REMOVE_DELISTED, SHEET_REQUESTS_PER_MINUTE,
+    SHEET_MAX_CELLS, SHEET_RETRY_ATTEMPTS, SHEET_TAB_MAX_CELLS,
+)
+
+UPLOAD_BATCH_ROWS = 500  # rows per write request (sheet uploads and GoogleSheetSink)
+UPLOAD_QUEUE_BATCHES = 8  # batches waiting for the upload thread before put() blocks
+GRID_GROW_ROWS = 2000  # rows added to a tab's grid at a time; unused ones are trimmed at the end
+RETRY_BASE_DELAY = 1.0  # seconds, doubled per attempt with full jitter
+RETRY_MAX_DELAY = 64
+
+
+# pandas, gspread and oauth2client are imported inside the functions that use them, so importing
+# this module (and the scrapers) stays fast until an upload actually happens.
 
 
 def _get_client():
     """Authenticate and return a gspread client."""
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
     scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
     creds = ServiceAccountCredentials.from_json_keyfile_name("credentials.json", scope)
     return gspread.authorize(creds)
 
 
-def upload_data_to_sheet(data, sheet_name: str):
+def open_worksheet(sheet_name: str, rows: int = 1000, cols: int = 26, clear: bool = False):
     """
-    upload data (list of dicts) to a specified sheet (tab) in the Google Sheet.
+    Return the named worksheet (tab), creating it with the given size if it does not exist.
     """
-    df = pd.DataFrame(data)
+    import gspread
+
     client = _get_client()
     spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
 
     try:
         worksheet = spreadsheet.worksheet(sheet_name)
-        worksheet.clear()
+        if clear:
+            worksheet.clear()
     except gspread.exceptions.WorksheetNotFound:
-        worksheet = spreadsheet.add_worksheet(title=sheet_name, rows=str(len(df)), cols=str(len(df.columns)))
+        worksheet = spreadsheet.add_worksheet(title=sheet_name, rows=str(max(rows, 1)), cols=str(cols))
+    return worksheet
+
+
+class SheetApi:
+    """
+    Sheets API calls paced to SHEET_REQUESTS_PER_MINUTE and retried on 429/5xx and connection errors
+    with jittered backoff (honouring Retry-After). Calls and retries are counted into stats.
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats if stats is not None else {"calls": 0, "retries": 0}
+        self._next_call = 0.0
+
+    def call(self, fn, *args, idempotent=True, **kwargs):
+        """
+        One API call. A call that is not idempotent (deleting rows or tabs) is only retried on 429,
+        since a 5xx or timeout may arrive after Sheets has applied it.
+        """
+        import requests
+        from gspread.exceptions import APIError
+
+        for attempt in range(SHEET_RETRY_ATTEMPTS):
+            now = time.monotonic()
+            if self._next_call > now:
+                time.sleep(self._next_call - now)
+            self._next_call = max(now, self._next_call) + 60 / SHEET_REQUESTS_PER_MINUTE
+            self.stats["calls"] += 1
+            stage_metrics.count("sheet_api_calls")
+            retry_after = None
+            try:
+                return fn(*args, **kwargs)
+            except APIError as e:
+                status = getattr(e.response, "status_code", None)
+                retryable = status == 429 or (idempotent and status is not None and status >= 500)
+                if not retryable or attempt + 1 == SHEET_RETRY_ATTEMPTS:
+                    raise
+                retry_after = parse_retry_after(e.response.headers.get("Retry-After"))
+            except (requests.ConnectionError, requests.Timeout):
+                if not idempotent or attempt + 1 == SHEET_RETRY_ATTEMPTS:
+                    raise
+            self.stats["retries"] += 1
+            stage_metrics.count("sheet_retries")
+            time.sleep(backoff_delay(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY, retry_after))
+
+
+class SheetUploader:
+    """
+    Appends rows to a tab from a background thread in batches of batch_rows, so uploading overlaps
+    the crawl instead of following it. Every API call goes through a SheetApi (quota pacing, retries). Rows
+    are written to explicit row numbers in a grid sized ahead of them, so a retried write that had
+    in fact gone through overwrites the same rows instead of duplicating them. Once a tab would pass
+    max_cells, rows continue in "<tab> (2)", "<tab> (3)"... Every tab shares the spreadsheet's
+    SHEET_MAX_CELLS, so the grid is only grown while the whole spreadsheet stays under it; an upload
+    that does not fit fails with an error before the call that would pass it (at the start when
+    expected_rows is known).
+
+    With clear=True rows go to "<tab> (staging)" tabs, and the tab is only replaced by them when
+    close() succeeds: the old tab and its overflow tabs are deleted and the staging tabs renamed in
+    their place (so the tab gets a new gid). abort(), or an upload error, deletes the staging tabs
+    and leaves the old content as it was. While uploading, both copies count towards the cell limit.
+    clear=False appends below the rows already in the tab, writing the header only into an empty one.
+
+    put() only blocks when UPLOAD_QUEUE_BATCHES batches are already waiting. close() sends the rest,
+    waits for the thread and re-raises the first error it hit.
+    """
+
+    def __init__(self, sheet_name, header, batch_rows=UPLOAD_BATCH_ROWS, clear=True, max_cells=SHEET_TAB_MAX_CELLS,
+                 expected_rows=None):
+        self.sheet_name = sheet_name
+        self.header = header
+        self.batch_rows = batch_rows
+        self.clear = clear
+        self.expected_rows = expected_rows
+        self.max_rows = max(2, max_cells // max(1, len(header)))
+        self.stats = {"mode": "upload", "rows": 0, "calls": 0, "retries": 0, "tabs": 0, "seconds": 0.0}
+        self.error = None
+        self._aborted = False
+        self._pending = []
+        self._spreadsheet = None
+        self._worksheet = None
+        self._written_tabs = []  # worksheets written so far, in tab order
+        self._tab_rows = 0  # rows written to the current tab, header included
+        self._grid_rows = 0  # the current tab's grid size
+        self._grid_cols = 0
+        self._sheet_cells = 0  # grid cells of every tab in the spreadsheet
+        self._api = SheetApi(self.stats)
+        self._call = self._api.call
+        self._started = time.perf_counter()
+        self._queue = queue.Queue(maxsize=UPLOAD_QUEUE_BATCHES)
+        self._thread = threading.Thread(target=self._run, name=f"sheet-upload-{sheet_name}", daemon=True)
+        self._thread.start()
+
+    def put(self, rows):
+        """Queue rows (lists in header order); full batches go to the upload thread."""
+        if self.error is not None:
+            raise self.error
+        self._pending.extend(rows)
+        while len(self._pending) >= self.batch_rows:
+            self._queue.put(self._pending[:self.batch_rows])
+            del self._pending[:self.batch_rows]
+
+    def close(self):
+        """Upload the remaining rows and, with clear=True, swap the staging tabs in."""
+        if self._pending:
+            self._queue.put(self._pending)
+            self._pending = []
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            if self.error is None and self._spreadsheet is not None:
+                try:
+                    self._finish_tab()
+                    if self.clear:
+                        self._swap_in()
+                except Exception as e:
+                    self.error = e
+            if self.error is not None:
+                if self.clear:
+                    self._drop_staging()
+                raise self.error
+        finally:
+            self.stats["seconds"] = time.perf_counter() - self._started
+
+    def abort(self):
+        """Stop uploading; with clear=True the staging tabs are deleted and the tab keeps its old rows."""
+        self._aborted = True
+        self._pending = []
+        self._queue.put(None)
+        self._thread.join()
+        self.stats["seconds"] = time.perf_counter() - self._started
+        if self.clear:
+            self._drop_staging()
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            # After an error or abort() keep draining so put() never blocks; close() reports errors
+            if self.error is None and not self._aborted:
+                try:
+                    self._append(batch)
+                except Exception as e:
+                    self.error = e
+
+    def _append(self, rows):
+        while rows:
+            if self._worksheet is None:
+                self._open_tab()
+            room = self.max_rows - self._tab_rows
+            if room <= 0:
+                self._finish_tab()
+                self._worksheet = None
+                continue
+            part, rows = rows[:room], rows[room:]
+            end = self._tab_rows + len(part)
+            if end > self._grid_rows:
+                # Grow ahead of the rows, but never past the spreadsheet's cell limit
+                free_rows = self._grid_rows + (SHEET_MAX_CELLS - self._sheet_cells) // self._grid_cols
+                self._resize(rows=max(end, min(self.max_rows, self._grid_rows + GRID_GROW_ROWS, free_rows)))
+            self._call(self._worksheet.update, values=part, range_name=f"A{self._tab_rows + 1}")
+            self._tab_rows = end
+            self.stats["rows"] += len(part)
+
+    def _finish_tab(self):
+        """Trim the grid rows sized ahead but not used, which would count towards the cell limit."""
+        if self._worksheet is not None and self._grid_rows > self._tab_rows:
+            self._resize(rows=self._tab_rows)
+
+    def _resize(self, rows=None, cols=None):
+        """
+        Resize the current tab's grid, failing instead if the spreadsheet would pass SHEET_MAX_CELLS.
+        resize() sets an absolute size, so it is as safe to retry as the writes.
+        """
+        rows = rows or self._grid_rows
+        cols = cols or self._grid_cols
+        cells = self._sheet_cells + rows * cols - self._grid_rows * self._grid_cols
+        if cells > SHEET_MAX_CELLS:
+            raise RuntimeError(
+                f"Sheet upload stopped: '{self._worksheet.title}' would need {rows} rows, which takes the "
+                f"spreadsheet past its {SHEET_MAX_CELLS:,} cell limit after {self.stats['rows']} rows. "
+                f"Delete unused tabs or upload to another spreadsheet."
+            )
+        self._call(self._worksheet.resize, rows=rows, cols=cols)
+        self._sheet_cells = cells
+        self._grid_rows, self._grid_cols = rows, cols
+
+    def _tab_title(self, number, staging=False):
+        """Title of the tab's number-th part: "<tab>", "<tab> (2)"... or "<tab> (staging)", "<tab> (staging 2)"..."""
+        if staging:
+            return f"{self.sheet_name} (staging)" if number == 1 else f"{self.sheet_name} (staging {number})"
+        return self.sheet_name if number == 1 else f"{self.sheet_name} ({number})"
+
+    def _is_own_tab(self, title, staging=False):
+        """One of the tab's parts (see _tab_title)."""
+        prefix = f"{self.sheet_name} ({'staging' if staging else ''}"
+        if not staging and title == self.sheet_name:
+            return True
+        if not (title.startswith(prefix) and title.endswith(")")):
+            return False
+        number = title[len(prefix):-1].strip()
+        return number.isdigit() or (staging and number == "")
+
+    def _open_spreadsheet(self):
+        """Open the spreadsheet, delete staging tabs an interrupted run left behind and count the cells in use."""
+        self._spreadsheet = self._call(_get_client().open_by_key, GOOGLE_SHEET_ID)
+        tabs = self._call(self._spreadsheet.worksheets)
+        for worksheet in [tab for tab in tabs if self._is_own_tab(tab.title, staging=True)]:
+            self._call(self._spreadsheet.del_worksheet, worksheet, idempotent=False)
+            tabs.remove(worksheet)
+        self._sheet_cells = sum(tab.row_count * tab.col_count for tab in tabs)
+        if self.expected_rows is not None:
+            # Appending reuses the tab's own grid; a replacement is staged next to the old copy
+            used = sum(tab.row_count * tab.col_count for tab in tabs if self.clear or not self._is_own_tab(tab.title))
+            needed = (self.expected_rows + 1) * len(self.header)
+            if used + needed > SHEET_MAX_CELLS:
+                raise RuntimeError(
+                    f"Sheet upload of {self.expected_rows} rows needs {needed:,} cells, but the spreadsheet already "
+                    f"uses {used:,} of its {SHEET_MAX_CELLS:,} (a replaced tab is kept until the upload finishes). "
+                    f"Delete unused tabs or upload to another spreadsheet."
+                )
+
+    def _swap_in(self):
+        """Replace the tab and its overflow tabs with the staging tabs just written."""
+        for tab in self._call(self._spreadsheet.worksheets):
+            if self._is_own_tab(tab.title):
+                self._call(self._spreadsheet.del_worksheet, tab, idempotent=False)
+        for number, worksheet in enumerate(self._written_tabs, start=1):
+            self._call(worksheet.update_title, self._tab_title(number))
+
+    def _drop_staging(self):
+        """Best-effort removal of the staging tabs after a failed or aborted upload."""
+        for worksheet in self._written_tabs:
+            try:
+                self._call(self._spreadsheet.del_worksheet, worksheet, idempotent=False)
+            except Exception as e:
+                logging.warning(f"Could not delete staging tab '{worksheet.title}': {e}")
+        self._written_tabs = []
+
+    def _open_tab(self):
+        import gspread
+
+        if self._spreadsheet is None:
+            self._open_spreadsheet()
+        self.stats["tabs"] += 1
+        title = self._tab_title(self.stats["tabs"], staging=self.clear)
+        try:
+            # Staging tabs never exist here: _open_spreadsheet deleted any left over
+            worksheet = self._call(self._spreadsheet.worksheet, title)
+            used = len(self._call(worksheet.col_values, 1))
+        except gspread.exceptions.WorksheetNotFound:
+            # One row to start with; the grid is what counts towards the cell limit, so it grows with the rows
+            if self._sheet_cells + len(self.header) > SHEET_MAX_CELLS:
+                raise RuntimeError(
+                    f"Sheet upload stopped: no room for tab '{title}' within the spreadsheet's "
+                    f"{SHEET_MAX_CELLS:,} cell limit after {self.stats['rows']} rows."
+                ) from None
+            worksheet = self._call(self._spreadsheet.add_worksheet, title=title, rows="1", cols=str(len(self.header)))
+            self._sheet_cells += len(self.header)
+            used = 0
+        self._worksheet = worksheet
+        self._written_tabs.append(worksheet)
+        self._grid_rows, self._grid_cols = worksheet.row_count, worksheet.col_count
+        if self._grid_cols < len(self.header):
+            self._resize(cols=len(self.header))
+        if used == 0:
+            self._call(worksheet.update, values=[self.header], range_name="A1")
+            used = 1
+        self._tab_rows = used
+
+
+def _header_and_rows(data):
+    """Column order (first appearance of each key) and the records as rows in that order."""
+    header = list(dict.fromkeys(key for record in data for key in record))
+    return header, [["" if record.get(key) is None else record.get(key) for key in header] for record in data]
+
+
+def upload_data_to_sheet(data, sheet_name: str):
+    """
+    Replace a sheet (tab) with data (list of dicts), appended in batches by a SheetUploader.
+    Returns the uploader's stats.
+    """
+    header, rows = _header_and_rows(data)
+    uploader = SheetUploader(sheet_name, header, expected_rows=len(rows))
+    uploader.put(rows)
+    uploader.close()
+    return uploader.stats
+
+
+def _row_hash(row):
+    return hashlib.blake2b(json.dumps(row, default=str).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _index_path(sheet_name):
+    return os.path.join(SHEET_INDEX_DIR, f"{GOOGLE_SHEET_ID}_{sheet_name}.json")
+
+
+def _load_index(sheet_name):
+    """Content hashes of the rows last written to sheet_name, keyed by listing ID."""
+    try:
+        with open(_index_path(sheet_name), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"header": None, "hashes": {}}
+
+
+def _save_index(sheet_name, header, hashes):
+    os.makedirs(SHEET_INDEX_DIR, exist_ok=True)
+    tmp = _index_path(sheet_name) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"header": header, "hashes": hashes}, f)
+    os.replace(tmp, _index_path(sheet_name))
+
+
+def _contiguous(numbers):
+    """Group sorted ints into (first, last) runs."""
+    runs = []
+    for n in numbers:
+        if runs and n == runs[-1][1] + 1:
+            runs[-1][1] = n
+        else:
+            runs.append([n, n])
+    return runs
+
+
+def sync_data_to_sheet(data, sheet_name: str, remove_delisted: bool = False):
+    """
+    Incrementally sync data (list of dicts) into a sheet (tab) instead of clearing and rewriting it.
+
+    Rows are matched by listing "ID" (read from the sheet's ID column, so row positions are always
+    current) and compared against the content hashes stored locally from the previous sync. Only
+    changed rows are rewritten, in one batched request; new listings are appended and, with
+    remove_delisted, rows whose ID is no longer in data are deleted. API calls go through a
+    SheetApi, so throttling is retried rather than aborting the sync half way; new rows are written
+    at explicit row numbers so a retry cannot duplicate them.
+    Falls back to upload_data_to_sheet when the tab is missing or its header has changed.
+    Returns a dict with the cells written and what a full rewrite would have written.
+    """
+    import gspread
+    from gspread.utils import rowcol_to_a1
+
+    header, all_rows = _header_and_rows(data)
+    full_cells = (len(data) + 1) * len(header)
+    rows = {}
+    for record, row in zip(data, all_rows):
+        rows.setdefault(str(record.get("ID")), row)
+
+    api = SheetApi()
+    spreadsheet = api.call(_get_client().open_by_key, GOOGLE_SHEET_ID)
+    index = _load_index(sheet_name)
+    try:
+        worksheet = api.call(spreadsheet.worksheet, sheet_name)
+        sheet_header = api.call(worksheet.row_values, 1)
+    except gspread.exceptions.WorksheetNotFound:
+        sheet_header = None
+
+    if sheet_header != header or index["header"] != header or "ID" not in header:
+        upload_stats = upload_data_to_sheet(data, sheet_name)
+        _save_index(sheet_name, header, {listing_id: _row_hash(row) for listing_id, row in rows.items()})
+        return {"mode": "full", "cells_written": full_cells, "full_rewrite_cells": full_cells,
+                "updated": 0, "appended": len(rows), "removed": 0,
+                "calls": api.stats["calls"] + upload_stats["calls"],
+                "retries": api.stats["retries"] + upload_stats["retries"]}
+
+    # Current row number of every listing in the sheet (row 1 is the header)
+    sheet_ids = api.call(worksheet.col_values, header.index("ID") + 1)[1:]
+    row_of = {}
+    for number, listing_id in enumerate(sheet_ids, start=2):
+        row_of.setdefault(listing_id, number)
+
+    hashes = index["hashes"]
+    new_hashes = {}
+    changed = []
+    appended = []
+    for listing_id, row in rows.items():
+        digest = _row_hash(row)
+        new_hashes[listing_id] = digest
+        if listing_id not in row_of:
+            appended.append(row)
+        elif hashes.get(listing_id) != digest:
+            changed.append((row_of[listing_id], row))
+
+    last_col = len(header)
+    if changed:
+        # Merge adjacent changed rows into one range each to keep the request small
+        changed.sort()
+        by_row = dict(changed)
+        api.call(worksheet.batch_update, [
+            {"range": f"{rowcol_to_a1(first, 1)}:{rowcol_to_a1(last, last_col)}",
+             "values": [by_row[n] for n in range(first, last + 1)]}
+            for first, last in _contiguous(sorted(by_row))
+        ])
+
+    removed = 0
+    if remove_delisted:
+        stale_rows = sorted(n for listing_id, n in row_of.items() if listing_id not in rows)
+        runs = _contiguous(stale_rows)
+        if runs:
+            # Delete bottom-up in a single request so earlier row numbers stay valid. Deleting is
+            # not idempotent (a repeat would remove other rows), so it is only retried on 429
+            api.call(spreadsheet.batch_update, {"requests": [
+                {"deleteDimension": {"range": {
+                    "sheetId": worksheet.id, "dimension": "ROWS", "startIndex": first - 1, "endIndex": last,
+                }}}
+                for first, last in reversed(runs)
+            ]}, idempotent=False)
+            removed = len(stale_rows)
+    else:
+        # Keep hashes of rows that are still in the sheet so they are not rewritten next time
+        for listing_id in row_of:
+            if listing_id not in new_hashes and listing_id in hashes:
+                new_hashes[listing_id] = hashes[listing_id]
+
+    if appended:
+        # Below the last listing row, growing the grid first if it is too short
+        first = len(sheet_ids) + 2 - removed
+        last = first + len(appended) - 1
+        if last > worksheet.row_count - removed:
+            api.call(worksheet.resize, rows=last)
+        api.call(worksheet.update, values=appended, range_name=rowcol_to_a1(first, 1))
+
+    _save_index(sheet_name, header, new_hashes)
+    return {"mode": "delta", "cells_written": (len(changed) + len(appended)) * last_col,
+            "full_rewrite_cells": full_cells, "updated": len(changed), "appended": len(appended),
+            "removed": removed, **api.stats}
+
+
+def upload_to_sheet(data, sheet_name: str):
+    """Upload using the mode configured in settings; returns the sync or upload stats."""
+    if SHEET_INCREMENTAL:
+        return sync_data_to_sheet(data, sheet_name, remove_delisted=SHEET_REMOVE_DELISTED)
+    return upload_data_to_sheet(data, sheet_name)
+
+
+def format_upload_stats(stats):
+    """One-line summary of a SheetUploader's stats."""
+    rate = stats["rows"] / stats["seconds"] if stats["seconds"] else 0
+    line = (
+        f"{stats['rows']} rows in {stats['seconds']:.1f}s ({rate:.0f} rows/s), "
+        f"{stats['calls']} API calls ({stats['retries']} retried)"
+    )
+    if stats["tabs"] > 1:
+        line += f", split over {stats['tabs']} tabs"
+    return line
+
 
-    worksheet.update([df.columns.values.tolist()] + df.fillna("").values.tolist())
+def format_sync_stats(stats):
+    """One-line summary of a sync_data_to_sheet (or upload_data_to_sheet) result."""
+    if stats["mode"] == "upload":
+        return format_upload_stats(stats)
+    saved = 1 - stats["cells_written"] / stats["full_rewrite_cells"] if stats["full_rewrite_cells"] else 0
+    return (
+        f"{stats['mode']} sync: {stats['updated']} updated, {stats['appended']} appended, "
+        f"{stats['removed']} removed — {stats['cells_written']} cells written vs "
+        f"{stats['full_rewrite_cells']} for a full rewrite ({saved:.0%} saved), "
+        f"{stats['calls']} API calls ({stats['retries']} retried)"
+    )
 
 # def append_data_to_sheet(data, sheet_name: str):
 #     """
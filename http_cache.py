@@ -0,0 +1,181 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from settings import CACHE_ENABLED, CACHE_MAX_BYTES, CACHE_PATH, CACHE_TTL
+
+
+def normalize_url(url: str) -> str:
+    """Cache key for a search URL: lower-case scheme/host, sorted query, no fragment."""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", query, ""))
+
+
+class CacheEntry:
+    __slots__ = ("url", "body", "etag", "last_modified", "stored_at", "fresh")
+
+    def __init__(self, url, body, etag, last_modified, stored_at, fresh):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at
+        self.fresh = fresh
+
+
+class ResponseCache:
+    """
+    On-disk cache of search page bodies, keyed by the normalized propertyfinder URL
+    (the one build_search_url returns, never the ScraperAPI-wrapped one).
+
+    Bodies are zlib-compressed in a single SQLite file, so the sync and async scrapers
+    (and several processes) can share it. Entries younger than their TTL are served
+    without a request; older ones are revalidated with If-None-Match / If-Modified-Since.
+    The least recently used entries are evicted once the compressed total exceeds max_bytes.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES, default_ttl=CACHE_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " url TEXT PRIMARY KEY, body BLOB NOT NULL, raw_size INTEGER NOT NULL, size INTEGER NOT NULL,"
+            " etag TEXT, last_modified TEXT, stored_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+        self._db.commit()
+        self._total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def lookup(self, url, ttl=None):
+        """Return a CacheEntry for url (fresh or stale), or None on a miss."""
+        key = normalize_url(url)
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            row = self._db.execute(
+                "SELECT body, raw_size, etag, last_modified, stored_at FROM responses WHERE url = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            body, raw_size, etag, last_modified, stored_at = row
+            fresh = time.time() - stored_at < ttl
+            if fresh:
+                self._db.execute("UPDATE responses SET last_access = ? WHERE url = ?", (time.time(), key))
+                self._db.commit()
+                self.stats["hits"] += 1
+                self.stats["bytes_saved"] += raw_size
+            else:
+                self.stats["stale"] += 1
+        return CacheEntry(key, zlib.decompress(body), etag, last_modified, stored_at, fresh)
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Request headers that turn a fetch of a stale entry into a revalidation."""
+        headers = {}
+        if entry is None or entry.fresh:
+            return headers
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        if headers:
+            # Override the default no-cache so the origin may answer 304
+            headers["Cache-Control"] = "max-age=0"
+        return headers
+
+    def revalidated(self, entry, response_headers=None):
+        """Record a 304 for entry and return its cached body."""
+        now = time.time()
+        etag = _header(response_headers, "ETag") or entry.etag
+        last_modified = _header(response_headers, "Last-Modified") or entry.last_modified
+        with self._lock:
+            self._db.execute(
+                "UPDATE responses SET stored_at = ?, last_access = ?, etag = ?, last_modified = ? WHERE url = ?",
+                (now, now, etag, last_modified, entry.url),
+            )
+            self._db.commit()
+            self.stats["revalidated"] += 1
+            self.stats["bytes_saved"] += len(entry.body)
+        return entry.body
+
+    def store(self, url, body, response_headers=None):
+        """Compress and store a response body, then evict LRU entries over max_bytes."""
+        if not body:
+            return
+        key = normalize_url(url)
+        compressed = zlib.compress(bytes(body), 6)
+        now = time.time()
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE url = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses"
+                " (url, body, raw_size, size, etag, last_modified, stored_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, compressed, len(body), len(compressed),
+                 _header(response_headers, "ETag"), _header(response_headers, "Last-Modified"), now, now),
+            )
+            self._total += len(compressed) - (old[0] if old else 0)
+            self.stats["stored"] += 1
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        while self._total > self.max_bytes:
+            rows = self._db.execute(
+                "SELECT url, size FROM responses ORDER BY last_access LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._total = 0
+                return
+            for url, size in rows:
+                self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self._total -= size
+                self.stats["evicted"] += 1
+                if self._total <= self.max_bytes:
+                    return
+
+    def format_stats(self):
+        """One-line hit/miss/bytes-saved summary for the end-of-run report."""
+        s = self.stats
+        # A stale entry that came back with 200 instead of 304 counts as a miss
+        misses = s["misses"] + s["stale"] - s["revalidated"]
+        return (
+            f"{s['hits']} hits, {s['revalidated']} revalidated, {misses} misses, "
+            f"{s['bytes_saved'] / 1_000_000:.1f} MB saved, {self._total / 1_000_000:.1f} MB on disk"
+        )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _header(headers, name):
+    if not headers:
+        return None
+    return headers.get(name)
+
+
+_cache = None
+
+
+def get_response_cache():
+    """Process-wide shared cache, or None when caching is disabled in settings."""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = ResponseCache()
+    return _cache
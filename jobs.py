@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import time
+import httpx
+from tqdm import tqdm
+from google_sheet import format_sync_stats, upload_to_sheet
+from listing import to_display_rows
+from listing_store import ListingStore
+from crawler import crawl_query
+from metrics import add_metrics_args, export_metrics, stage_metrics
+from rate_limit import AdaptiveLimiter, HostRateLimiter
+from requestmask import build_search_url
+from sharding import format_coverage, plan_shards, run_shards
+from settings import LISTING_STORE_PATH
+from search_options import CATEGORIES, COUNTRIES, DEFAULT_QUERY, FURNISHING, LOCATIONS
+from sinks import ListSink
+
+# Config
+HOST_RATE = 2.0  # requests per second per propertyfinder domain
+HOST_BURST = 4
+GLOBAL_CONCURRENCY = 8  # requests in flight across all queries
+
+QUERY_KEYS = ("country", "location", "category", "furnishing", "rental_period", "sort_by")
+
+logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def expand_spec(spec):
+    """
+    Expand one job spec into concrete queries (cartesian product of every list-valued key).
+    "country": "all" means every country and "location": "all" every known location of that country.
+    Other keys (e.g. "sheet", "cache_ttl") are copied onto each query.
+    """
+    spec = {**DEFAULT_QUERY, **spec}
+    countries = list(COUNTRIES) if spec.get("country") == "all" else _as_list(spec["country"])
+    extras = {key: value for key, value in spec.items() if key not in QUERY_KEYS}
+
+    queries = []
+    for country in countries:
+        if country not in COUNTRIES:
+            raise ValueError(f"Unknown country code: {country!r}")
+        if spec.get("location") == "all":
+            # Id 0 marks cities whose propertyfinder id is not known yet
+            locations = [location for location in LOCATIONS[country] if location]
+        else:
+            locations = _as_list(spec["location"])
+        for location, category, furnishing, rental_period, sort_by in itertools.product(
+            locations, *(_as_list(spec[key]) for key in QUERY_KEYS[2:])
+        ):
+            queries.append({
+                "country": country, "location": location, "category": category, "furnishing": furnishing,
+                "rental_period": rental_period, "sort_by": sort_by, **extras,
+            })
+    return queries
+
+
+def load_job_file(path):
+    """Read a JSON file holding one spec or a list of specs and return the expanded queries."""
+    with open(path, encoding="utf-8") as f:
+        specs = json.load(f)
+    return [query for spec in _as_list(specs) for query in expand_spec(spec)]
+
+
+def describe_query(query):
+    locations = LOCATIONS.get(query["country"], {})
+    return (
+        f"{query['country']}/{locations.get(query['location'], query['location'])}/"
+        f"{CATEGORIES.get(query['category'], query['category'])}/{FURNISHING.get(query['furnishing'], query['furnishing'])}"
+    )
+
+
+async def run_jobs(queries, rate=HOST_RATE, burst=HOST_BURST, concurrency=GLOBAL_CONCURRENCY, shard=False):
+    """
+    Crawl all queries concurrently on one shared AsyncClient.
+    Each propertyfinder domain gets its own token bucket; all requests share one adaptive
+    concurrency limit that never exceeds the cap.
+    With shard, queries over the page cap are split into shards (see sharding.py) and come back
+    flagged "sharded".
+    Returns [(query, properties, reached_end)] in the order the queries were given; reached_end
+    says the crawl got every page to the end of the result set.
+    """
+    adaptive = AdaptiveLimiter(initial=min(3, concurrency), max_limit=concurrency)
+    limiter = HostRateLimiter(rate, burst, concurrency, semaphore=adaptive)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits) as client:
+        with tqdm(total=len(queries), desc="Jobs", unit="query", dynamic_ncols=True) as pbar:
+            async def run(query):
+                gate = limiter.gate(build_search_url(query, 1))
+                reached_end = False
+                try:
+                    if shard:
+                        plan = await plan_shards(query, client, gate)
+                        unique = await run_shards(plan, client, gate)
+                        properties = unique.sink.records
+                        query = {**query, "sharded": True}
+                        tqdm.write(f"  {describe_query(query)}: {len(plan.shards)} shards, {format_coverage(plan, unique)}")
+                    else:
+                        collected = ListSink()
+                        await crawl_query(query, client, gate, sink=collected)
+                        properties, reached_end = collected.records, collected.reached_end
+                except Exception as e:
+                    logging.warning(f"Job {describe_query(query)} failed: {e}")
+                    properties = []
+                pbar.update(1)
+                tqdm.write(f"  {describe_query(query)}: {len(properties)} properties")
+                return query, properties, reached_end
+
+            results = await asyncio.gather(*(run(query) for query in queries))
+    tqdm.write(f"  {adaptive.format_stats()}")
+    return results
+
+
+def route_results(results):
+    """Group results by destination tab (the query's "sheet", else its country), de-duplicated by ID."""
+    tabs = {}
+    for query, properties, _ in results:
+        tab = tabs.setdefault(query.get("sheet") or query["country"], {})
+        for listing in properties:
+            tab.setdefault(listing.id, listing)
+    return {name: list(by_id.values()) for name, by_id in tabs.items()}
+
+
+def add_query_args(parser):
+    """The --spec/--country/... options that select queries (see queries_from_args)."""
+    parser.add_argument("--spec", help="JSON file with one job spec or a list of them")
+    parser.add_argument("--country", nargs="+", help="country codes, or 'all'")
+    parser.add_argument("--location", nargs="+", help="location ids, or 'all' for every known location")
+    parser.add_argument("--category", nargs="+", type=int, default=[DEFAULT_QUERY["category"]])
+    parser.add_argument("--furnishing", nargs="+", type=int, default=[DEFAULT_QUERY["furnishing"]])
+    parser.add_argument("--rental-period", nargs="+", default=[DEFAULT_QUERY["rental_period"]])
+    parser.add_argument("--sort-by", nargs="+", default=[DEFAULT_QUERY["sort_by"]])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run many Property Finder searches in one non-interactive batch",
+        epilog='Spec file example: [{"country": "ae", "location": "all", "category": [1, 2]}]',
+    )
+    add_query_args(parser)
+    parser.add_argument("--rate", type=float, default=HOST_RATE, help="requests per second per domain")
+    parser.add_argument("--burst", type=int, default=HOST_BURST)
+    parser.add_argument("--concurrency", type=int, default=GLOBAL_CONCURRENCY, help="global in-flight request cap")
+    parser.add_argument("--no-upload", action="store_true", help="crawl only, skip the Google Sheets upload")
+    parser.add_argument(
+        "--store", nargs="?", const=LISTING_STORE_PATH, metavar="PATH",
+        help=f"also record every query as a run in the listing store (default path: {LISTING_STORE_PATH})"
+    )
+    parser.add_argument(
+        "--shard", action="store_true",
+        help="split queries with more results than the page cap into price/bedroom shards"
+    )
+    parser.add_argument("--list", action="store_true", help="print the expanded queries and exit")
+    add_metrics_args(parser)
+    args = parser.parse_args()
+    if not args.spec and not args.country:
+        parser.error("give --spec FILE or --country")
+    return args
+
+
+def queries_from_args(args):
+    if args.spec:
+        return load_job_file(args.spec)
+    country = "all" if args.country == ["all"] else args.country
+    location = "all" if not args.location or args.location == ["all"] else [int(v) for v in args.location]
+    return expand_spec({
+        "country": country, "location": location, "category": args.category, "furnishing": args.furnishing,
+        "rental_period": args.rental_period, "sort_by": args.sort_by,
+    })
+
+
+def upload_tabs(tabs):
+    """Upload each tab's listings to the sheet (incremental when enabled in settings)."""
+    for tab, rows in tabs.items():
+        if not rows:
+            print(f"⚠ {tab}: no properties found, nothing to upload.")
+            continue
+        print(f"⏳ Uploading {len(rows)} properties to tab '{tab}'...")
+        upload_start = time.time()
+        with stage_metrics.time("upload", sink="sheet"):
+            sync_stats = upload_to_sheet(to_display_rows(rows), tab)
+        print(f"✔ Upload complete in {time.time() - upload_start:.1f}s")
+        if sync_stats:
+            print(f"  {format_sync_stats(sync_stats)}")
+
+
+def main(args):
+    queries = queries_from_args(args)
+    if args.list:
+        for query in queries:
+            print(describe_query(query))
+        print(f"{len(queries)} queries")
+        return
+
+    if args.trace:
+        stage_metrics.enable_trace()
+    start_time = time.time()
+    results = asyncio.run(run_jobs(queries, args.rate, args.burst, args.concurrency, args.shard))
+    tabs = route_results(results)
+
+    elapsed = time.time() - start_time
+    mins, secs = divmod(int(elapsed), 60)
+    total = sum(len(rows) for rows in tabs.values())
+    print(f"\n✔ {len(queries)} queries complete — {total} unique properties in {len(tabs)} tabs in {mins}m {secs}s")
+
+    if args.store:
+        with ListingStore(args.store) as store:
+            for query, properties, reached_end in results:
+                store.record(query, properties, reached_end)
+        print(f"✔ {len(results)} runs recorded in {args.store}")
+    if not args.no_upload:
+        upload_tabs(tabs)
+    for line in stage_metrics.format_summary():
+        print(f"  {line}")
+    export_metrics(args)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,254 @@
+"""
+Run journal: every page a crawl completes is saved to disk as it arrives, so an interrupted run
+(proxy outage, Ctrl-C, failed upload) can be resumed without fetching those pages again.
+
+    python main_asyncio.py --resume          # latest run that did not finish uploading
+    python main.py --resume 20261018-101500-ae-1-1
+    python journal.py list
+    python journal.py upload 20261018-101500-ae-1-1 --output sheet   # retry only the upload
+
+Each run is a directory under JOURNAL_DIR holding one NDJSON file per completed page and a
+manifest.json (query, outputs, pages done, page 1's search metadata, crawl/upload state).
+Page files and the manifest are written to a temporary file and renamed, so a crash never leaves
+a half-written one. Failed pages are not journaled and are fetched again on resume.
+"""
+import argparse
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from listing import listing_from_dict
+from listing_store import PAGE_SIZE
+from settings import JOURNAL_DIR, JOURNAL_KEEP_RUNS
+from sinks import open_sinks
+
+
+def _write_atomic(path, text):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+class RunJournal:
+    """The on-disk record of one run. Safe to record pages from several threads."""
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.run_id = os.path.basename(path)
+        self.manifest = manifest
+        self.resumed = len(manifest["pages"])  # pages already done when the journal was opened
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, query, outputs, root=JOURNAL_DIR):
+        run_id = f"{datetime.now():%Y%m%d-%H%M%S}-{query['country']}-{query['location']}-{query['category']}"
+        path = os.path.join(root, run_id)
+        os.makedirs(path, exist_ok=True)
+        journal = cls(path, {
+            "query": query, "outputs": outputs, "created_at": _now(), "updated_at": _now(),
+            "pages": {}, "failed": [], "meta": None, "crawl_complete": False, "uploaded": False,
+        })
+        journal._save()
+        _prune(root, keep=JOURNAL_KEEP_RUNS, current=run_id)
+        return journal
+
+    @classmethod
+    def open(cls, run_id=None, root=JOURNAL_DIR):
+        """A run by id, or the latest one that has not finished uploading; None if there is none."""
+        if run_id is None:
+            unfinished = [run for run in list_runs(root) if not run[1]["uploaded"]]
+            if not unfinished:
+                return None
+            run_id = unfinished[-1][0]
+        path = os.path.join(root, run_id)
+        try:
+            with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+                return cls(path, json.load(f))
+        except FileNotFoundError:
+            return None
+
+    @property
+    def query(self):
+        return self.manifest["query"]
+
+    def has(self, page):
+        return str(page) in self.manifest["pages"]
+
+    def load(self, page):
+        """(Listings, search meta for page 1) of a journaled page."""
+        with open(self._page_path(page), encoding="utf-8") as f:
+            listings = [listing_from_dict(json.loads(line)) for line in f]
+        return listings, self.manifest["meta"] if page == 1 else None
+
+    def record(self, page, listings, meta=None):
+        """Save a completed page (page 1 with its search metadata)."""
+        _write_atomic(
+            self._page_path(page),
+            "".join(json.dumps(listing.as_dict(), ensure_ascii=False) + "\n" for listing in listings),
+        )
+        with self._lock:
+            self.manifest["pages"][str(page)] = len(listings)
+            if page in self.manifest["failed"]:
+                self.manifest["failed"].remove(page)
+            if page == 1:
+                self.manifest["meta"] = meta
+            self._save()
+
+    def fail(self, page):
+        with self._lock:
+            if page not in self.manifest["failed"]:
+                self.manifest["failed"].append(page)
+                self._save()
+
+    def finish_crawl(self, complete, reached_end=False):
+        """
+        complete: the crawl stopped without a failed page. reached_end: it also got to the end of
+        the result set rather than stopping at MAX_PAGES (see ResultSink.finish_crawl).
+        """
+        with self._lock:
+            self.manifest["crawl_complete"] = complete
+            self.manifest["reached_end"] = reached_end
+            self._save()
+
+    def finish_upload(self):
+        with self._lock:
+            self.manifest["uploaded"] = True
+            self._save()
+
+    def pages(self):
+        """(page, Listings) for every journaled page up to the first short one, in page order."""
+        page = 1
+        while self.has(page):
+            listings, _ = self.load(page)
+            yield page, listings
+            if len(listings) < PAGE_SIZE:
+                return
+            page += 1
+
+    def _page_path(self, page):
+        return os.path.join(self.path, f"page-{page:04d}.ndjson")
+
+    def _save(self):
+        self.manifest["updated_at"] = _now()
+        _write_atomic(os.path.join(self.path, "manifest.json"), json.dumps(self.manifest, indent=1))
+
+
+def list_runs(root=JOURNAL_DIR):
+    """[(run id, manifest)] oldest first."""
+    runs = []
+    if not os.path.isdir(root):
+        return runs
+    for run_id in sorted(os.listdir(root)):
+        try:
+            with open(os.path.join(root, run_id, "manifest.json"), encoding="utf-8") as f:
+                runs.append((run_id, json.load(f)))
+        except (OSError, ValueError):
+            continue
+    return runs
+
+
+def _prune(root, keep, current):
+    """Delete the oldest uploaded runs beyond keep; unfinished runs are kept until resumed."""
+    finished = [run_id for run_id, manifest in list_runs(root) if manifest["uploaded"] and run_id != current]
+    for run_id in finished[:max(0, len(finished) - keep)]:
+        shutil.rmtree(os.path.join(root, run_id), ignore_errors=True)
+
+
+def add_resume_args(parser):
+    parser.add_argument(
+        "--resume", nargs="?", const="", metavar="RUN",
+        help="continue an interrupted run (default: the latest one not uploaded), fetching only the "
+             "pages it is missing; see python journal.py list"
+    )
+
+
+def open_run(args, input_query):
+    """
+    The journal and query for a scraper run: the resumed run's with --resume, else a new
+    journal for the query input_query() returns. Returns (None, None) if there is nothing to resume.
+    """
+    if args.resume is None:
+        query = input_query()
+        return RunJournal.create(query, args.output or ["sheet"]), query
+    journal = RunJournal.open(args.resume or None)
+    if journal is None:
+        return None, None
+    args.output = args.output or journal.manifest["outputs"]
+    return journal, journal.query
+
+
+@contextmanager
+def resumable(journal):
+    """
+    Wrap a run's crawl and output flush: the run is marked uploaded when the block succeeds and
+    the crawl finished without a failed page, otherwise the way to resume it is printed (so
+    --resume finds it and its failed pages are fetched again). A None journal does nothing.
+    """
+    if journal is None:
+        yield
+        return
+    try:
+        yield
+    except (Exception, KeyboardInterrupt):
+        print(f"\n⚠ Run {journal.run_id} stopped; its saved pages are kept. Continue with --resume {journal.run_id}")
+        raise
+    if journal.manifest["crawl_complete"]:
+        journal.finish_upload()
+    else:
+        print(f"\n⚠ Run {journal.run_id} has failed pages; its saved pages are kept. Continue with --resume {journal.run_id}")
+
+
+def upload_run(journal, outputs):
+    """Write a run's journaled pages to outputs again, without fetching anything."""
+    with open_sinks(outputs, journal.query["country"], journal.query) as sink:
+        for _, listings in journal.pages():
+            sink.write(listings)
+        sink.finish_crawl(journal.manifest.get("reached_end", False))
+    # A crawl with failed pages stays open for --resume
+    if journal.manifest["crawl_complete"]:
+        journal.finish_upload()
+    return sink
+
+
+def _describe(manifest):
+    query = manifest["query"]
+    state = "uploaded" if manifest["uploaded"] else "crawled" if manifest["crawl_complete"] else "interrupted"
+    failed = f", {len(manifest['failed'])} failed" if manifest["failed"] else ""
+    return (f"{query['country']}/{query['location']}/{query['category']} — {len(manifest['pages'])} pages"
+            f"{failed}, {state}, outputs {', '.join(manifest['outputs'])}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Inspect run journals and retry uploads")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="journaled runs, oldest first")
+    upload = commands.add_parser("upload", help="write a run's journaled pages to its outputs again")
+    upload.add_argument("run_id")
+    upload.add_argument("--output", action="append", metavar="TARGET", help="outputs (default: the run's own)")
+    return parser.parse_args()
+
+
+def main(args):
+    if args.command == "list":
+        for run_id, manifest in list_runs():
+            print(f"  {run_id}: {_describe(manifest)}")
+        return
+    journal = RunJournal.open(args.run_id)
+    if journal is None:
+        raise SystemExit(f"No journaled run {args.run_id!r}")
+    if not journal.manifest["crawl_complete"]:
+        print("⚠ The crawl did not finish; uploading the pages it got. Resume it with --resume to fetch the rest.")
+    sink = upload_run(journal, args.output or journal.manifest["outputs"])
+    print(f"✔ Upload complete — {sink.summary()}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
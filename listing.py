@@ -0,0 +1,180 @@
+import json
+from dataclasses import dataclass, fields
+from datetime import datetime
+from typing import Optional
+
+DESCRIPTION_PREVIEW = 150  # characters of description shown in the sheet
+
+
+@dataclass(slots=True)
+class Listing:
+    """One search result with typed values; display strings are only built by to_display_row()."""
+
+    id: Optional[str]
+    title: Optional[str]
+    property_type: Optional[str]
+    price: Optional[float]
+    currency: Optional[str]
+    price_period: Optional[str]
+    bedrooms: Optional[str]
+    bathrooms: Optional[str]
+    size: Optional[float]
+    size_unit: Optional[str]
+    furnished: Optional[str]
+    listed_date: Optional[datetime]
+    rera: Optional[str]
+    location: Optional[str]
+    lat: Optional[float]
+    lon: Optional[float]
+    listing_url: Optional[str]
+    image_url: Optional[str]
+    agent_name: Optional[str]
+    agent_email: Optional[str]
+    super_agent: Optional[bool]
+    broker_name: Optional[str]
+    broker_email: Optional[str]
+    broker_phone: Optional[str]
+    description: Optional[str]
+    # Only filled in by the detail-page enrichment stage (enrich.py)
+    images: Optional[list] = None
+    amenities: Optional[list] = None
+    agent_profile: Optional[dict] = None
+
+    def as_dict(self):
+        """Typed values keyed by field name, dates as ISO strings (for NDJSON, SQLite, CSV...)."""
+        data = {name: getattr(self, name) for name in LISTING_FIELDS}
+        if self.listed_date is not None:
+            data["listed_date"] = _format_date(self.listed_date)
+        return data
+
+
+LISTING_FIELDS = tuple(field.name for field in fields(Listing))
+ENRICHMENT_FIELDS = ("images", "amenities", "agent_profile")  # lists/dicts; files store them as JSON text
+
+
+def listing_from_dict(data):
+    """Rebuild a Listing from Listing.as_dict() output (e.g. read back from JSON)."""
+    values = {name: data.get(name) for name in LISTING_FIELDS}
+    values["listed_date"] = _parse_date(values["listed_date"])
+    return Listing(**values)
+
+def _number(value):
+    """Keep ints and floats as they are, parse numeric strings, anything else becomes None."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+
+def _format_date(value):
+    return value.isoformat().replace("+00:00", "Z")
+
+
+def extract_listings(json_data):
+    """
+    Parse a page's __NEXT_DATA__ JSON and build its Listings in one pass.
+    Listings without a price are skipped, as they always have been.
+    """
+    if not json_data:
+        return []
+
+    try:
+        properties = json.loads(json_data)['props']['pageProps']['searchResult']['properties']
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return []
+
+    listings = []
+    append = listings.append
+    empty = {}
+    for prop in properties:
+        try:
+            price = prop["price"]
+            size = prop.get("size") or empty
+            location = prop.get("location") or empty
+            coordinates = location.get("coordinates") or empty
+            images = prop.get("images") or (empty,)
+            agent = prop.get("agent") or empty
+            broker = prop.get("broker") or empty
+            listed_date = prop.get("listed_date")
+            append(Listing(
+                prop.get("id"),
+                prop.get("title"),
+                prop.get("property_type"),
+                _number(price["value"]),
+                price.get("currency"),
+                price.get("period"),
+                prop.get("bedrooms"),
+                prop.get("bathrooms"),
+                _number(size.get("value")),
+                size.get("unit"),
+                prop.get("furnished"),
+                _parse_date(listed_date) if isinstance(listed_date, str) else None,
+                prop.get("rera"),
+                location.get("full_name"),
+                _number(coordinates.get("lat")),
+                _number(coordinates.get("lon")),
+                prop.get("share_url"),
+                images[0].get("medium"),
+                agent.get("name"),
+                agent.get("email"),
+                agent.get("is_super_agent"),
+                broker.get("name"),
+                broker.get("email"),
+                broker.get("phone"),
+                prop.get("description"),
+            ))
+        except (KeyError, TypeError, AttributeError):
+            pass
+    return listings
+
+
+def _description_preview(description):
+    flat = ', '.join(line.strip('- ').strip() for line in (description or '').splitlines()).strip()
+    return flat[:DESCRIPTION_PREVIEW] + ('...' if description and len(description) > DESCRIPTION_PREVIEW else '')
+
+
+def to_display_row(listing):
+    """The sheet's formatted columns for one listing (same strings the scraper has always produced)."""
+    return {
+        "ID": listing.id,
+        "Title": listing.title,
+        "Property Type": listing.property_type,
+        "Price": f"{listing.price} {listing.currency} / {listing.price_period}",
+        "Bedrooms": listing.bedrooms,
+        "Bathrooms": listing.bathrooms,
+        "Size": f"{listing.size} {listing.size_unit}" if listing.size is not None else None,
+        "Furnished": listing.furnished,
+        "Listed Date": _format_date(listing.listed_date) if listing.listed_date else None,
+        "RERA ID": listing.rera,
+        "Location": listing.location,
+        "Map Link": f"https://www.google.com/maps?q={listing.lat},{listing.lon}",
+        "Listing URL": listing.listing_url,
+        "Image URL": listing.image_url,
+        "Agent Name": listing.agent_name,
+        "Agent Email": listing.agent_email,
+        "Super Agent": listing.super_agent,
+        "Broker Name": listing.broker_name,
+        "Broker Email": listing.broker_email,
+        "Broker Phone": listing.broker_phone,
+        "Description": _description_preview(listing.description),
+    }
+
+
+def to_display_rows(listings):
+    return [to_display_row(listing) for listing in listings]
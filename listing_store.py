@@ -0,0 +1,367 @@
+"""
+Persistent listing store with price history across runs.
+
+    python listing_store.py runs
+    python listing_store.py new --since-run 12 --location Dubai
+    python listing_store.py changed --days 7 --location Dubai --category 2 --drops
+    python listing_store.py removed --since 2026-10-01 --format csv > removed.csv
+
+Every crawl is a run. Listings are upserted by ID one page per transaction, and a history row is
+written only when something happens to a listing: it is new, its price changed, it disappeared
+from a completed crawl of its query, or it came back. Queries stream rows from the cursor, so
+result sets of any size are never loaded into memory.
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta, timezone
+
+from listing import ENRICHMENT_FIELDS, LISTING_FIELDS
+from settings import LISTING_STORE_PATH
+
+PAGE_SIZE = 20  # listings per search page; a shorter last page means the crawl reached the end
+
+_TYPES = {"price": "REAL", "size": "REAL", "lat": "REAL", "lon": "REAL", "super_agent": "INTEGER"}
+# Detail-page fields are not tracked across runs
+_FIELDS = tuple(name for name in LISTING_FIELDS if name != "id" and name not in ENRICHMENT_FIELDS)
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    query_key TEXT NOT NULL,
+    query TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    complete INTEGER,
+    listings INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS listings (
+    id TEXT PRIMARY KEY,
+    {", ".join(f"{name} {_TYPES.get(name, 'TEXT')}" for name in _FIELDS)},
+    country TEXT,
+    location_id INTEGER,
+    category INTEGER,
+    query_key TEXT,
+    status TEXT NOT NULL,
+    first_seen_run INTEGER NOT NULL,
+    last_seen_run INTEGER NOT NULL,
+    first_seen_at TEXT NOT NULL,
+    last_seen_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS listings_location ON listings (country, location_id, category);
+CREATE INDEX IF NOT EXISTS listings_location_name ON listings (location);
+CREATE INDEX IF NOT EXISTS listings_price ON listings (price);
+CREATE INDEX IF NOT EXISTS listings_listed_date ON listings (listed_date);
+CREATE INDEX IF NOT EXISTS listings_first_seen ON listings (first_seen_run);
+CREATE INDEX IF NOT EXISTS listings_scope ON listings (query_key, status, last_seen_run);
+CREATE TABLE IF NOT EXISTS price_history (
+    listing_id TEXT NOT NULL,
+    run_id INTEGER NOT NULL,
+    seen_at TEXT NOT NULL,
+    event TEXT NOT NULL,  -- new, price, removed, relisted
+    price REAL,
+    old_price REAL
+);
+CREATE INDEX IF NOT EXISTS price_history_listing ON price_history (listing_id, run_id);
+CREATE INDEX IF NOT EXISTS price_history_run ON price_history (run_id, event);
+CREATE INDEX IF NOT EXISTS price_history_seen ON price_history (seen_at, event);
+"""
+
+_SUMMARY_COLUMNS = ("id", "price", "currency", "price_period", "bedrooms", "location", "title", "listing_url")
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def query_key(query):
+    """The result set a query covers; sort order does not change which listings it returns."""
+    return "/".join(str(query.get(key)) for key in ("country", "location", "category", "furnishing", "rental_period"))
+
+
+class ListingStore:
+    """SQLite store of every listing seen, its current values, and a compact price/status history."""
+
+    def __init__(self, path=LISTING_STORE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+        columns = ("id", *_FIELDS, "country", "location_id", "category", "query_key", "status",
+                   "first_seen_run", "last_seen_run", "first_seen_at", "last_seen_at")
+        updated = (*_FIELDS, "country", "location_id", "category", "query_key", "status", "last_seen_run", "last_seen_at")
+        self._upsert = (
+            f"INSERT INTO listings ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            f" ON CONFLICT(id) DO UPDATE SET {', '.join(f'{name} = excluded.{name}' for name in updated)}"
+        )
+
+    def start_run(self, query):
+        with self._db:
+            cursor = self._db.execute(
+                "INSERT INTO runs (query_key, query, started_at) VALUES (?, ?, ?)",
+                (query_key(query), json.dumps(query, sort_keys=True), _now()),
+            )
+        return cursor.lastrowid
+
+    def upsert(self, run_id, query, listings):
+        """Upsert one batch of Listings seen in run_id; returns how many were new, repriced and relisted."""
+        now = _now()
+        by_id = {listing.id: listing for listing in listings if listing.id}
+        counts = {"new": 0, "price": 0, "relisted": 0}
+        if not by_id:
+            return counts
+        key = query_key(query)
+
+        with self._db:
+            existing = {}
+            ids = list(by_id)
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                existing.update(
+                    (row["id"], (row["price"], row["status"])) for row in self._db.execute(
+                        f"SELECT id, price, status FROM listings WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                    )
+                )
+
+            history = []
+            for listing_id, listing in by_id.items():
+                old = existing.get(listing_id)
+                if old is None:
+                    event, old_price = "new", None
+                elif old[1] == "removed":
+                    event, old_price = "relisted", old[0]
+                elif old[0] != listing.price:
+                    event, old_price = "price", old[0]
+                else:
+                    continue
+                counts[event] += 1
+                history.append((listing_id, run_id, now, event, listing.price, old_price))
+
+            self._db.executemany(self._upsert, (
+                (listing_id, *_row(listing), query.get("country"), query.get("location"), query.get("category"),
+                 key, "active", run_id, run_id, now, now)
+                for listing_id, listing in by_id.items()
+            ))
+            self._db.executemany(
+                "INSERT INTO price_history (listing_id, run_id, seen_at, event, price, old_price) VALUES (?, ?, ?, ?, ?, ?)",
+                history,
+            )
+            self._db.execute("UPDATE runs SET listings = listings + ? WHERE id = ?", (len(by_id), run_id))
+        return counts
+
+    def finish_run(self, run_id, complete):
+        """
+        Close run_id. Only a complete crawl (one that reached the end of its result set) marks the
+        query's active listings it did not see as removed; a failed or capped crawl removes nothing.
+        Returns the number of listings marked removed.
+        """
+        now = _now()
+        with self._db:
+            run = self._db.execute("SELECT query_key, listings FROM runs WHERE id = ?", (run_id,)).fetchone()
+            complete = bool(complete and run["listings"])
+            self._db.execute("UPDATE runs SET finished_at = ?, complete = ? WHERE id = ?", (now, int(complete), run_id))
+            if not complete:
+                return 0
+            scope = (run["query_key"], run_id)
+            self._db.execute(
+                "INSERT INTO price_history (listing_id, run_id, seen_at, event, price, old_price)"
+                " SELECT id, ?, ?, 'removed', NULL, price FROM listings"
+                " WHERE query_key = ? AND status = 'active' AND last_seen_run < ?",
+                (run_id, now, *scope),
+            )
+            return self._db.execute(
+                "UPDATE listings SET status = 'removed' WHERE query_key = ? AND status = 'active' AND last_seen_run < ?",
+                scope,
+            ).rowcount
+
+    def record(self, query, listings, complete=False):
+        """
+        Store a whole crawl at once (jobs.py). complete: the crawl reached the end of the result
+        set (its sink's reached_end); a sharded crawl never counts as complete.
+        """
+        run_id = self.start_run(query)
+        for start in range(0, len(listings), 1000):
+            self.upsert(run_id, query, listings[start:start + 1000])
+        self.finish_run(run_id, complete and not query.get("sharded"))
+        return run_id
+
+    # Queries. since_run is exclusive (changes after that run); since is an ISO date or datetime.
+
+    def runs(self, limit=20):
+        return self._rows("SELECT * FROM runs ORDER BY id DESC LIMIT ?", [limit])
+
+    def new_listings(self, since_run=None, since=None, limit=None, **filters):
+        where, params = _filters(filters)
+        if since_run is not None:
+            where.append("l.first_seen_run > ?")
+            params.append(since_run)
+        if since is not None:
+            where.append("l.first_seen_at >= ?")
+            params.append(since)
+        return self._rows(
+            f"SELECT l.*, NULL AS old_price, l.first_seen_at AS seen_at FROM listings l{_where(where)}"
+            f" ORDER BY l.first_seen_run DESC{_limit(limit, params)}", params
+        )
+
+    def changed_listings(self, since_run=None, since=None, drops_only=False, limit=None, **filters):
+        """Price changes, newest first; drops_only keeps only price decreases."""
+        return self._events("price", since_run, since, limit, filters, "h.price < h.old_price" if drops_only else None)
+
+    def removed_listings(self, since_run=None, since=None, limit=None, **filters):
+        return self._events("removed", since_run, since, limit, filters)
+
+    def located_listings(self, include_removed=False, **filters):
+        """(id, lat, lon, price) of listings with coordinates, for geo_index.py."""
+        where, params = _filters(filters)
+        where += ["l.lat IS NOT NULL", "l.lon IS NOT NULL"]
+        if not include_removed:
+            where.append("l.status = 'active'")
+        return self._db.execute(f"SELECT l.id, l.lat, l.lon, l.price FROM listings l{_where(where)}", params)
+
+    def history(self, listing_id):
+        return self._rows("SELECT * FROM price_history WHERE listing_id = ? ORDER BY run_id", [listing_id])
+
+    def _events(self, event, since_run, since, limit, filters, extra=None):
+        where, params = _filters(filters)
+        where.insert(0, "h.event = ?")
+        params.insert(0, event)
+        if since_run is not None:
+            where.append("h.run_id > ?")
+            params.append(since_run)
+        if since is not None:
+            where.append("h.seen_at >= ?")
+            params.append(since)
+        if extra:
+            where.append(extra)
+        rows = self._rows(
+            f"SELECT l.*, h.price AS event_price, h.old_price, h.seen_at FROM price_history h"
+            f" JOIN listings l ON l.id = h.listing_id{_where(where)} ORDER BY h.run_id DESC{_limit(limit, params)}",
+            params,
+        )
+        for row in rows:
+            # A price event reports the price it changed to, which may since have changed again
+            event_price = row.pop("event_price")
+            if event == "price":
+                row["price"] = event_price
+            yield row
+
+    def _rows(self, sql, params):
+        for row in self._db.execute(sql, params):
+            yield dict(row)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _row(listing):
+    data = listing.as_dict()
+    return tuple(data[name] for name in _FIELDS)
+
+
+def _filters(filters):
+    """WHERE terms for the common filters: country, location (name substring), location_id, category, price range."""
+    where, params = [], []
+    for name, term in (("country", "l.country = ?"), ("location_id", "l.location_id = ?"),
+                       ("category", "l.category = ?"), ("min_price", "l.price >= ?"), ("max_price", "l.price <= ?")):
+        if filters.get(name) is not None:
+            where.append(term)
+            params.append(filters[name])
+    if filters.get("location"):
+        where.append("l.location LIKE ?")
+        params.append(f"%{filters['location']}%")
+    return where, params
+
+
+def _where(terms):
+    return " WHERE " + " AND ".join(terms) if terms else ""
+
+
+def _limit(limit, params):
+    if limit is None:
+        return ""
+    params.append(limit)
+    return " LIMIT ?"
+
+
+def _print_rows(rows, fmt, columns):
+    if fmt == "ndjson":
+        for row in rows:
+            print(json.dumps(row, ensure_ascii=False))
+        return
+    writer = csv.writer(sys.stdout, delimiter="," if fmt == "csv" else "\t")
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(["" if row.get(column) is None else row.get(column) for column in columns])
+        count += 1
+    if fmt == "table":
+        print(f"({count} rows)", file=sys.stderr)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Query the local listing store")
+    parser.add_argument("--db", default=LISTING_STORE_PATH, help=f"store path (default: {LISTING_STORE_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("runs", help="list recent runs")
+    history = commands.add_parser("history", help="price/status history of one listing")
+    history.add_argument("listing_id")
+    for name, help_text in (("new", "listings first seen since"), ("changed", "price changes since"),
+                            ("removed", "listings gone from a complete crawl since")):
+        command = commands.add_parser(name, help=help_text)
+        since = command.add_mutually_exclusive_group()
+        since.add_argument("--since-run", type=int, help="changes after this run id")
+        since.add_argument("--since", help="changes on or after this ISO date/time (UTC)")
+        since.add_argument("--days", type=float, help="changes in the last N days")
+        command.add_argument("--country")
+        command.add_argument("--location", help="location name substring, e.g. 'Dubai Marina'")
+        command.add_argument("--location-id", type=int)
+        command.add_argument("--category", type=int)
+        command.add_argument("--min-price", type=float)
+        command.add_argument("--max-price", type=float)
+        command.add_argument("--limit", type=int)
+        command.add_argument("--format", choices=("table", "csv", "ndjson"), default="table")
+        if name == "changed":
+            command.add_argument("--drops", action="store_true", help="price decreases only")
+    return parser.parse_args()
+
+
+def main(args):
+    with ListingStore(args.db) as store:
+        if args.command == "runs":
+            _print_rows(store.runs(), "table", ("id", "query_key", "started_at", "finished_at", "complete", "listings"))
+            return
+        if args.command == "history":
+            _print_rows(store.history(args.listing_id), "table", ("run_id", "seen_at", "event", "price", "old_price"))
+            return
+
+        since = args.since
+        if args.days is not None:
+            since = (datetime.now(timezone.utc) - timedelta(days=args.days)).isoformat(timespec="seconds")
+        filters = {"country": args.country, "location": args.location, "location_id": args.location_id,
+                   "category": args.category, "min_price": args.min_price, "max_price": args.max_price}
+        if args.command == "new":
+            rows = store.new_listings(args.since_run, since, args.limit, **filters)
+        elif args.command == "changed":
+            rows = store.changed_listings(args.since_run, since, args.drops, args.limit, **filters)
+        else:
+            rows = store.removed_listings(args.since_run, since, args.limit, **filters)
+        _print_rows(rows, args.format, ("seen_at", *_SUMMARY_COLUMNS[:2], "old_price", *_SUMMARY_COLUMNS[2:]))
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -1,11 +1,20 @@
+import argparse
 import requests
-from bs4 import BeautifulSoup
-import json
+import threading
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
-from google_sheet import upload_data_to_sheet
-from requestmask import get_random_headers, build_url
+from listing import extract_listings
+from sinks import open_sinks
+from requestmask import get_random_headers, build_url, build_search_url, request_route
+from search_options import CATEGORIES, COUNTRIES, FURNISHING, LOCATIONS, RENTAL_PERIODS, SORT_BY_OPTIONS
+from next_data import NextDataScanner, extract_next_data, extract_next_data_stream, format_extract_stats
+from http_cache import ResponseCache, get_response_cache
+from watermark import WatermarkState, incremental_query
+from journal import add_resume_args, open_run, resumable
+from metrics import StreamTimer, add_metrics_args, export_metrics, stage_metrics
 
 # Setup logging — only WARNING+ shown during the run so tqdm bar is clean
 logging.basicConfig(
@@ -16,99 +25,141 @@ logging.basicConfig(
 MAX_PROPERTIES_PER_PAGE = 20
 MAX_PAGES = 100 # adjust as needed based on expected total results and rate limits
 REQUEST_RETRIES = 3
-REQUEST_DELAY = 0  # seconds
+REQUEST_DELAY = 0  # minimum seconds between request starts, across all prefetch threads
+PREFETCH_PAGES = 4  # pages downloaded ahead (worker threads) while the current one is parsed; 0 = one at a time
+KEEPALIVE_DRAIN_BYTES = 256 * 1024  # body left after __NEXT_DATA__ read anyway so the connection can be reused
+
+_session = None
+_session_pool = 0  # connections per host the mounted adapter keeps
+_session_lock = threading.Lock()
+_pace_lock = threading.Lock()
+_last_request = 0.0
+
+
+def get_session(pool_size=None):
+    """
+    Shared keep-alive Session. Its per-host connection pool holds pool_size (+2) connections
+    (PREFETCH_PAGES if the first call gives none); asking for more than the current pool mounts
+    a larger adapter, while calls without pool_size leave it as it is.
+    """
+    global _session, _session_pool
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+        elif pool_size is None:
+            return _session
+        wanted = max(PREFETCH_PAGES if pool_size is None else pool_size, 1) + 2
+        if wanted > _session_pool:
+            # Connections already pooled by the old adapter are dropped with it
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=wanted)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            _session_pool = wanted
+        return _session
+
+
+def reset_session():
+    """Close the shared Session, so the next get_session() starts with a fresh, newly sized pool."""
+    global _session, _session_pool
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _session_pool = 0
+
+
+def _pace():
+    """Wait until REQUEST_DELAY has passed since the previous request started (in any thread)."""
+    global _last_request
+    if not REQUEST_DELAY:
+        return
+    with _pace_lock:
+        wait = _last_request + REQUEST_DELAY - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        _last_request = time.monotonic()
+
+
+def _drain(response, limit=KEEPALIVE_DRAIN_BYTES):
+    """
+    Read the rest of a body that was abandoned early, up to limit, so urllib3 can return the
+    connection to the pool instead of closing it; past the limit a new handshake is cheaper.
+    """
+    read = 0
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        read += len(chunk)
+        if read > limit:
+            return
 
 
 def fetch_properties(query, page):
-    """Fetch property JSON data for given query and page number, with retry and error handling."""
-    url = (
-        f"https://www.propertyfinder.{query['country']}/en/search"
-        f"?l={query['location']}&c={query['category']}&fu={query['furnishing']}"
-        f"&rp={query['rental_period']}&ob={query['sort_by']}&page={page}"
-    )
-    target_url = build_url(url)
+    """
+    Fetch property JSON data for given query and page number, with retry and error handling.
+    Request errors and bodies cut off inside the __NEXT_DATA__ payload are retried up to REQUEST_RETRIES times.
+    """
+    search_url = build_search_url(query, page)
+    target_url = build_url(search_url)
+    route = request_route()
+
+    # Serve from the local cache when fresh; a stale entry turns the request into a revalidation
+    cache = get_response_cache()
+    entry = cache.lookup(search_url, query.get("cache_ttl")) if cache else None
+    if entry is not None and entry.fresh:
+        stage_metrics.count("cache_hits")
+        with stage_metrics.time("parse", page, source="cache"):
+            return extract_next_data(entry.body)[0]
 
     for attempt in range(REQUEST_RETRIES):
+        if attempt:
+            stage_metrics.count("retries")
         try:
-            response = requests.get(target_url, headers=get_random_headers(), timeout=10)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.content, "html.parser")
-            script_tag = soup.find("script", id="__NEXT_DATA__")
-            if not script_tag or not script_tag.string:
-                return None
-            return script_tag.string
+            headers = get_random_headers(ResponseCache.conditional_headers(entry))
+            _pace()
+            stage_metrics.count("requests")
+            # Stream the body and stop parsing once the __NEXT_DATA__ script is complete
+            with get_session().get(target_url, headers=headers, timeout=10, stream=True) as response:
+                # requests only exposes the time to the response headers, connecting included
+                stage_metrics.observe("ttfb", response.elapsed.total_seconds(), page, via=route)
+                if entry is not None and response.status_code == 304:
+                    with stage_metrics.time("parse", page, source="cache"):
+                        return extract_next_data(cache.revalidated(entry, response.headers))[0]
+                response.raise_for_status()
+                scanner = NextDataScanner()
+                timer = StreamTimer()
+                body_start = time.perf_counter()
+                json_data, _ = extract_next_data_stream(timer.wrap(response.iter_content(chunk_size=64 * 1024)), scanner)
+                stage_metrics.observe("download", timer.read_seconds, page, via=route)
+                stage_metrics.observe("parse", time.perf_counter() - body_start - timer.read_seconds, page, source="stream")
+                stage_metrics.count("bytes_downloaded", timer.bytes)
+                if scanner.payload is not None:
+                    _drain(response)  # stopped early; a body read to its end has nothing left
+            if scanner.truncated:
+                # The body ended inside the payload (dropped connection): fetch the page again
+                stage_metrics.count("truncated")
+                time.sleep(REQUEST_DELAY)
+                continue
+            if cache is not None and json_data:
+                cache.store(search_url, scanner.buffer, response.headers)
+            return json_data
         except requests.RequestException:
+            stage_metrics.count("request_errors")
             time.sleep(REQUEST_DELAY)
     return None
 
 
 def extract_property_data(json_data):
-    """Extract structured property data from JSON string."""
-    if not json_data:
-        return []
-
-    try:
-        data = json.loads(json_data)
-        properties = data['props']['pageProps']['searchResult']['properties']
-    except (json.JSONDecodeError, KeyError):
-        return []
-
-    property_list = []
-    for prop in properties:
-        try:
-            data = {
-                "ID": prop.get("id"),
-                "Title": prop.get("title"),
-                "Property Type": prop.get("property_type"),
-                "Price": f"{prop['price']['value']} {prop['price']['currency']} / {prop['price']['period']}",
-                "Bedrooms": prop.get("bedrooms"),
-                "Bathrooms": prop.get("bathrooms"),
-                "Size": f"{prop['size']['value']} {prop['size']['unit']}" if prop.get("size") else None,
-                "Furnished": prop.get("furnished"),
-                "Listed Date": prop.get("listed_date"),
-                "RERA ID": prop.get("rera"),
-                "Location": prop.get("location", {}).get("full_name"),
-                "Map Link": (
-                    f"https://www.google.com/maps?q="
-                    f"{prop.get('location', {}).get('coordinates', {}).get('lat')},"
-                    f"{prop.get('location', {}).get('coordinates', {}).get('lon')}"
-                ),
-                "Listing URL": prop.get("share_url"),
-                "Image URL": prop.get("images", [{}])[0].get("medium"),
-                "Agent Name": prop.get("agent", {}).get("name"),
-                "Agent Email": prop.get("agent", {}).get("email"),
-                "Super Agent": prop.get("agent", {}).get("is_super_agent"),
-                "Broker Name": prop.get("broker", {}).get("name"),
-                "Broker Email": prop.get("broker", {}).get("email"),
-                "Broker Phone": prop.get("broker", {}).get("phone"),
-                "Description": (lambda d: (', '.join(line.strip('- ').strip() for line in (d or '').splitlines())).strip()[:150] + ('...' if d and len(d) > 150 else ''))(prop.get("description"))
-            }
-            property_list.append(data)
-        except Exception:
-            pass
-    return property_list
+    """Extract typed Listings from JSON string (formatting for display happens in the sinks)."""
+    return extract_listings(json_data)
 
 
 def input_query_parameters():
     """Interactive CLI input for search query parameters with validation."""
-    Countries = {
-        "ae": "United Arab Emirates",
-        "qa": "Qatar",
-        "bh": "Bahrain",
-        "eg": "Egypt",
-        "sa": "Saudi Arabia"
-    }
-    Locations = {
-        "ae": {1: "Dubai", 6: "Abu Dhabi", 4: "Sharjah", 5: "Ajman", 3: "Ras Al Khaimah", 8: "Al Ain", 7: "Fujairah", 2: "Umm Al Quwain"},
-        "qa": {9: "Doha", 4: "Lusail", 2: "Al Wakra", 5: "Umm Salal Mohammad", 6: "Al Shamal", 3: "Al Khor", 7: "Al Daayen"},
-        "bh": {34: "Manama", 49: "Riffa", 12: "Muharraq", 00: "Isa Town", 00: "Hamad Town", 00: "Sitra", 00: "Jidhafs"},
-        "eg": {2254: "Cairo", 20663: "Giza", 30754: "Alexandria", 00: "Mansoura", 00: "Tanta", 00: "Asyut", 00: "Ismailia"},
-        "sa": {8216: "Riyadh", 2658: "Jeddah", 00: "Mecca", 00: "Medina", 00: "Dammam", 00: "Khobar", 00: "Dhahran"}
-    }
-    Categories = {1: "buy", 2: "rent", 3: "commercial-buy", 4: "commercial-rent", 5: "new-projects"}
-    Furnishing = {0: "All furnishings", 1: "Furnished", 2: "Unfurnished", 3: "Partly furnished"}
-    RentalPeriods = {"y": "yearly", "m": "monthly", "w": "weekly", "d": "daily"}
-    SortByOptions = {"mr": "Featured", "nd": "Newest", "pa": "Price (low)", "pd": "Price (high)", "ba": "Beds (least)", "bd": "Beds (most)"}
+    Countries = COUNTRIES
+    Locations = LOCATIONS
+    Categories = CATEGORIES
+    Furnishing = FURNISHING
+    RentalPeriods = RENTAL_PERIODS
+    SortByOptions = SORT_BY_OPTIONS
 
     def get_choice(prompt, options, default=None, key_type=str):
         while True:
@@ -150,52 +201,180 @@ def input_query_parameters():
     return query
 
 
-def main():
-    all_properties = []
-    query = input_query_parameters()
-
-    start_time = time.time()
-
-    bar_format = "Scraping: {percentage:3.0f}%|{bar}| {n}/{total} pages [{elapsed}<{remaining}, {rate_fmt}{postfix}]"
+def parse_args():
+    parser = argparse.ArgumentParser(description="Synchronous Property Finder scraper")
+    parser.add_argument(
+        "--output", action="append", metavar="TARGET",
+        help="where to stream results: 'sheet' (default), 'sheet:<tab>', 'store' (listing store with price "
+             "history), 'geo:<path>' (spatial index for geo_index.py), or a .ndjson/.csv/.sqlite/.parquet path; "
+             "repeat for several"
+    )
+    parser.add_argument(
+        "--prefetch", type=int, default=PREFETCH_PAGES,
+        help=f"pages downloaded ahead in worker threads (default: {PREFETCH_PAGES}; 0 = one page at a time)"
+    )
+    parser.add_argument(
+        "--new-only", action="store_true",
+        help="only listings added since the last --new-only run of this query (sorted newest first, "
+             "stops at the first page with nothing new)"
+    )
+    add_resume_args(parser)
+    add_metrics_args(parser)
+    args = parser.parse_args()
+    if args.resume is not None and args.new_only:
+        parser.error("--resume cannot be combined with --new-only")
+    return args
+
+
+def crawl_query(query, sink, pbar=None, watermark=None, prefetch=PREFETCH_PAGES, journal=None):
+    """
+    Fetch pages in order, writing each to sink, until an empty or short page; returns the count.
+    Up to prefetch pages are downloaded and extracted ahead in worker threads while the current
+    page is written; downloads past the stopping page are cancelled or discarded.
+    With a Watermark (incremental crawl, newest first) only listings earlier runs have not returned
+    are written, and the crawl stops at the first page that has none.
+    With a RunJournal, pages it already holds are read from it instead of fetched, and every
+    fetched page is saved to it. The sink's finish_crawl() is told whether the crawl got to an
+    empty or short page.
+    """
+    found_count = 0
+    complete = reached_end = False
+    workers = max(1, prefetch)
+    futures = {}
+    next_page = 1
+
+    def progress(status):
+        if pbar is not None:
+            pbar.set_postfix(added=found_count, status=status)
+            pbar.update(1)
 
-    with tqdm(total=MAX_PAGES, desc="Scraping", unit="page", bar_format=bar_format, dynamic_ncols=True) as pbar:
+    def load_page(page):
+        """The page's Listings, or None if it could not be fetched."""
+        if journal is not None and journal.has(page):
+            return journal.load(page)[0]
+        json_data = fetch_properties(query, page)
+        if not json_data:
+            if journal is not None:
+                journal.fail(page)
+            return None
+        with stage_metrics.time("extract", page):
+            properties = extract_property_data(json_data)
+        if journal is not None:
+            journal.record(page, properties)
+        return properties
+
+    def top_up(pool, limit):
+        nonlocal next_page
+        while next_page <= MAX_PAGES and len(futures) < limit:
+            futures[next_page] = pool.submit(load_page, next_page)
+            next_page += 1
+
+    get_session(workers)
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+    try:
+        # An incremental crawl usually stops after page 1, so it waits for that page before prefetching
+        top_up(pool, 1 if watermark is not None else workers)
         for page in range(1, MAX_PAGES + 1):
-            json_data = fetch_properties(query, page)
+            properties = futures.pop(page).result()
 
-            if not json_data:
-                pbar.set_postfix(added=len(all_properties), status="no data")
-                pbar.update(1)
+            if properties is None:
+                progress("no data")
                 break
 
-            properties = extract_property_data(json_data)
-
             if not properties:
-                pbar.set_postfix(added=len(all_properties), status="empty")
-                pbar.update(1)
+                progress("empty")
+                complete = reached_end = True
                 break
 
-            all_properties.extend(properties)
-            pbar.set_postfix(added=len(all_properties), status="added")
-            pbar.update(1)
-
-            if len(properties) < MAX_PROPERTIES_PER_PAGE:
+            page_size = len(properties)
+            if watermark is not None:
+                watermark.observe(properties)
+                properties = watermark.new_listings(properties)
+                if not properties:
+                    progress("caught up")
+                    complete = reached_end = True
+                    break
+
+            sink.write(properties)
+            found_count += len(properties)
+            progress("added")
+
+            if page_size < MAX_PROPERTIES_PER_PAGE:
+                complete = reached_end = True
                 break
 
-            time.sleep(REQUEST_DELAY)
+            top_up(pool, workers)
+        else:
+            complete = True
+    finally:
+        # Pages past the stop: queued ones are cancelled, running ones finish in the background
+        for future in futures.values():
+            future.cancel()
+        pool.shutdown(wait=False)
+    # Stopping at MAX_PAGES is complete for the watermark and journal, but more results may follow
+    sink.finish_crawl(reached_end)
+    if watermark is not None:
+        watermark.complete = complete
+    if journal is not None:
+        journal.finish_crawl(complete, reached_end)
+    return found_count
+
+
+def main(args):
+    # Plain crawls are journaled page by page so an interrupted run can be resumed
+    journal = None
+    if args.new_only:
+        query = input_query_parameters()
+    else:
+        journal, query = open_run(args, input_query_parameters)
+        if journal is None:
+            print("⚠ No interrupted run to resume (see python journal.py list)")
+            return
+        if journal.resumed:
+            print(f"↻ Resuming run {journal.run_id}: {journal.resumed} pages already saved")
+    if args.trace:
+        stage_metrics.enable_trace()
+    watermarks = watermark = None
+    if args.new_only:
+        query = incremental_query(query)
+        watermarks = WatermarkState()
+        watermark = watermarks.get(query)
+
+    start_time = time.time()
 
-    elapsed = time.time() - start_time
-    mins, secs = divmod(int(elapsed), 60)
-    print(f"\n✔ Scraping complete — {len(all_properties)} properties found in {mins}m {secs}s")
+    bar_format = "Scraping: {percentage:3.0f}%|{bar}| {n}/{total} pages [{elapsed}<{remaining}, {rate_fmt}{postfix}]"
 
-    if all_properties:
-        print("⏳ Uploading to Google Sheet...")
+    # Each page is written to the sinks as soon as it is parsed; closing them flushes the last batch
+    with resumable(journal), open_sinks(args.output or ["sheet"], query["country"], query) as sink:
+        with tqdm(total=MAX_PAGES, desc="Scraping", unit="page", bar_format=bar_format, dynamic_ncols=True) as pbar:
+            found_count = crawl_query(query, sink, pbar, watermark, args.prefetch, journal)
+        if watermarks is not None and watermark.complete:
+            watermarks.update(query, watermark.advanced())
+            watermarks.save()
+        elif watermarks is not None:
+            print("⚠ Crawl stopped on a failed page; the watermark was not advanced")
+
+        elapsed = time.time() - start_time
+        mins, secs = divmod(int(elapsed), 60)
+        print(f"\n✔ Scraping complete — {found_count} properties found in {mins}m {secs}s")
+        print(f"  __NEXT_DATA__ extraction paths: {format_extract_stats()}")
+        if get_response_cache():
+            print(f"  Response cache: {get_response_cache().format_stats()}")
+
+        if found_count:
+            print("⏳ Flushing outputs...")
         upload_start = time.time()
-        upload_data_to_sheet(all_properties, query["country"])
+
+    if found_count:
         upload_elapsed = time.time() - upload_start
-        print(f"✔ Upload complete in {upload_elapsed:.1f}s")
+        print(f"✔ Upload complete in {upload_elapsed:.1f}s — {sink.summary()}")
     else:
         print("⚠ No properties found, nothing to upload.")
 
+    for line in stage_metrics.format_summary():
+        print(f"  {line}")
+    export_metrics(args)
+
 
 if __name__ == "__main__":
-    main()
+    main(parse_args())
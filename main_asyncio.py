@@ -1,115 +1,39 @@
+import argparse
 import asyncio
+import os
 import httpx
-from bs4 import BeautifulSoup
-import json
 import time
 import logging
+from contextlib import nullcontext
 from tqdm import tqdm
-from google_sheet import upload_data_to_sheet
-from requestmask import get_random_headers, build_url
+from search_options import CATEGORIES, COUNTRIES, FURNISHING, LOCATIONS, RENTAL_PERIODS, SORT_BY_OPTIONS
+from next_data import format_extract_stats
+from parse_pipeline import ParsePipeline
+from http_cache import get_response_cache
+from rate_limit import AdaptiveLimiter
+from crawler import (
+    CONCURRENT_REQUESTS, MAX_CONCURRENT_REQUESTS, MAX_PAGES, crawl_query, fetch_page_bytes, parse_page_bytes, retry_stats,
+)
+from metrics import add_metrics_args, export_metrics, stage_metrics
+from sinks import open_sinks
+from watermark import WatermarkState, incremental_query
+from journal import add_resume_args, open_run, resumable
 
 # Config
-MAX_PROPERTIES_PER_PAGE = 20
-MAX_PAGES = 100 # adjust as needed based on expected total results and rate limits
-CONCURRENT_REQUESTS = 3
-REQUEST_DELAY = 0  # seconds
+PARSE_WORKERS = 0  # >0 parses pages in a process pool of this size, 0 parses on the event loop
 
 # Suppress noisy logs so the tqdm bar stays clean
 logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
 
 
-async def fetch_properties(query, page, client, semaphore):
-    """Asynchronously fetch property data with concurrency control."""
-    url = (
-        f"https://www.propertyfinder.{query['country']}/en/search"
-        f"?l={query['location']}&c={query['category']}&fu={query['furnishing']}"
-        f"&rp={query['rental_period']}&ob={query['sort_by']}&page={page}"
-    )
-    target_url = build_url(url)
-    headers = get_random_headers()
-
-    async with semaphore:
-        try:
-            response = await client.get(target_url, headers=headers, timeout=10)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, "html.parser")
-            script_tag = soup.find("script", id="__NEXT_DATA__")
-            if not script_tag or not script_tag.string:
-                return page, None
-            return page, script_tag.string
-        except httpx.HTTPError:
-            return page, None
-        except Exception:
-            return page, None
-
-
-def extract_property_data(json_data):
-    """Extract structured property data from JSON string."""
-    if not json_data:
-        return []
-
-    try:
-        data = json.loads(json_data)
-        properties = data['props']['pageProps']['searchResult']['properties']
-    except (json.JSONDecodeError, KeyError):
-        return []
-
-    property_list = []
-    for prop in properties:
-        try:
-            data = {
-                "ID": prop.get("id"),
-                "Title": prop.get("title"),
-                "Property Type": prop.get("property_type"),
-                "Price": f"{prop['price']['value']} {prop['price']['currency']} / {prop['price']['period']}",
-                "Bedrooms": prop.get("bedrooms"),
-                "Bathrooms": prop.get("bathrooms"),
-                "Size": f"{prop['size']['value']} {prop['size']['unit']}" if prop.get("size") else None,
-                "Furnished": prop.get("furnished"),
-                "Listed Date": prop.get("listed_date"),
-                "RERA ID": prop.get("rera"),
-                "Location": prop.get("location", {}).get("full_name"),
-                "Map Link": (
-                    f"https://www.google.com/maps?q="
-                    f"{prop.get('location', {}).get('coordinates', {}).get('lat')},"
-                    f"{prop.get('location', {}).get('coordinates', {}).get('lon')}"
-                ),
-                "Listing URL": prop.get("share_url"),
-                "Image URL": prop.get("images", [{}])[0].get("medium"),
-                "Agent Name": prop.get("agent", {}).get("name"),
-                "Agent Email": prop.get("agent", {}).get("email"),
-                "Super Agent": prop.get("agent", {}).get("is_super_agent"),
-                "Broker Name": prop.get("broker", {}).get("name"),
-                "Broker Email": prop.get("broker", {}).get("email"),
-                "Broker Phone": prop.get("broker", {}).get("phone"),
-                "Description": (lambda d: (', '.join(line.strip('- ').strip() for line in (d or '').splitlines())).strip()[:150] + ('...' if d and len(d) > 150 else ''))(prop.get("description"))
-            }
-            property_list.append(data)
-        except Exception:
-            pass
-    return property_list
-
-
 def input_query_parameters():
     """Interactive CLI input for search query parameters with validation."""
-    Countries = {
-        "ae": "United Arab Emirates",
-        "qa": "Qatar",
-        "bh": "Bahrain",
-        "eg": "Egypt",
-        "sa": "Saudi Arabia"
-    }
-    Locations = {
-        "ae": {1: "Dubai", 6: "Abu Dhabi", 4: "Sharjah", 5: "Ajman", 3: "Ras Al Khaimah", 8: "Al Ain", 7: "Fujairah", 2: "Umm Al Quwain"},
-        "qa": {9: "Doha", 4: "Lusail", 2: "Al Wakra", 5: "Umm Salal Mohammad", 6: "Al Shamal", 3: "Al Khor", 7: "Al Daayen"},
-        "bh": {34: "Manama", 49: "Riffa", 12: "Muharraq", 00: "Isa Town", 00: "Hamad Town", 00: "Sitra", 00: "Jidhafs"},
-        "eg": {2254: "Cairo", 20663: "Giza", 30754: "Alexandria", 00: "Mansoura", 00: "Tanta", 00: "Asyut", 00: "Ismailia"},
-        "sa": {8216: "Riyadh", 2658: "Jeddah", 00: "Mecca", 00: "Medina", 00: "Dammam", 00: "Khobar", 00: "Dhahran"}
-    }
-    Categories = {1: "buy", 2: "rent", 3: "commercial-buy", 4: "commercial-rent", 5: "new-projects"}
-    Furnishing = {0: "All furnishings", 1: "Furnished", 2: "Unfurnished", 3: "Partly furnished"}
-    RentalPeriods = {"y": "yearly", "m": "monthly", "w": "weekly", "d": "daily"}
-    SortByOptions = {"mr": "Featured", "nd": "Newest", "pa": "Price (low)", "pd": "Price (high)", "ba": "Beds (least)", "bd": "Beds (most)"}
+    Countries = COUNTRIES
+    Locations = LOCATIONS
+    Categories = CATEGORIES
+    Furnishing = FURNISHING
+    RentalPeriods = RENTAL_PERIODS
+    SortByOptions = SORT_BY_OPTIONS
 
     def get_choice(prompt, options, default=None, key_type=str):
         while True:
@@ -151,60 +75,166 @@ def input_query_parameters():
     return query
 
 
-async def main():
-    query = input_query_parameters()
-    semaphore = asyncio.Semaphore(CONCURRENT_REQUESTS)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Asynchronous Property Finder scraper")
+    parser.add_argument(
+        "--parse-workers", type=int, default=PARSE_WORKERS,
+        help=f"parse pages in a process pool with N workers (0 = on the event loop, default: {PARSE_WORKERS}; "
+             f"this machine has {os.cpu_count()} CPUs)"
+    )
+    parser.add_argument(
+        "--fixed-concurrency", action="store_true",
+        help=f"keep exactly {CONCURRENT_REQUESTS} requests in flight instead of adapting"
+    )
+    parser.add_argument("--concurrency-log", metavar="CSV", help="write the concurrency limit over time to this file")
+    parser.add_argument(
+        "--new-only", action="store_true",
+        help="only listings added since the last --new-only run of this query (sorted newest first, "
+             "stops at the first page with nothing new)"
+    )
+    parser.add_argument(
+        "--output", action="append", metavar="TARGET",
+        help="where to stream results: 'sheet' (default), 'sheet:<tab>', 'store' (listing store with price "
+             "history), 'geo:<path>' (spatial index for geo_index.py), or a .ndjson/.csv/.sqlite/.parquet path; "
+             "repeat for several"
+    )
+    parser.add_argument(
+        "--enrich", action="store_true",
+        help="fetch each listing's detail page for the full description, images, amenities and agent "
+             "profile (cached per listing; see enrich.py)"
+    )
+    parser.add_argument(
+        "--shard", action="store_true",
+        help=f"split a search with more results than the {MAX_PAGES}-page cap into price/bedroom shards, "
+             "crawl them concurrently and report coverage"
+    )
+    parser.add_argument(
+        "--shard-by", nargs="+", choices=("price", "bedrooms", "location"), default=["price", "bedrooms"],
+        help="split order for --shard (default: price bands, then bedrooms)"
+    )
+    parser.add_argument(
+        "--sub-locations", nargs="+", type=int, metavar="ID",
+        help="location ids inside the searched location, for --shard-by location"
+    )
+    add_resume_args(parser)
+    add_metrics_args(parser)
+    args = parser.parse_args()
+    if args.shard and (args.new_only or args.parse_workers > 0):
+        parser.error("--shard cannot be combined with --new-only or --parse-workers")
+    if args.resume is not None and (args.new_only or args.shard):
+        parser.error("--resume cannot be combined with --new-only or --shard")
+    if "location" in args.shard_by and not args.sub_locations:
+        parser.error("--shard-by location needs --sub-locations")
+    return args
+
+
+async def main(args):
+    # Plain crawls are journaled page by page so an interrupted run can be resumed
+    journal = None
+    if args.new_only or args.shard:
+        query = input_query_parameters()
+    else:
+        journal, query = open_run(args, input_query_parameters)
+        if journal is None:
+            print("⚠ No interrupted run to resume (see python journal.py list)")
+            return
+        if journal.resumed:
+            print(f"↻ Resuming run {journal.run_id}: {journal.resumed} pages already saved")
+    if args.trace:
+        stage_metrics.enable_trace()
+    watermarks = watermark = None
+    if args.new_only:
+        query = incremental_query(query)
+        watermarks = WatermarkState()
+        watermark = watermarks.get(query)
+    if args.shard:
+        query = {**query, "sharded": True}  # the listing store must not infer removals from shard pages
+    if args.fixed_concurrency:
+        semaphore = asyncio.Semaphore(CONCURRENT_REQUESTS)
+    else:
+        semaphore = AdaptiveLimiter(initial=CONCURRENT_REQUESTS, max_limit=MAX_CONCURRENT_REQUESTS)
     start_time = time.time()
 
-    # results_by_page will store (page -> list of properties), ordered later
-    results_by_page: dict[int, list] = {}
-    added_count = 0
-    last_page_reached = MAX_PAGES
-
-    bar_format = "Scraping: {percentage:3.0f}%|{bar}| {n}/{total} pages [{elapsed}<{remaining}, {rate_fmt}{postfix}]"
-
-    async with httpx.AsyncClient() as client:
-        tasks = {
-            asyncio.ensure_future(fetch_properties(query, page, client, semaphore)): page
-            for page in range(1, MAX_PAGES + 1)
-        }
-
-        with tqdm(total=MAX_PAGES, desc="Scraping", unit="page", bar_format=bar_format, dynamic_ncols=True) as pbar:
-            for coro in asyncio.as_completed(tasks.keys()):
-                page, json_data = await coro
-                properties = extract_property_data(json_data)
-                results_by_page[page] = properties
-                added_count += len(properties)
-
-                status = "added" if properties else ("empty" if json_data else "no data")
-                pbar.set_postfix(added=added_count, status=status)
-                pbar.update(1)
-
-    # Process results in page order to detect the last page correctly
-    all_properties = []
-    for page in range(1, MAX_PAGES + 1):
-        props = results_by_page.get(page, [])
-        if not props:
-            last_page_reached = page
-            break
-        all_properties.extend(props)
-        if len(props) < MAX_PROPERTIES_PER_PAGE:
-            last_page_reached = page
-            break
-
-    elapsed = time.time() - start_time
-    mins, secs = divmod(int(elapsed), 60)
-    print(f"\n✔ Scraping complete — {len(all_properties)} properties found in {mins}m {secs}s")
-
-    if all_properties:
-        print("⏳ Uploading to Google Sheet...")
+    bar_format = "Scraping: {percentage:3.0f}%|{bar}| {n}/{total} {unit}s [{elapsed}<{remaining}, {rate_fmt}{postfix}]"
+    stage_report = []
+
+    # Results stream into the sinks as pages complete; closing them flushes the last batch
+    with resumable(journal), open_sinks(args.output or ["sheet"], query["country"], query) as sink:
+        async with httpx.AsyncClient() as client:
+            enricher = None
+            if args.enrich:
+                from enrich import Enricher, EnrichingSink
+
+                enricher = Enricher(client)
+            # Enrichment runs behind the crawl; leaving the block waits for its last pages
+            async with EnrichingSink(sink, enricher) if enricher else nullcontext(sink) as target:
+                with tqdm(total=MAX_PAGES, desc="Scraping", unit="page", bar_format=bar_format, dynamic_ncols=True) as pbar:
+                    if args.shard:
+                        from sharding import format_coverage, format_plan, plan_shards, run_shards
+
+                        pbar.set_description("Planning")
+                        plan = await plan_shards(query, client, semaphore, args.shard_by, args.sub_locations)
+                        for line in format_plan(plan):
+                            tqdm.write(line)
+                        pbar.unit = "shard"
+                        pbar.reset(total=len(plan.shards))
+                        pbar.set_description("Shards")
+                        unique = await run_shards(plan, client, semaphore, target, pbar)
+                        found_count = unique.count
+                        stage_report = [format_coverage(plan, unique)]
+                    elif args.parse_workers > 0:
+                        pipeline = ParsePipeline(
+                            lambda page, limiter: fetch_page_bytes(query, page, client, limiter),
+                            parse_page_bytes,
+                            workers=args.parse_workers,
+                            download_semaphore=semaphore,
+                            download_slots=CONCURRENT_REQUESTS if args.fixed_concurrency else MAX_CONCURRENT_REQUESTS,
+                        )
+                        async with pipeline:
+                            found_count = await crawl_query(query, client, semaphore, pbar, pipeline, target, watermark, journal)
+                        stage_report = pipeline.report()
+                    else:
+                        found_count = await crawl_query(
+                            query, client, semaphore, pbar, sink=target, watermark=watermark, journal=journal
+                        )
+
+        if watermarks is not None and watermark.complete:
+            watermarks.update(query, watermark.advanced())
+            watermarks.save()
+        elif watermarks is not None:
+            print("⚠ Crawl stopped on a failed page; the watermark was not advanced")
+
+        elapsed = time.time() - start_time
+        mins, secs = divmod(int(elapsed), 60)
+        print(f"\n✔ Scraping complete — {found_count} properties found in {mins}m {secs}s")
+        print(f"  __NEXT_DATA__ extraction paths: {format_extract_stats()}")
+        if get_response_cache():
+            print(f"  Response cache: {get_response_cache().format_stats()}")
+        for line in stage_report:
+            print(f"  {line}")
+        if enricher is not None:
+            print(f"  {enricher.format_stats()}")
+        if retry_stats:
+            print(f"  Retries: {retry_stats['retries']}, pages given up: {retry_stats['gave_up']}")
+        if isinstance(semaphore, AdaptiveLimiter):
+            print(f"  {semaphore.format_stats()}")
+            if args.concurrency_log:
+                semaphore.write_history(args.concurrency_log)
+
+        if found_count:
+            print("⏳ Flushing outputs...")
         upload_start = time.time()
-        upload_data_to_sheet(all_properties, query["country"])
+
+    if found_count:
         upload_elapsed = time.time() - upload_start
-        print(f"✔ Upload complete in {upload_elapsed:.1f}s")
+        print(f"✔ Upload complete in {upload_elapsed:.1f}s — {sink.summary()}")
     else:
         print("⚠ No properties found, nothing to upload.")
 
+    for line in stage_metrics.format_summary():
+        print(f"  {line}")
+    export_metrics(args)
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,295 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Upper bounds in seconds; wide enough for a 304 from the cache up to a slow Sheets append
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+# Stages in pipeline order, for the end-of-run summary
+STAGES = ("connect", "tls", "ttfb", "download", "parse", "extract", "upload")
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds (Prometheus style)."""
+
+    __slots__ = ("counts", "count", "sum", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def quantile(self, q):
+        """Estimate by linear interpolation inside the bucket holding the q-th observation."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(BUCKETS, self.counts):
+            if count and seen + count >= rank:
+                upper = self.max if bound == math.inf else min(bound, self.max)
+                lower = max(lower, self.min)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.max
+
+    def as_dict(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            buckets["+Inf" if bound == math.inf else str(bound)] = cumulative
+        return {
+            "count": self.count, "sum": round(self.sum, 6), "min": self.min, "max": self.max,
+            "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class StageMetrics:
+    """
+    Timings of each scraper stage (connect, tls, ttfb, download, parse, extract, upload) as
+    histograms keyed by stage and labels, plus plain counters (requests, retries, bytes).
+    With enable_trace() every observation is also kept as a Chrome trace event; lane groups
+    events into timeline rows (the page number for per-page stages).
+    Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = Counter()
+        self.trace = None
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def enable_trace(self):
+        self.trace = []
+
+    def observe(self, stage, seconds, lane=None, **labels):
+        """Record one stage duration that ended just now."""
+        key = (stage, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+            if self.trace is not None:
+                end = time.perf_counter() - self._origin
+                self.trace.append({
+                    "name": stage, "ph": "X", "ts": round((end - seconds) * 1e6), "dur": round(seconds * 1e6),
+                    "pid": os.getpid(), "tid": 0 if lane is None else lane, "args": labels,
+                })
+
+    @contextmanager
+    def time(self, stage, lane=None, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, lane, **labels)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def stage_totals(self):
+        """Histograms merged across labels, one per stage."""
+        merged = {}
+        for (stage, _), histogram in self.histograms.items():
+            total = merged.setdefault(stage, Histogram())
+            for i, count in enumerate(histogram.counts):
+                total.counts[i] += count
+            total.count += histogram.count
+            total.sum += histogram.sum
+            total.min = histogram.min if total.min is None else min(total.min, histogram.min)
+            total.max = histogram.max if total.max is None else max(total.max, histogram.max)
+        return merged
+
+    def format_summary(self):
+        """One line per stage (count, total, p50/p99) for the end-of-run report."""
+        totals = self.stage_totals()
+        lines = []
+        for stage in sorted(totals, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+            h = totals[stage]
+            lines.append(
+                f"{stage}: {h.count}× {h.sum:.2f}s total, p50 {h.quantile(0.5) * 1000:.0f} ms, "
+                f"p99 {h.quantile(0.99) * 1000:.0f} ms"
+            )
+        if self.counters:
+            lines.append(", ".join(f"{name} {value}" for name, value in sorted(self.counters.items())))
+        return lines
+
+    def to_json(self):
+        return {
+            "stages": [
+                {"stage": stage, "labels": dict(labels), **histogram.as_dict()}
+                for (stage, labels), histogram in sorted(self.histograms.items())
+            ],
+            "counters": dict(self.counters),
+        }
+
+    def to_prometheus(self):
+        """Prometheus text exposition format (for a node_exporter textfile collector or a pushgateway)."""
+        lines = [
+            "# HELP scraper_stage_seconds Time spent in each scraper stage.",
+            "# TYPE scraper_stage_seconds histogram",
+        ]
+        for (stage, labels), histogram in sorted(self.histograms.items()):
+            base = [("stage", stage), *labels]
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f"scraper_stage_seconds_bucket{_labels(base + [('le', le)])} {cumulative}")
+            lines.append(f"scraper_stage_seconds_sum{_labels(base)} {histogram.sum}")
+            lines.append(f"scraper_stage_seconds_count{_labels(base)} {histogram.count}")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE scraper_{name}_total counter")
+            lines.append(f"scraper_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write metrics to path: Prometheus text for .prom/.txt, JSON otherwise."""
+        if os.path.splitext(path)[1].lower() in (".prom", ".txt"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_json(), indent=2)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+    def write_trace(self, path):
+        """Write the recorded events as a Chrome trace (open in chrome://tracing or ui.perfetto.dev)."""
+        events = list(self.trace or [])
+        lanes = sorted({event["tid"] for event in events})
+        events += [
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": lane,
+             "args": {"name": "run" if lane == 0 else f"page {lane}"}}
+            for lane in lanes
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def _labels(pairs):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+class StreamTimer:
+    """
+    Wraps a response body iterator to split the time spent waiting on the network from the
+    time the consumer spends on each chunk; also counts the bytes read.
+    """
+
+    def __init__(self):
+        self.read_seconds = 0.0
+        self.bytes = 0
+
+    def wrap(self, chunks):
+        iterator = iter(chunks)
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.read_seconds += time.perf_counter() - start
+            self.bytes += len(chunk)
+            yield chunk
+
+    async def wrap_async(self, chunks):
+        iterator = chunks.__aiter__()
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                self.read_seconds += time.perf_counter() - start
+            self.bytes += len(chunk)
+            yield chunk
+
+
+class HttpxTrace:
+    """
+    httpx "trace" request extension: records connect, TLS handshake and time to first byte
+    (request sent to response headers received) for one request.
+    """
+
+    def __init__(self, metrics, lane=None, **labels):
+        self.metrics = metrics
+        self.lane = lane
+        self.labels = labels
+        self.headers_at = None  # perf_counter() when the response headers arrived
+        self._started = {}
+
+    async def __call__(self, name, info):
+        event, _, phase = name.rpartition(".")
+        now = time.perf_counter()
+        if phase == "started":
+            self._started[event] = now
+            return
+        if phase != "complete":
+            return
+        if event.endswith("connect_tcp") or event.endswith("connect_unix_socket"):
+            stage = "connect"
+        elif event.endswith("start_tls"):
+            stage = "tls"
+        elif event.endswith("receive_response_headers"):
+            stage = "ttfb"
+            self.headers_at = now
+            event = event.replace("receive_response_headers", "send_request_headers")
+        else:
+            return
+        start = self._started.get(event)
+        if start is not None:
+            self.metrics.observe(stage, now - start, self.lane, **self.labels)
+
+
+# Timings and counters for this process
+stage_metrics = StageMetrics()
+
+
+def add_metrics_args(parser):
+    """The --metrics/--trace options shared by the scrapers."""
+    parser.add_argument(
+        "--metrics", metavar="PATH",
+        help="write per-stage timing histograms and counters at the end of the run (.json, or .prom for Prometheus text)"
+    )
+    parser.add_argument(
+        "--trace", metavar="PATH",
+        help="write a Chrome trace of every stage for timeline viewing (chrome://tracing or ui.perfetto.dev)"
+    )
+
+
+def export_metrics(args, metrics=None):
+    """Write the files requested with --metrics/--trace."""
+    metrics = metrics or stage_metrics
+    if args.metrics:
+        metrics.write(args.metrics)
+        print(f"  Metrics written to {args.metrics}")
+    if args.trace:
+        metrics.write_trace(args.trace)
+        print(f"  Trace written to {args.trace}")
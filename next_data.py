@@ -0,0 +1,192 @@
+import json
+import logging
+from collections import Counter
+
+# The search page embeds its data as <script id="__NEXT_DATA__" type="application/json">...</script>.
+# Next.js escapes "</" inside the payload, so the first "</script>" after the tag closes it.
+_MARKERS = (b'id="__NEXT_DATA__"', b"id='__NEXT_DATA__'", b"id=__NEXT_DATA__")
+_SCRIPT_OPEN = b"<script"
+_SCRIPT_CLOSE = b"</script>"
+
+FAST_PATH = "fast"
+STREAM_PATH = "stream"
+FALLBACK_PATH = "bs4"
+
+# How many pages were extracted by each path during this process
+extract_stats = Counter()
+
+_fallback_warned = False
+
+
+def _find_marker(content, start=0):
+    """Return the offset of the first __NEXT_DATA__ id attribute at or after start, or -1."""
+    found = [pos for pos in (content.find(m, start) for m in _MARKERS) if pos != -1]
+    return min(found) if found else -1
+
+
+def _slice_at(content, marker):
+    """Return the script body that starts after the tag holding marker, or None if it is incomplete."""
+    tag_start = content.rfind(_SCRIPT_OPEN, 0, marker)
+    # The marker must belong to an open <script ...> tag, not to some other element
+    if tag_start == -1 or content.find(b">", tag_start, marker) != -1:
+        return None
+    body_start = content.find(b">", marker)
+    if body_start == -1:
+        return None
+    body_end = content.find(_SCRIPT_CLOSE, body_start)
+    if body_end == -1:
+        return None
+    return bytes(content[body_start + 1:body_end])
+
+
+def is_truncated(content, marker=None):
+    """
+    True if content opens the __NEXT_DATA__ script but ends before its closing </script>,
+    i.e. the body was cut off (a dropped connection), not a page without the payload.
+    """
+    if marker is None:
+        marker = _find_marker(content)
+    if marker == -1:
+        return False
+    body_start = content.find(b">", marker)
+    return body_start == -1 or content.find(_SCRIPT_CLOSE, body_start) == -1
+
+
+def _decode(payload):
+    text = payload.decode("utf-8", errors="replace").strip()
+    return text or None
+
+
+def _bs4_extract(content):
+    """Old full-parse path, kept for pages whose markup the fast path does not recognise."""
+    global _fallback_warned
+    from bs4 import BeautifulSoup
+
+    if not _fallback_warned:
+        logging.warning("__NEXT_DATA__ fast path failed, falling back to BeautifulSoup (page layout may have changed)")
+        _fallback_warned = True
+    soup = BeautifulSoup(bytes(content), "html.parser")
+    script_tag = soup.find("script", id="__NEXT_DATA__")
+    if not script_tag or not script_tag.string:
+        return None
+    return script_tag.string
+
+
+def _record(text, path):
+    extract_stats[path if text else "missing"] += 1
+    return text, (path if text else None)
+
+
+def extract_next_data(content):
+    """
+    Return (json_text, path) for the __NEXT_DATA__ payload in a full response body.
+    path is FAST_PATH or FALLBACK_PATH, or None when the page has no payload or it is cut off.
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    marker = _find_marker(content)
+    if marker != -1:
+        payload = _slice_at(content, marker)
+        if payload is not None:
+            return _record(_decode(payload), FAST_PATH)
+        if is_truncated(content, marker):
+            extract_stats["truncated"] += 1
+            return None, None
+    return _record(_bs4_extract(content), FALLBACK_PATH)
+
+
+class NextDataScanner:
+    """
+    Incremental scanner fed with body chunks as they arrive.
+    feed() returns True once the closing </script> has been seen, so the caller can stop reading.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.payload = None
+        self._marker = -1
+        self._search_from = 0
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self._marker == -1:
+            self._marker = _find_marker(self.buffer, self._search_from)
+            if self._marker == -1:
+                # Keep an overlap so a marker split across chunks is still found
+                self._search_from = max(0, len(self.buffer) - len(_MARKERS[0]))
+                return False
+        self.payload = _slice_at(self.buffer, self._marker)
+        return self.payload is not None
+
+    @property
+    def truncated(self):
+        """Once the body is finished: it opened the __NEXT_DATA__ script but never closed it."""
+        return self.payload is None and self._marker != -1 and is_truncated(self.buffer, self._marker)
+
+    def result(self):
+        """Return (json_text, path) once the body is finished or the scanner stopped early."""
+        if self.payload is not None:
+            return _record(_decode(self.payload), STREAM_PATH)
+        if self.truncated:
+            # A cut-off payload is a failed download for the caller to retry, not a page to parse
+            extract_stats["truncated"] += 1
+            return None, None
+        return _record(_bs4_extract(self.buffer), FALLBACK_PATH)
+
+
+def extract_next_data_stream(chunks, scanner=None):
+    """
+    Read chunks from a sync iterator until the payload is complete; return (json_text, path).
+    Pass a scanner to keep access to the bytes read (scanner.buffer), e.g. for caching.
+    """
+    scanner = scanner or NextDataScanner()
+    for chunk in chunks:
+        if scanner.feed(chunk):
+            break
+    return scanner.result()
+
+
+async def extract_next_data_async(chunks, scanner=None):
+    """Async variant of extract_next_data_stream for httpx's aiter_bytes()."""
+    scanner = scanner or NextDataScanner()
+    async for chunk in chunks:
+        if scanner.feed(chunk):
+            break
+    return scanner.result()
+
+
+def format_extract_stats():
+    """One-line summary of which extraction paths were used, for the end-of-run report."""
+    if not extract_stats:
+        return "no pages extracted"
+    return ", ".join(f"{path}={count}" for path, count in sorted(extract_stats.items()))
+
+
+def extract_search_meta(json_data):
+    """
+    Return {"total_count", "page_count", "per_page"} from the searchResult metadata, or None.
+    Missing counts are left as None; page_count is derived from total_count when only that is given.
+    """
+    if not json_data:
+        return None
+    try:
+        search_result = json.loads(json_data)['props']['pageProps']['searchResult']
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return None
+
+    meta = search_result.get("meta") or {}
+    total_count = _as_int(meta.get("total_count", search_result.get("total_count")))
+    per_page = _as_int(meta.get("per_page")) or len(search_result.get("properties") or []) or None
+    page_count = _as_int(meta.get("page_count"))
+    if page_count is None and total_count is not None and per_page:
+        page_count = -(-total_count // per_page)
+    if total_count is None and page_count is None:
+        return None
+    return {"total_count": total_count, "page_count": page_count, "per_page": per_page}
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,105 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+class StageStats:
+    """Busy time of one pipeline stage, reported as utilisation of its available slots."""
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.busy = 0.0
+        self.items = 0
+        self.waiting = 0.0  # time spent blocked on the next stage (backpressure)
+
+    def add(self, seconds, items=1):
+        self.busy += seconds
+        self.items += items
+
+    def report(self, wall):
+        utilisation = self.busy / (wall * self.capacity) if wall > 0 else 0.0
+        line = f"{self.name}: {self.items} pages, {utilisation:.0%} of {self.capacity} slots busy"
+        if self.waiting:
+            line += f", {self.waiting:.1f}s blocked on backpressure"
+        return line
+
+
+class ParsePipeline:
+    """
+    Download -> bounded queue -> process pool.
+
+    fetch_bytes(page, limiter) is a coroutine that only does I/O and returns the raw body (or None);
+    it must hold limiter (download_semaphore, whose size is the download stage's capacity) around
+    each request only, not while it backs off between retries.
+    parse_fn(content, with_meta) runs in a worker process and must be a picklable top-level function.
+    At most queue_size + workers pages are downloaded but not yet parsed; further downloads wait
+    for a parser to free a slot.
+    """
+
+    def __init__(self, fetch_bytes, parse_fn, workers, download_semaphore, download_slots, queue_size=None):
+        self.fetch_bytes = fetch_bytes
+        self.download_semaphore = download_semaphore
+        self.parse_fn = parse_fn
+        self.workers = max(1, workers)
+        self.queue = asyncio.Queue(maxsize=queue_size or self.workers * 2)
+        self._slots = asyncio.Semaphore(self.queue.maxsize + self.workers)
+        self.executor = None
+        self._consumers = []
+        self.download_stats = StageStats("download", download_slots)
+        self.parse_stats = StageStats("parse", self.workers)
+        self._started = None
+
+    async def __aenter__(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._consumers = [asyncio.ensure_future(self._consume()) for _ in range(self.workers)]
+        self._started = time.perf_counter()
+        return self
+
+    async def __aexit__(self, *exc):
+        for consumer in self._consumers:
+            consumer.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    async def process(self, page):
+        """Download page and return parse_fn's result once a worker has parsed it."""
+        # A download only starts once a parse slot is free, so downloads pause when parsers fall behind
+        wait_start = time.perf_counter()
+        await self._slots.acquire()
+        self.download_stats.waiting += time.perf_counter() - wait_start
+        try:
+            start = time.perf_counter()
+            content = await self.fetch_bytes(page, self.download_semaphore)
+            self.download_stats.add(time.perf_counter() - start)
+        except BaseException:
+            self._slots.release()
+            raise
+        try:
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put((content, page == 1, future))
+            return await future
+        finally:
+            self._slots.release()
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            content, with_meta, future = await self.queue.get()
+            start = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(self.executor, self.parse_fn, content, with_meta)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.parse_stats.add(time.perf_counter() - start)
+                self.queue.task_done()
+
+    def report(self):
+        """Per-stage utilisation lines for the end-of-run summary."""
+        wall = time.perf_counter() - self._started if self._started else 0.0
+        return [self.download_stats.report(wall), self.parse_stats.report(wall)]
@@ -0,0 +1,235 @@
+import asyncio
+import csv
+import logging
+import random
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Config (retries of the async search and detail fetchers; main.py keeps its own REQUEST_RETRIES)
+RETRY_ATTEMPTS = 4  # per request, for 429/5xx, timeouts and cut-off bodies
+RETRY_BASE_DELAY = 0.5  # seconds, doubled per attempt with full jitter
+RETRY_MAX_DELAY = 30
+
+
+class TokenBucket:
+    """Async token bucket: `rate` requests per second on average, bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # The lock keeps waiters in FIFO order so one host cannot starve another's queue
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class HostGate:
+    """
+    Drop-in replacement for the asyncio.Semaphore passed to fetch_properties:
+    entering it takes a token from the host's bucket and then a slot from the shared concurrency cap.
+    Waiting for a token happens outside the cap, so a throttled host does not hold slots other hosts could use.
+    """
+
+    def __init__(self, semaphore, bucket):
+        self.semaphore = semaphore
+        self.bucket = bucket
+
+    def record(self, latency, ok, retry_after=None):
+        record_outcome(self.semaphore, latency, ok, retry_after)
+
+    async def __aenter__(self):
+        await self.bucket.acquire()
+        await self.semaphore.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.semaphore.release()
+
+
+class HostRateLimiter:
+    """
+    One TokenBucket per host behind a single global concurrency cap.
+    Pass an AdaptiveLimiter as semaphore to let the cap adapt instead of staying fixed.
+    """
+
+    def __init__(self, rate: float, burst: int, concurrency: int, semaphore=None):
+        self.rate = rate
+        self.burst = burst
+        self.semaphore = semaphore or asyncio.Semaphore(concurrency)
+        self._buckets = {}
+
+    def gate(self, url_or_host: str) -> HostGate:
+        host = urlsplit(url_or_host).netloc or url_or_host
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+        return HostGate(self.semaphore, bucket)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit that can stand in for an asyncio.Semaphore.
+
+    Callers report each request with record(): while latency stays within latency_factor of the
+    best seen and errors stay rare, the limit grows by about one slot per window of successful
+    requests; a throttled, 5xx or timed-out request halves it (at most once per cooldown), and a
+    Retry-After pauses new requests until it has passed. Every change of the limit is kept in
+    history so a run can be tuned afterwards.
+    """
+
+    def __init__(self, initial=3, min_limit=1, max_limit=16, latency_factor=3.0, decrease=0.5, max_error_rate=0.05):
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_factor = latency_factor
+        self.decrease = decrease
+        self.max_error_rate = max_error_rate
+        self.in_flight = 0
+        self.stats = Counter()
+        self._waiters = deque()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._best_latency = None
+        self._latency = None  # EWMA
+        self._error_rate = 0.0  # EWMA of failures
+        self._started = time.monotonic()
+        self.history = [(0.0, int(self.limit))]
+
+    def _slots(self):
+        return int(self.limit)
+
+    async def acquire(self):
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            if self.in_flight < self._slots():
+                self.in_flight += 1
+                return
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Woken but cancelled before running: hand the wakeup on, or the freed slot is lost
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+    def _wake(self):
+        free = self._slots() - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def record(self, latency, ok, retry_after=None):
+        """Feed back one request: ok=False for 429/5xx/timeouts, with the server's Retry-After if any."""
+        now = time.monotonic()
+        old = self._slots()
+        self._error_rate = 0.9 * self._error_rate + (0.0 if ok else 0.1)
+        if ok:
+            self.stats["ok"] += 1
+            self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+            self._best_latency = latency if self._best_latency is None else min(self._best_latency, latency)
+            healthy = self._latency <= self._best_latency * self.latency_factor
+            if healthy and self._error_rate <= self.max_error_rate:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        else:
+            self.stats["failed"] += 1
+            # One decrease per cooldown, so a burst of failures from the same window only halves once
+            cooldown = max(1.0, self._latency or 1.0)
+            if now - self._last_decrease >= cooldown:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self._last_decrease = now
+            if retry_after:
+                self.stats["retry_after"] += 1
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+        if self._slots() != old:
+            self.history.append((round(now - self._started, 3), self._slots()))
+            logger.info(f"concurrency {old} -> {self._slots()} (latency {self._latency or 0:.2f}s, error rate {self._error_rate:.0%})")
+            self._wake()
+
+    def write_history(self, path):
+        """Write the limit over time as CSV (seconds since start, limit)."""
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["seconds", "concurrency"])
+            writer.writerows(self.history)
+
+    def format_stats(self):
+        """One-line summary of how the limit moved during the run."""
+        limits = [limit for _, limit in self.history]
+        return (
+            f"concurrency {limits[0]} -> {limits[-1]} (min {min(limits)}, max {max(limits)}), "
+            f"{self.stats['ok']} ok, {self.stats['failed']} throttled/failed, "
+            f"{self.stats['retry_after']} Retry-After pauses"
+        )
+
+
+def is_retryable(status_code):
+    """Whether a response status is worth retrying: throttled (429) or a server error."""
+    return status_code == 429 or status_code >= 500
+
+
+def record_outcome(limiter, latency, ok, retry_after=None):
+    """Report a request to limiter if it adapts (AdaptiveLimiter or a HostGate in front of one)."""
+    record = getattr(limiter, "record", None)
+    if record is not None:
+        record(latency, ok, retry_after)
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY, retry_after=None):
+    """Full-jitter exponential backoff for retry number attempt (0-based), never shorter than Retry-After."""
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    return max(delay, retry_after or 0.0)
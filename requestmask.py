@@ -1,19 +1,11 @@
-import logging
-from fake_useragent import UserAgent
-from settings import SCRAPER_API_KEY, USE_SCRAPER_API
-
-ua = UserAgent()
+from search_options import SEARCH_FILTERS
+from settings import SCRAPER_API_KEY, SEARCH_BASE_URL, USE_SCRAPER_API
+from user_agents import random_user_agent
 
 
 def get_random_user_agent():
-    """Return a random User-Agent string."""
-    try:
-        return ua.random
-    except Exception as e:
-        logging.warning(f"Failed to get random User-Agent: {e}")
-        # fallback to a simple, common user agent
-        return "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 " \
-               "(KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36"
+    """Return a random User-Agent string from the local pool (no dataset load, see user_agents.py)."""
+    return random_user_agent()
 
 def get_random_headers(extra_headers: dict = None) -> dict:
     """Generate headers for HTTP request with optional override."""
@@ -41,3 +33,23 @@ def build_url(original_url: str) -> str:
     return original_url
 
 
+def request_route() -> str:
+    """Label for where requests go ("scraperapi" or "direct"), used to tag network timings."""
+    return "scraperapi" if USE_SCRAPER_API else "direct"
+
+
+def build_search_url(query: dict, page: int) -> str:
+    """
+    Build the propertyfinder search URL for a query and page (before build_url wraps it).
+    Optional "price_min"/"price_max" (inclusive) and "bedrooms" keys narrow the search; the
+    sharding planner uses them to split queries that are too large for the page cap.
+    """
+    url = (
+        f"{SEARCH_BASE_URL.format(country=query['country'])}/en/search"
+        f"?l={query['location']}&c={query['category']}&fu={query['furnishing']}"
+        f"&rp={query['rental_period']}&ob={query['sort_by']}"
+    )
+    for key, param in SEARCH_FILTERS:
+        if query.get(key) is not None:
+            url += f"&{param}={query[key]}"
+    return f"{url}&page={page}"
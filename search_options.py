@@ -0,0 +1,27 @@
+# Search parameter choices offered by propertyfinder, shared by the interactive prompt and batch jobs.
+# Location id 0 is a placeholder for cities whose id is not known yet.
+
+COUNTRIES = {
+    "ae": "United Arab Emirates",
+    "qa": "Qatar",
+    "bh": "Bahrain",
+    "eg": "Egypt",
+    "sa": "Saudi Arabia"
+}
+LOCATIONS = {
+    "ae": {1: "Dubai", 6: "Abu Dhabi", 4: "Sharjah", 5: "Ajman", 3: "Ras Al Khaimah", 8: "Al Ain", 7: "Fujairah", 2: "Umm Al Quwain"},
+    "qa": {9: "Doha", 4: "Lusail", 2: "Al Wakra", 5: "Umm Salal Mohammad", 6: "Al Shamal", 3: "Al Khor", 7: "Al Daayen"},
+    "bh": {34: "Manama", 49: "Riffa", 12: "Muharraq", 00: "Isa Town", 00: "Hamad Town", 00: "Sitra", 00: "Jidhafs"},
+    "eg": {2254: "Cairo", 20663: "Giza", 30754: "Alexandria", 00: "Mansoura", 00: "Tanta", 00: "Asyut", 00: "Ismailia"},
+    "sa": {8216: "Riyadh", 2658: "Jeddah", 00: "Mecca", 00: "Medina", 00: "Dammam", 00: "Khobar", 00: "Dhahran"}
+}
+CATEGORIES = {1: "buy", 2: "rent", 3: "commercial-buy", 4: "commercial-rent", 5: "new-projects"}
+FURNISHING = {0: "All furnishings", 1: "Furnished", 2: "Unfurnished", 3: "Partly furnished"}
+RENTAL_PERIODS = {"y": "yearly", "m": "monthly", "w": "weekly", "d": "daily"}
+BEDROOMS = {0: "Studio", 1: "1", 2: "2", 3: "3", 4: "4", 5: "5", 6: "6", 7: "7+"}
+SORT_BY_OPTIONS = {"mr": "Featured", "nd": "Newest", "pa": "Price (low)", "pd": "Price (high)", "ba": "Beds (least)", "bd": "Beds (most)"}
+
+# Optional query keys -> search URL parameters (price bounds are inclusive, "bdr[]" URL-encoded)
+SEARCH_FILTERS = (("price_min", "pf"), ("price_max", "pt"), ("bedrooms", "bdr%5B%5D"))
+
+DEFAULT_QUERY = {"category": 1, "furnishing": 0, "rental_period": "y", "sort_by": "mr"}
@@ -8,5 +8,46 @@ GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID")
 
 USE_SCRAPER_API = False
 
+# Site root for search URLs; {country} is the country code (override to point at a replay server)
+SEARCH_BASE_URL = os.getenv("SEARCH_BASE_URL", "https://www.propertyfinder.{country}")
+
+# Optional User-Agent pool, one per line (python user_agents.py writes it); built-in pool otherwise
+USER_AGENTS_FILE = os.path.join(".cache", "user_agents.txt")
+
 # Proxy settings
 SCRAPER_API_KEY = os.getenv("SCRAPER_API_KEY")
+
+# Local HTTP response cache (shared by main.py and main_asyncio.py)
+CACHE_ENABLED = True
+CACHE_PATH = os.path.join(".cache", "responses.sqlite3")
+CACHE_TTL = 15 * 60  # seconds a cached page is served without revalidation
+CACHE_MAX_BYTES = 200 * 1024 * 1024  # compressed size before least recently used pages are evicted
+
+# Local listing store with price history across runs (--output store, jobs.py --store, listing_store.py)
+LISTING_STORE_PATH = os.path.join("data", "listings.sqlite3")
+
+# Incremental "new listings only" crawl (--new-only): per-query watermark of what earlier runs returned
+WATERMARK_PATH = os.path.join(".cache", "watermarks.json")
+WATERMARK_MAX_IDS = 1000  # most recent listing IDs remembered per query
+
+# Google Sheets upload mode: incremental sync by listing ID instead of clear-and-rewrite
+SHEET_INCREMENTAL = False
+SHEET_REMOVE_DELISTED = False  # in incremental mode, delete rows whose listing is no longer returned
+SHEET_INDEX_DIR = os.path.join(".cache", "sheet_index")  # per-tab row hashes from the last sync
+
+# Background Sheets uploader (used by the sheet output and full uploads)
+SHEET_REQUESTS_PER_MINUTE = 60  # Sheets API quota per user; calls are paced to stay under it
+SHEET_RETRY_ATTEMPTS = 6  # per API call, on 429/5xx and connection errors
+SHEET_TAB_MAX_CELLS = 5_000_000  # rows continue in "<tab> (2)", ... past this
+SHEET_MAX_CELLS = 10_000_000  # Google's limit for the whole spreadsheet, shared by all its tabs
+
+# Shared work queue for distributed crawls (work_queue.py)
+WORK_QUEUE_PATH = os.path.join("data", "work_queue.sqlite3")
+
+# Run journal: completed pages saved as they arrive so --resume can continue an interrupted run
+JOURNAL_DIR = os.path.join(".cache", "runs")
+JOURNAL_KEEP_RUNS = 10  # uploaded runs kept; older ones are deleted when a new run starts
+
+# Detail-page enrichment (--enrich, enrich.py): parsed detail pages cached per listing
+DETAIL_CACHE_PATH = os.path.join(".cache", "details.sqlite3")
+DETAIL_CACHE_TTL = 7 * 24 * 3600  # seconds before an unchanged listing's detail page is fetched again
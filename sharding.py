@@ -0,0 +1,192 @@
+import asyncio
+import math
+from dataclasses import dataclass
+from typing import Optional
+
+from crawler import MAX_PAGES, MAX_PROPERTIES_PER_PAGE, crawl_query, extract_property_data, fetch_properties
+from next_data import extract_search_meta
+from search_options import BEDROOMS
+from sinks import ListSink, UniqueSink
+
+# Config
+PAGE_CAP = MAX_PAGES * MAX_PROPERTIES_PER_PAGE  # most listings one query can page through
+MIN_PRICE_BAND = 1  # price bands this narrow are not bisected further
+OVERLAP_TOLERANCE = 0.05  # child counts summing to more than this over the parent mean the filter was ignored
+SHARD_DIMENSIONS = ("price", "bedrooms")  # default split order; "location" needs sub_locations
+
+
+@dataclass(slots=True)
+class Shard:
+    """One slice of a query and the result count the site reports for it."""
+
+    query: dict
+    count: Optional[int]  # None when page 1 could not be read
+    truncated: bool = False  # still over PAGE_CAP after every split was tried
+    found: Optional[int] = None  # listings written when the shard was crawled (before de-duplication)
+
+
+@dataclass(slots=True)
+class ShardPlan:
+    query: dict
+    total: Optional[int]  # result count the site reports for the whole query
+    shards: list
+
+    @property
+    def planned(self):
+        """Listings the shards should return between them, by the site's counts."""
+        return sum(shard.count or 0 for shard in self.shards)
+
+    @property
+    def complete(self):
+        """Every shard fits under the page cap and was counted."""
+        return all(shard.count is not None and not shard.truncated for shard in self.shards)
+
+
+def describe_shard(query):
+    parts = []
+    if query.get("price_min") is not None or query.get("price_max") is not None:
+        low = query.get("price_min")
+        high = query.get("price_max")
+        parts.append(f"price {low if low is not None else '…'}-{high if high is not None else '…'}")
+    if query.get("bedrooms") is not None:
+        parts.append(f"{BEDROOMS.get(query['bedrooms'], query['bedrooms'])} bed")
+    parts.append(f"location {query['location']}")
+    return ", ".join(parts)
+
+
+async def fetch_count(query, client, semaphore):
+    """The site's result count for a query, read from page 1 (None if the page failed)."""
+    _, json_data = await fetch_properties(query, 1, client, semaphore)
+    if json_data is None:
+        return None
+    meta = extract_search_meta(json_data)
+    if meta and meta["total_count"] is not None:
+        return meta["total_count"]
+    # No metadata: a short first page is still an exact count
+    listings = extract_property_data(json_data)
+    return len(listings) if len(listings) < MAX_PROPERTIES_PER_PAGE else None
+
+
+async def price_bounds(query, client, semaphore):
+    """(lowest, highest) price in the query's results, from page 1 sorted by price each way."""
+    async def edge(sort_by):
+        _, json_data = await fetch_properties({**query, "sort_by": sort_by}, 1, client, semaphore)
+        return [listing.price for listing in extract_property_data(json_data) if listing.price]
+
+    # Featured listings can lead either order, so take the extreme of the whole page
+    low, high = await asyncio.gather(edge("pa"), edge("pd"))
+    if not low or not high:
+        return None
+    return int(min(low)), int(math.ceil(max(high)))
+
+
+def split_price(query, bounds):
+    """
+    Two queries covering the query's price band, split at its geometric midpoint (prices are
+    skewed, so this halves the count better than the arithmetic one). The outermost bands stay
+    open-ended so listings outside the sampled bounds are still covered.
+    """
+    if bounds is None:
+        return None
+    low = query.get("price_min", bounds[0])
+    high = query.get("price_max", bounds[1])
+    if high - low <= MIN_PRICE_BAND:
+        return None
+    middle = int(math.sqrt(low * high)) if low > 0 else (low + high) // 2
+    middle = min(max(middle, low + 1), high - 1)
+    # Both bounds are inclusive and prices need not be whole numbers, so the halves share the
+    # middle price: ending one at middle and starting the next at middle + 1 would lose any price
+    # in between. Listings priced exactly middle come back from both and are de-duplicated by ID.
+    return [{**query, "price_max": middle}, {**query, "price_min": middle}]
+
+
+def split_bedrooms(query):
+    if query.get("bedrooms") is not None:
+        return None
+    return [{**query, "bedrooms": bedrooms} for bedrooms in BEDROOMS]
+
+
+def split_location(query, sub_locations):
+    if not sub_locations or query["location"] in sub_locations:
+        return None
+    return [{**query, "location": location} for location in sub_locations]
+
+
+async def plan_shards(query, client, semaphore, dimensions=SHARD_DIMENSIONS, sub_locations=None, capacity=PAGE_CAP):
+    """
+    Split query into shards that each fit under the page cap, using the result count the site
+    reports on page 1 of every candidate; only neighbouring price bands overlap, at their shared
+    boundary price. dimensions is tried in order for each
+    shard still over the cap: "price" bisects the price band (repeatedly), "bedrooms" splits by
+    bedroom count and "location" into sub_locations (each once). Shards with no results are dropped.
+    """
+    total = await fetch_count(query, client, semaphore)
+    bounds = await price_bounds(query, client, semaphore) if "price" in dimensions else None
+
+    def children(query):
+        for dimension in dimensions:
+            if dimension == "price":
+                split = split_price(query, bounds)
+            elif dimension == "bedrooms":
+                split = split_bedrooms(query)
+            elif dimension == "location":
+                split = split_location(query, sub_locations)
+            else:
+                raise ValueError(f"Unknown shard dimension: {dimension!r}")
+            if split:
+                return split
+        return None
+
+    async def plan(query, count):
+        if count is None or count <= capacity:
+            return [Shard(query, count)]
+        queries = children(query)
+        if queries is None:
+            return [Shard(query, count, truncated=True)]
+        counts = await asyncio.gather(*(fetch_count(child, client, semaphore) for child in queries))
+        if sum(n or 0 for n in counts) > count * (1 + OVERLAP_TOLERANCE):
+            # The shards overlap, so the site did not apply the filter; splitting further would never end
+            return [Shard(query, count, truncated=True)]
+        nested = await asyncio.gather(*(plan(child, n) for child, n in zip(queries, counts) if n != 0))
+        return [shard for shards in nested for shard in shards]
+
+    return ShardPlan(query, total, await plan({**query, "sharded": True}, total))
+
+
+async def run_shards(plan, client, semaphore, sink=None, pbar=None):
+    """
+    Crawl every shard concurrently into sink, each listing ID written once.
+    Returns the UniqueSink wrapper (count, duplicates); without a sink the listings are kept
+    in memory in its .sink.records.
+    """
+    unique = UniqueSink(sink if sink is not None else ListSink())
+
+    async def run(shard):
+        shard.found = await crawl_query(shard.query, client, semaphore, sink=unique)
+        if pbar is not None:
+            pbar.set_postfix(unique=unique.count, duplicates=unique.duplicates)
+            pbar.update(1)
+
+    await asyncio.gather(*(run(shard) for shard in plan.shards))
+    return unique
+
+
+def format_plan(plan):
+    lines = [f"{len(plan.shards)} shards for {plan.total} reported listings (cap {PAGE_CAP} per shard)"]
+    for shard in plan.shards:
+        flag = " ⚠ over the cap" if shard.truncated else " ⚠ count unknown" if shard.count is None else ""
+        lines.append(f"  {describe_shard(shard.query)}: {shard.count}{flag}")
+    return lines
+
+
+def format_coverage(plan, unique):
+    """Coverage of the site-reported total by the shard plan and by the listings actually crawled."""
+    line = f"Coverage: {unique.count} unique listings"
+    if plan.total:
+        line += f" of {plan.total} reported ({unique.count / plan.total:.1%})"
+        line += f", shards planned {plan.planned} ({plan.planned / plan.total:.1%})"
+    line += f", {unique.duplicates} duplicates skipped"
+    truncated = sum(shard.truncated for shard in plan.shards)
+    if truncated:
+        line += f", {truncated} shards still over the {PAGE_CAP} cap"
+    return line
@@ -0,0 +1,475 @@
+import csv
+import json
+import logging
+import os
+import sqlite3
+from contextlib import nullcontext
+from google_sheet import UPLOAD_BATCH_ROWS
+from listing import ENRICHMENT_FIELDS, LISTING_FIELDS, to_display_row
+from listing_store import ListingStore
+from metrics import stage_metrics
+from settings import LISTING_STORE_PATH, SHEET_INCREMENTAL, SHEET_REMOVE_DELISTED
+
+PARQUET_BATCH_ROWS = 5000  # rows per Parquet row group
+
+
+class ResultSink:
+    """
+    Destination for scraped Listings, written page by page as the crawl runs so nothing
+    has to hold the whole result set. Each sink formats listings for its own format here at the
+    boundary: typed values for files and databases, display strings for the sheet.
+    Use as a context manager; close() flushes.
+    Time spent writing and closing is recorded as the "upload" stage, labelled with kind.
+    """
+
+    name = "sink"
+    kind = None  # metrics label; None leaves the sink untimed
+    reached_end = False  # set through finish_crawl()
+
+    def __init__(self):
+        self.count = 0
+
+    def _timed(self):
+        return stage_metrics.time("upload", sink=self.kind) if self.kind else nullcontext()
+
+    def write(self, records):
+        """Write one page of Listings."""
+        if records:
+            with self._timed():
+                self._write(records)
+            self.count += len(records)
+
+    def _write(self, records):
+        raise NotImplementedError
+
+    def finish_crawl(self, reached_end):
+        """Called by the crawl before close(): whether every page up to the end of the result set was written."""
+        self.reached_end = reached_end
+
+    async def drain(self):
+        """Awaited by the async crawl after writing; a sink that writes in the background waits here for room."""
+
+    def close(self):
+        with self._timed():
+            self._close()
+
+    def _close(self):
+        pass
+
+    def summary(self):
+        return f"{self.name}: {self.count} records"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ListSink(ResultSink):
+    """Keeps Listings in memory, for callers that want the whole result as a list."""
+
+    name = "memory"
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def _write(self, records):
+        self.records.extend(records)
+
+
+def _flat_dict(record):
+    """as_dict() with the list/dict enrichment fields as JSON text, for flat formats (CSV, SQLite)."""
+    data = record.as_dict()
+    for name in ENRICHMENT_FIELDS:
+        if data[name] is not None:
+            data[name] = json.dumps(data[name], ensure_ascii=False)
+    return data
+
+
+class NdjsonSink(ResultSink):
+    kind = "ndjson"
+
+    def __init__(self, path):
+        super().__init__()
+        self.name = path
+        self._file = open(path, "w", encoding="utf-8")
+
+    def _write(self, records):
+        self._file.writelines(json.dumps(record.as_dict(), ensure_ascii=False) + "\n" for record in records)
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+
+class CsvSink(ResultSink):
+    kind = "csv"
+
+    def __init__(self, path):
+        super().__init__()
+        self.name = path
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=LISTING_FIELDS)
+        self._writer.writeheader()
+
+    def _write(self, records):
+        self._writer.writerows(_flat_dict(record) for record in records)
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+class SqliteSink(ResultSink):
+    """One typed column per Listing field; rows are upserted by id, one transaction per page."""
+
+    kind = "sqlite"
+
+    def __init__(self, path, table="properties"):
+        super().__init__()
+        self.name = path
+        self._db = sqlite3.connect(path)
+        columns = ", ".join(
+            f"{_quote(name)} {_SQLITE_TYPES.get(name, 'TEXT')}{' PRIMARY KEY' if name == 'id' else ''}"
+            for name in LISTING_FIELDS
+        )
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table)} ({columns})")
+        # Tables written before a field was added get the missing column
+        existing = {row[1] for row in self._db.execute(f"PRAGMA table_info({_quote(table)})")}
+        for name in LISTING_FIELDS:
+            if name not in existing:
+                self._db.execute(f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(name)} {_SQLITE_TYPES.get(name, 'TEXT')}")
+        self._db.commit()
+        self._insert = (
+            f"INSERT OR REPLACE INTO {_quote(table)} ({', '.join(map(_quote, LISTING_FIELDS))})"
+            f" VALUES ({', '.join('?' * len(LISTING_FIELDS))})"
+        )
+
+    def _write(self, records):
+        with self._db:
+            self._db.executemany(self._insert, (tuple(_flat_dict(record).values()) for record in records))
+
+    def _close(self):
+        self._db.close()
+
+
+_SQLITE_TYPES = {"price": "REAL", "size": "REAL", "lat": "REAL", "lon": "REAL", "super_agent": "INTEGER"}
+
+
+class ParquetSink(ResultSink):
+    """Typed Parquet file written in row groups; needs the optional pyarrow package."""
+
+    kind = "parquet"
+
+    def __init__(self, path, batch_rows=PARQUET_BATCH_ROWS):
+        super().__init__()
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise RuntimeError("Parquet output needs pyarrow: pip install pyarrow") from None
+        self.name = path
+        self.path = path
+        self.batch_rows = batch_rows
+        self._buffer = []
+        self._writer = None
+        numeric = {"price", "size", "lat", "lon"}
+        self._schema = pa.schema([
+            (name, pa.float64() if name in numeric
+             else pa.bool_() if name == "super_agent"
+             else pa.timestamp("s", tz="UTC") if name == "listed_date"
+             else pa.string())
+            for name in LISTING_FIELDS
+        ])
+
+    def _write(self, records):
+        self._buffer.extend(records)
+        if len(self._buffer) >= self.batch_rows:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self._buffer:
+            return
+        columns = {}
+        for field in self._schema:
+            values = [getattr(record, field.name) for record in self._buffer]
+            if field.name in ENRICHMENT_FIELDS:
+                values = [None if v is None else json.dumps(v, ensure_ascii=False) for v in values]
+            elif pa.types.is_string(field.type):
+                values = [None if v is None else str(v) for v in values]
+            columns[field.name] = values
+        table = pa.Table.from_pydict(columns, schema=self._schema)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, self._schema)
+        self._writer.write_table(table)
+        self._buffer = []
+
+    def _close(self):
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class GoogleSheetSink(ResultSink):
+    """
+    Streams rows into a sheet tab through a SheetUploader, which appends UPLOAD_BATCH_ROWS-sized
+    batches from a background thread while the crawl goes on. Rows go to a staging tab that only
+    replaces the tab when the sink closes without an error, so a crawl that fails part way (or
+    writes nothing) leaves the old content in place. In incremental mode (SHEET_INCREMENTAL)
+    rows are kept until close() because sync_data_to_sheet needs the complete set; a failed crawl
+    does not sync. With append=True (new-listings-only crawls) rows go straight below the
+    existing ones.
+    """
+
+    kind = "sheet"
+
+    def __init__(self, sheet_name, batch_rows=UPLOAD_BATCH_ROWS, append=False):
+        super().__init__()
+        self.name = f"sheet '{sheet_name}'"
+        self.sheet_name = sheet_name
+        self.batch_rows = batch_rows
+        self.append = append
+        self.incremental = SHEET_INCREMENTAL and not append
+        self.sync_stats = None
+        self._uploader = None
+        self._rows = []
+        self._failed = False
+
+    def _write(self, records):
+        rows = [to_display_row(record) for record in records]
+        if self.incremental:
+            self._rows.extend(rows)
+            return
+        if self._uploader is None:
+            from google_sheet import SheetUploader
+
+            self._uploader = SheetUploader(self.sheet_name, list(rows[0]), self.batch_rows, clear=not self.append)
+        header = self._uploader.header
+        self._uploader.put([["" if r.get(key) is None else r.get(key) for key in header] for r in rows])
+
+    def __exit__(self, exc_type, *exc):
+        self._failed = exc_type is not None
+        self.close()
+
+    def _close(self):
+        if self.incremental:
+            from google_sheet import sync_data_to_sheet
+
+            if self._rows and not self._failed:
+                self.sync_stats = sync_data_to_sheet(self._rows, self.sheet_name, SHEET_REMOVE_DELISTED)
+            self._rows = []
+            return
+        if self._uploader is not None:
+            try:
+                if self._failed:
+                    self._uploader.abort()
+                else:
+                    self._uploader.close()
+            finally:
+                self.sync_stats = self._uploader.stats
+
+    def summary(self):
+        line = super().summary()
+        if self.sync_stats:
+            from google_sheet import format_sync_stats
+
+            line += f" ({format_sync_stats(self.sync_stats)})"
+        return line
+
+
+class ListingStoreSink(ResultSink):
+    """
+    Records the crawl as one run in the ListingStore, a page per transaction. The run counts as
+    complete (so unseen listings of the query are marked removed) only if the crawl reported
+    reaching the end of the result set (finish_crawl) and the sink closed without an error.
+    A new-listings-only crawl (query["incremental"]) never counts as complete, and neither does a
+    sharded one (query["sharded"]), whose shards write pages in no particular order.
+    """
+
+    kind = "store"
+
+    def __init__(self, path, query):
+        super().__init__()
+        self.name = f"store {path}"
+        self.query = query
+        self.changes = {"new": 0, "price": 0, "relisted": 0, "removed": 0}
+        self._store = ListingStore(path)
+        self._run_id = self._store.start_run(query)
+        self._failed = False
+
+    def _write(self, records):
+        for event, count in self._store.upsert(self._run_id, self.query, records).items():
+            self.changes[event] += count
+
+    def __exit__(self, exc_type, *exc):
+        self._failed = exc_type is not None
+        self.close()
+
+    def _close(self):
+        complete = self.reached_end and not self._failed and not (
+            self.query.get("incremental") or self.query.get("sharded")
+        )
+        self.changes["removed"] = self._store.finish_run(self._run_id, complete)
+        self._store.close()
+
+    def summary(self):
+        changes = ", ".join(f"{count} {event}" for event, count in self.changes.items())
+        return f"{super().summary()} (run {self._run_id}: {changes})"
+
+
+class MultiSink(ResultSink):
+    """Fans each page out to several sinks."""
+
+    def __init__(self, sinks):
+        super().__init__()
+        self.sinks = sinks
+
+    def _write(self, records):
+        for sink in self.sinks:
+            sink.write(records)
+
+    def finish_crawl(self, reached_end):
+        super().finish_crawl(reached_end)
+        for sink in self.sinks:
+            sink.finish_crawl(reached_end)
+
+    async def drain(self):
+        for sink in self.sinks:
+            await sink.drain()
+
+    def __exit__(self, *exc):
+        self._each(lambda sink: sink.__exit__(*exc))
+
+    def close(self):
+        self._each(lambda sink: sink.close())
+
+    def _each(self, close):
+        """Close every sink even if some fail (so the others still flush); the first error is raised after."""
+        error = None
+        for sink in self.sinks:
+            try:
+                close(sink)
+            except BaseException as e:
+                if error is None:
+                    error = e
+                else:
+                    logging.warning(f"Closing {sink.name} failed too: {e!r}")
+        if error is not None:
+            raise error
+
+    def summary(self):
+        return "; ".join(sink.summary() for sink in self.sinks)
+
+
+class UniqueSink(ResultSink):
+    """
+    Passes each listing ID on to sink once, for crawls whose result sets can overlap (query shards).
+    Does not close sink or pass finish_crawl() on to it; whoever opened it does.
+    """
+
+    def __init__(self, sink):
+        super().__init__()
+        self.sink = sink
+        self.name = sink.name
+        self.duplicates = 0
+        self._seen = set()
+
+    def write(self, records):
+        fresh = []
+        for listing in records:
+            if listing.id in self._seen:
+                self.duplicates += 1
+            else:
+                self._seen.add(listing.id)
+                fresh.append(listing)
+        self.sink.write(fresh)
+        self.count += len(fresh)
+
+    async def drain(self):
+        await self.sink.drain()
+
+    def summary(self):
+        return f"{self.sink.summary()}, {self.duplicates} duplicates skipped"
+
+
+_FILE_SINKS = {".ndjson": NdjsonSink, ".jsonl": NdjsonSink, ".csv": CsvSink,
+               ".sqlite": SqliteSink, ".sqlite3": SqliteSink, ".db": SqliteSink, ".parquet": ParquetSink}
+
+
+def open_sink(output, sheet_name, query=None):
+    """
+    Build a sink from an --output value: "sheet" (tab named sheet_name), "sheet:<tab>",
+    "store" or "store:<path>" (the listing store, which needs the crawl's query),
+    "geo:<path>" (a spatial index of the coordinates, saved for geo_index.py), or a file path whose extension picks the format (.ndjson/.jsonl, .csv, .sqlite/.db, .parquet).
+    """
+    if output == "sheet" or output.startswith("sheet:"):
+        # A new-listings-only crawl adds to the tab instead of replacing it
+        append = bool(query and query.get("incremental"))
+        return GoogleSheetSink(output.partition(":")[2] or sheet_name, append=append)
+    if output == "store" or output.startswith("store:"):
+        if query is None:
+            raise ValueError("The listing store output needs the crawl's query")
+        return ListingStoreSink(output.partition(":")[2] or LISTING_STORE_PATH, query)
+    if output.startswith("geo:"):
+        from geo_index import GeoIndexSink  # geo_index imports this module
+
+        if not output.partition(":")[2]:
+            raise ValueError("The geo output needs a path to save the index to: 'geo:<path>'")
+        return GeoIndexSink(path=output.partition(":")[2])
+    sink_class = _FILE_SINKS.get(os.path.splitext(output)[1].lower())
+    if sink_class is None:
+        raise ValueError(f"Unknown output {output!r}; use 'sheet', 'store', 'geo:<path>' or a .ndjson/.csv/.sqlite/.parquet path")
+    return sink_class(output)
+
+
+def open_sinks(outputs, sheet_name, query=None):
+    """One sink per --output value, combined when there are several."""
+    sinks = [open_sink(output, sheet_name, query) for output in outputs]
+    return sinks[0] if len(sinks) == 1 else MultiSink(sinks)
+
+
+class OrderedPageWriter:
+    """
+    Accepts pages in completion order and writes them to sink in page order.
+    Only out-of-order pages are held in memory. The result set ends at the first empty page
+    or the first page shorter than per_page; anything after it is dropped.
+    """
+
+    def __init__(self, sink, per_page, first_page=1):
+        self.sink = sink
+        self.per_page = per_page
+        self.next_page = first_page
+        self.last_page = None
+        self.written = 0
+        self._pending = {}
+
+    def add(self, page, records, size=None):
+        """
+        size is the page's listing count before any filtering (defaults to len(records));
+        a size below per_page ends the result set.
+        """
+        if self.last_page is not None or page < self.next_page:
+            return
+        self._pending[page] = (records, len(records) if size is None else size)
+        while self.next_page in self._pending:
+            records, size = self._pending.pop(self.next_page)
+            self.sink.write(records)
+            self.written += len(records)
+            if size < self.per_page:
+                self.last_page = self.next_page
+                self._pending.clear()
+                return
+            self.next_page += 1
+
+    @property
+    def window(self):
+        """Pages buffered waiting for an earlier page."""
+        return len(self._pending)
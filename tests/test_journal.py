@@ -0,0 +1,32 @@
+from journal import RunJournal, resumable
+from listing import listing_from_dict
+
+QUERY = {"country": "ae", "location": 1, "category": 1}
+
+
+def _listings(count):
+    return [listing_from_dict({"id": str(n)}) for n in range(count)]
+
+
+def test_crawl_with_failed_page_stays_resumable(tmp_path):
+    journal = RunJournal.create(QUERY, ["sheet"], root=str(tmp_path))
+    with resumable(journal):
+        journal.record(1, _listings(20))
+        journal.fail(2)
+        journal.finish_crawl(complete=False)
+
+    reopened = RunJournal.open(root=str(tmp_path))
+    assert reopened is not None
+    assert reopened.run_id == journal.run_id
+    assert not reopened.manifest["uploaded"]
+    assert reopened.manifest["failed"] == [2]
+
+
+def test_complete_crawl_is_marked_uploaded(tmp_path):
+    journal = RunJournal.create(QUERY, ["sheet"], root=str(tmp_path))
+    with resumable(journal):
+        journal.record(1, _listings(5))
+        journal.finish_crawl(complete=True, reached_end=True)
+
+    assert RunJournal.open(root=str(tmp_path)) is None
+    assert RunJournal.open(journal.run_id, root=str(tmp_path)).manifest["uploaded"]
@@ -0,0 +1,37 @@
+import asyncio
+
+from rate_limit import AdaptiveLimiter
+
+
+def test_cancel_after_wake_hands_slot_to_next_waiter():
+    async def run():
+        limiter = AdaptiveLimiter(initial=1, max_limit=1)
+        await limiter.acquire()
+        first = asyncio.ensure_future(limiter.acquire())
+        second = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)  # both are now queued behind the held slot
+
+        limiter.release()  # wakes first ...
+        first.cancel()  # ... which is cancelled before it gets to run
+        await asyncio.gather(first, return_exceptions=True)
+
+        await asyncio.wait_for(second, timeout=1)
+        assert limiter.in_flight == 1
+        assert not limiter._waiters
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_is_removed_from_queue():
+    async def run():
+        limiter = AdaptiveLimiter(initial=1, max_limit=1)
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert not limiter._waiters
+        limiter.release()
+        assert limiter.in_flight == 0
+
+    asyncio.run(run())
@@ -0,0 +1,42 @@
+import pytest
+
+from geo_index import load_npz
+from listing import listing_from_dict
+from sinks import ListSink, MultiSink, open_sinks
+
+
+class _ClosingSink(ListSink):
+    def __init__(self, name, closed, error=None):
+        super().__init__()
+        self.name = name
+        self._closed = closed
+        self._error = error
+
+    def _close(self):
+        self._closed.append(self.name)
+        if self._error is not None:
+            raise self._error
+
+
+def test_multisink_closes_every_sink_when_one_fails():
+    closed = []
+    sinks = [_ClosingSink("first", closed), _ClosingSink("sheet", closed, RuntimeError("quota")),
+             _ClosingSink("last", closed)]
+    with pytest.raises(RuntimeError, match="quota"):
+        with MultiSink(sinks):
+            pass
+    assert closed == ["first", "sheet", "last"]
+
+
+def test_geo_output_saves_an_index_geo_index_can_load(tmp_path):
+    pytest.importorskip("numpy")
+    path = str(tmp_path / "listings.npz")
+    listings = [listing_from_dict({"id": "1", "lat": 25.08, "lon": 55.14, "price": 100000.0}),
+                listing_from_dict({"id": "2", "lat": 25.2, "lon": 55.3}),
+                listing_from_dict({"id": "3"})]
+    with open_sinks([f"geo:{path}"], "ae") as sink:
+        sink.write(listings)
+        sink.write([{"id": "4", "lat": 25.081, "lon": 55.141, "price": None}])
+    index = load_npz(path)
+    assert len(index) == 3
+    assert index.nearest(25.08, 55.14, k=2)["id"].tolist() == ["1", "4"]
@@ -0,0 +1,68 @@
+import asyncio
+
+import httpx
+import pytest
+
+import crawler
+import http_cache
+import main
+import requestmask
+from benchmarks.fixtures import FixtureSet
+from benchmarks.replay_server import ReplayConfig, ReplayServer
+from sinks import ListSink
+
+QUERY = {"country": "ae", "location": 1, "category": 1, "furnishing": 0, "rental_period": "y", "sort_by": "mr"}
+TOTAL_RESULTS = 400
+
+
+@pytest.fixture
+def replay(monkeypatch):
+    """A local replay server that cuts off 30% of pages inside their __NEXT_DATA__ payload."""
+    server = ReplayServer(
+        FixtureSet(total_results=TOTAL_RESULTS), ReplayConfig(latency=0, jitter=0, truncate_rate=0.3, seed=1)
+    ).start()
+    monkeypatch.setattr(requestmask, "SEARCH_BASE_URL", server.base_url)
+    monkeypatch.setattr(requestmask, "USE_SCRAPER_API", False)
+    monkeypatch.setattr(http_cache, "CACHE_ENABLED", False)
+    # Enough attempts that no page runs out of them, and no real backoff
+    monkeypatch.setattr(crawler, "RETRY_ATTEMPTS", 12)
+    monkeypatch.setattr(crawler, "RETRY_BASE_DELAY", 0.001)
+    yield server
+    server.stop()
+
+
+def test_async_crawl_retries_cut_off_pages(replay):
+    async def crawl():
+        sink = ListSink()
+        async with httpx.AsyncClient() as client:
+            await crawler.crawl_query(QUERY, client, asyncio.Semaphore(4), sink=sink)
+        return sink
+
+    sink = asyncio.run(crawl())
+    assert replay.stats["truncated"] > 0
+    assert len({listing.id for listing in sink.records}) == TOTAL_RESULTS
+    assert sink.reached_end
+
+
+def test_page_bytes_retry_cut_off_pages(replay):
+    async def fetch_all():
+        async with httpx.AsyncClient() as client:
+            return await asyncio.gather(*(crawler.fetch_page_bytes(QUERY, page, client) for page in range(1, 21)))
+
+    bodies = asyncio.run(fetch_all())
+    assert replay.stats["truncated"] > 0
+    assert sum(len(crawler.parse_page_bytes(body)[0]) for body in bodies) == TOTAL_RESULTS
+
+
+def test_sync_crawl_retries_cut_off_pages(replay, monkeypatch):
+    monkeypatch.setattr(main, "REQUEST_RETRIES", 12)
+    main.reset_session()
+    before = dict(main.stage_metrics.counters)
+    sink = ListSink()
+    main.crawl_query(QUERY, sink, prefetch=2)
+    assert replay.stats["truncated"] > 0
+    # Retried as cut-off pages, not by way of a request error
+    assert main.stage_metrics.counters["truncated"] > before.get("truncated", 0)
+    assert main.stage_metrics.counters["request_errors"] == before.get("request_errors", 0)
+    assert len({listing.id for listing in sink.records}) == TOTAL_RESULTS
+    assert sink.reached_end
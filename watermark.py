@@ -0,0 +1,93 @@
+import json
+import os
+from datetime import datetime, timezone
+
+from listing import _format_date, _parse_date
+from listing_store import query_key
+from settings import WATERMARK_MAX_IDS, WATERMARK_PATH
+
+NEWEST_FIRST = "nd"  # sort_by code for "Newest"; the incremental crawl relies on this order
+
+
+class Watermark:
+    """
+    What a query had already returned in earlier runs: the newest listed_date seen and the most
+    recent listing IDs (to catch ties on that date and listings without one).
+
+    The previous run's values stay fixed while a crawl filters pages; observe() collects the new
+    high-water mark separately so pages can be checked in any order.
+    """
+
+    def __init__(self, listed_date=None, ids=()):
+        self.listed_date = listed_date
+        self.ids = dict.fromkeys(ids)  # insertion-ordered set, oldest first
+        self.complete = False  # set by the crawl when it stopped cleanly rather than on a failed page
+        self._newest = listed_date
+        self._seen = []
+
+    def is_new(self, listing):
+        if listing.id in self.ids:
+            return False
+        if self.listed_date is None or listing.listed_date is None:
+            return True
+        return listing.listed_date >= self.listed_date
+
+    def new_listings(self, listings):
+        """The listings on a page that earlier runs have not returned; empty means the page is all old."""
+        return [listing for listing in listings if self.is_new(listing)]
+
+    def observe(self, listings):
+        for listing in listings:
+            self._seen.append(listing.id)
+            if listing.listed_date is not None and (self._newest is None or listing.listed_date > self._newest):
+                self._newest = listing.listed_date
+
+    def advanced(self, max_ids=WATERMARK_MAX_IDS):
+        """
+        A Watermark for the next run, including everything observed in this one.
+        Only save it after a complete crawl, or listings on the pages that failed are skipped for good.
+        """
+        ids = dict(self.ids)
+        # Pages come newest first; re-insert from the oldest so the newest IDs survive the cap
+        for listing_id in reversed(self._seen):
+            ids.pop(listing_id, None)
+            ids[listing_id] = None
+        return Watermark(self._newest, list(ids)[-max_ids:])
+
+
+class WatermarkState:
+    """Per-query watermarks kept in a small JSON file between runs."""
+
+    def __init__(self, path=WATERMARK_PATH):
+        self.path = path
+        self._data = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._data = json.load(f)
+
+    def get(self, query):
+        entry = self._data.get(query_key(query))
+        if entry is None:
+            return Watermark()
+        return Watermark(_parse_date(entry.get("listed_date")), entry.get("ids", ()))
+
+    def update(self, query, watermark):
+        self._data[query_key(query)] = {
+            "listed_date": _format_date(watermark.listed_date) if watermark.listed_date else None,
+            "ids": list(watermark.ids),
+            "updated_at": _format_date(datetime.now(timezone.utc).replace(microsecond=0)),
+        }
+
+    def save(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Write then rename so an interrupted save never leaves a truncated file
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, indent=1)
+        os.replace(tmp, self.path)
+
+
+def incremental_query(query):
+    """The query as the incremental crawl runs it: newest first, flagged for the sinks."""
+    return {**query, "sort_by": NEWEST_FIRST, "incremental": True}
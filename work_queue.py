@@ -0,0 +1,443 @@
+"""
+Crawl through a shared queue of (query, page) items that any number of worker processes lease.
+
+    python work_queue.py enqueue --country ae --location 1 6 --category 1 2
+    python work_queue.py work --concurrency 8          # start as many of these as you like
+    python work_queue.py status
+    python work_queue.py export 3 --output sheet --output dubai.parquet
+
+Enqueueing a query adds its page 1; the worker that completes page 1 adds the remaining pages
+from its search metadata, and a short page cancels the pages after it. Workers claim items with
+time-limited leases: a lease that expires (worker died or hung) puts the item back in the queue,
+and a result is only recorded by the worker still holding the item's lease, so every page is
+recorded at most once. Items that fail MAX_ATTEMPTS times are marked failed.
+
+The only backend here is SQLite, which needs a filesystem where SQLite locking works: the workers
+are processes on one machine, sharing its local disk. Spreading them over several machines takes a
+backend over a shared server, which is not included: subclass WorkQueue, register it in
+QUEUE_BACKENDS under a scheme and pass --queue <scheme>:<target>. Lease expiry compares wall
+clocks, so such a backend needs the workers' clocks in sync.
+
+Exports write a job's pages in order up to its first short page, or up to the first page that
+is not done yet.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import httpx
+
+from crawler import (
+    CONCURRENT_REQUESTS, MAX_PAGES, MAX_PROPERTIES_PER_PAGE, extract_property_data, fetch_properties, plan_last_page,
+)
+from jobs import add_query_args, describe_query, queries_from_args
+from listing import listing_from_dict
+from next_data import extract_search_meta
+from rate_limit import AdaptiveLimiter
+from settings import WORK_QUEUE_PATH
+from sinks import open_sinks
+
+LEASE_SECONDS = 120  # longer than a page's fetch with every retry and backoff
+MAX_ATTEMPTS = 3  # leases per item (expired or failed) before it is marked failed
+POLL_INTERVAL = 2.0  # seconds an idle worker waits before looking for work again
+WORKER_CONCURRENCY = 8  # items one worker process fetches at once
+
+STATUSES = ("pending", "leased", "done", "failed", "skipped")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    query TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id INTEGER NOT NULL REFERENCES jobs (id),
+    page INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    lease_token TEXT,
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    listings INTEGER,
+    error TEXT,
+    PRIMARY KEY (job_id, page)
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (status, lease_expires);
+CREATE TABLE IF NOT EXISTS results (
+    job_id INTEGER NOT NULL,
+    page INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    listing TEXT NOT NULL,
+    PRIMARY KEY (job_id, page, position)
+);
+"""
+
+
+@dataclass(slots=True)
+class WorkItem:
+    """One leased page; token identifies the lease when the result or failure is reported."""
+
+    job_id: int
+    page: int
+    query: dict
+    token: str
+    attempts: int
+
+
+class WorkQueue:
+    """The operations workers and the coordinator need; backends implement all of them."""
+
+    def add_job(self, query):
+        """Queue page 1 of query; returns the job id."""
+        raise NotImplementedError
+
+    def claim(self, worker, limit=1, lease=LEASE_SECONDS):
+        """Lease up to limit pending items to worker (requeueing expired leases first); returns WorkItems."""
+        raise NotImplementedError
+
+    def complete(self, item, listings, more_pages=()):
+        """
+        Record item's listings and queue more_pages of its job, if item's lease is still held.
+        Returns False (and records nothing) when the lease was lost to another worker.
+        """
+        raise NotImplementedError
+
+    def fail(self, item, error):
+        """Give item back to the queue, or mark it failed after MAX_ATTEMPTS leases."""
+        raise NotImplementedError
+
+    def progress(self, job_id=None):
+        """Item counts by status, for one job or all of them."""
+        raise NotImplementedError
+
+    def jobs(self):
+        """[(job id, query, {status: count})]"""
+        raise NotImplementedError
+
+    def query(self, job_id):
+        """The query of a job, or None if there is no such job."""
+        raise NotImplementedError
+
+    def pages(self, job_id):
+        """(page, [Listing]) for every completed page of a job (empty ones included), in page order."""
+        raise NotImplementedError
+
+    def last_page(self, job_id):
+        """The highest page queued for a job, whatever its status (0 if there is no such job)."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SqliteWorkQueue(WorkQueue):
+    """
+    WorkQueue in one SQLite file; claims and completions are short IMMEDIATE transactions.
+    Its methods may be called from any thread (run_worker calls them through asyncio.to_thread);
+    a lock keeps them to one at a time on the shared connection.
+    """
+
+    def __init__(self, path=WORK_QUEUE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Autocommit mode with explicit BEGIN IMMEDIATE, so a claim takes the write lock up front
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def add_job(self, query):
+        with self._transaction():
+            cursor = self._db.execute(
+                "INSERT INTO jobs (query, created_at) VALUES (?, ?)", (json.dumps(query, sort_keys=True), time.time())
+            )
+            self._db.execute("INSERT INTO items (job_id, page) VALUES (?, 1)", (cursor.lastrowid,))
+        return cursor.lastrowid
+
+    def claim(self, worker, limit=1, lease=LEASE_SECONDS):
+        now = time.time()
+        claimed = []
+        with self._transaction():
+            self._db.execute(
+                "UPDATE items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+                " lease_token = NULL, error = 'lease expired' WHERE status = 'leased' AND lease_expires < ?",
+                (MAX_ATTEMPTS, now),
+            )
+            rows = self._db.execute(
+                "SELECT i.job_id, i.page, i.attempts, j.query FROM items i JOIN jobs j ON j.id = i.job_id"
+                " WHERE i.status = 'pending' ORDER BY i.job_id, i.page LIMIT ?",
+                (limit,),
+            ).fetchall()
+            for job_id, page, attempts, query in rows:
+                token = uuid.uuid4().hex
+                self._db.execute(
+                    "UPDATE items SET status = 'leased', lease_token = ?, worker = ?, lease_expires = ?,"
+                    " attempts = attempts + 1 WHERE job_id = ? AND page = ?",
+                    (token, worker, now + lease, job_id, page),
+                )
+                claimed.append(WorkItem(job_id, page, json.loads(query), token, attempts + 1))
+        return claimed
+
+    def complete(self, item, listings, more_pages=()):
+        with self._transaction():
+            cursor = self._db.execute(
+                "UPDATE items SET status = 'done', lease_token = NULL, listings = ?, error = NULL"
+                " WHERE job_id = ? AND page = ? AND status = 'leased' AND lease_token = ?",
+                (len(listings), item.job_id, item.page, item.token),
+            )
+            if cursor.rowcount == 0:
+                return False
+            self._db.executemany(
+                "INSERT OR REPLACE INTO results (job_id, page, position, listing) VALUES (?, ?, ?, ?)",
+                ((item.job_id, item.page, position, json.dumps(listing.as_dict(), ensure_ascii=False))
+                 for position, listing in enumerate(listings)),
+            )
+            self._db.executemany(
+                "INSERT OR IGNORE INTO items (job_id, page) VALUES (?, ?)",
+                ((item.job_id, page) for page in more_pages),
+            )
+            if len(listings) < MAX_PROPERTIES_PER_PAGE:
+                # The result set ends here; pages after it that nobody has started are not needed
+                self._db.execute(
+                    "UPDATE items SET status = 'skipped' WHERE job_id = ? AND page > ? AND status = 'pending'",
+                    (item.job_id, item.page),
+                )
+        return True
+
+    def fail(self, item, error):
+        with self._transaction():
+            self._db.execute(
+                "UPDATE items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+                " lease_token = NULL, error = ? WHERE job_id = ? AND page = ? AND status = 'leased' AND lease_token = ?",
+                (MAX_ATTEMPTS, error, item.job_id, item.page, item.token),
+            )
+
+    def progress(self, job_id=None):
+        sql = "SELECT status, COUNT(*) FROM items"
+        params = ()
+        if job_id is not None:
+            sql += " WHERE job_id = ?"
+            params = (job_id,)
+        counts = dict.fromkeys(STATUSES, 0)
+        with self._lock:
+            counts.update(self._db.execute(sql + " GROUP BY status", params).fetchall())
+        return counts
+
+    def jobs(self):
+        with self._lock:
+            rows = self._db.execute("SELECT id, query FROM jobs ORDER BY id").fetchall()
+        return [(job_id, json.loads(query), self.progress(job_id)) for job_id, query in rows]
+
+    def pages(self, job_id):
+        with self._lock:
+            # One page's rows at a time, so a large job is never held in memory
+            numbers = [page for page, in self._db.execute(
+                "SELECT page FROM items WHERE job_id = ? AND status = 'done' ORDER BY page", (job_id,)
+            )]
+        for page in numbers:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT listing FROM results WHERE job_id = ? AND page = ? ORDER BY position", (job_id, page)
+                ).fetchall()
+            yield page, [listing_from_dict(json.loads(listing)) for listing, in rows]
+
+    def last_page(self, job_id):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(MAX(page), 0) FROM items WHERE job_id = ?", (job_id,)).fetchone()[0]
+
+    def query(self, job_id):
+        with self._lock:
+            row = self._db.execute("SELECT query FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+QUEUE_BACKENDS = {"sqlite": SqliteWorkQueue}
+
+
+def open_queue(target=WORK_QUEUE_PATH):
+    """A queue from a --queue value: "<scheme>:<target>" for a registered backend, else a SQLite path."""
+    scheme, _, rest = target.partition(":")
+    if rest and scheme in QUEUE_BACKENDS:
+        return QUEUE_BACKENDS[scheme](rest)
+    if rest and len(scheme) > 1 and "/" not in scheme and "\\" not in scheme:
+        raise ValueError(f"No work queue backend for {scheme!r}; register one in QUEUE_BACKENDS")
+    return SqliteWorkQueue(target)
+
+
+async def run_worker(queue, worker=None, concurrency=WORKER_CONCURRENCY, lease=LEASE_SECONDS, follow=False):
+    """
+    Claim, fetch and complete items until the queue has nothing pending or leased
+    (with follow, keep polling for new jobs). Returns counts of what this worker did.
+    Queue calls run in threads (asyncio.to_thread) so a busy database never stalls the fetches.
+    An item whose processing raises is logged and left to its lease, which puts it back in the
+    queue when it expires.
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    stats = {"pages": 0, "listings": 0, "failed": 0, "lost_leases": 0, "errors": 0}
+    semaphore = AdaptiveLimiter(initial=min(CONCURRENT_REQUESTS, concurrency), max_limit=concurrency)
+
+    async def process(item):
+        try:
+            _, json_data = await fetch_properties(item.query, item.page, client, semaphore)
+        except Exception as e:
+            json_data = None
+            error = repr(e)
+        else:
+            error = "request failed or page had no __NEXT_DATA__"
+        if json_data is None:
+            await asyncio.to_thread(queue.fail, item, error)
+            stats["failed"] += 1
+            return
+        listings = extract_property_data(json_data)
+        more_pages = ()
+        if item.page == 1:
+            more_pages = range(2, plan_last_page(extract_search_meta(json_data), listings) + 1)
+        if await asyncio.to_thread(queue.complete, item, listings, more_pages):
+            stats["pages"] += 1
+            stats["listings"] += len(listings)
+        else:
+            stats["lost_leases"] += 1
+
+    def check(task):
+        if not task.cancelled() and task.exception() is not None:
+            stats["errors"] += 1
+            logging.warning(f"Work item failed: {task.exception()!r}")
+
+    async with httpx.AsyncClient() as client:
+        running = set()
+        try:
+            while True:
+                if len(running) < concurrency:
+                    for item in await asyncio.to_thread(queue.claim, worker, concurrency - len(running), lease):
+                        task = asyncio.ensure_future(process(item))
+                        task.add_done_callback(check)
+                        running.add(task)
+                if not running:
+                    counts = await asyncio.to_thread(queue.progress)
+                    if not follow and not counts["pending"] and not counts["leased"]:
+                        break
+                    await asyncio.sleep(POLL_INTERVAL)
+                    continue
+                _, running = await asyncio.wait(running, timeout=POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+    return stats
+
+
+def export_job(queue, job_id, outputs):
+    """
+    Stream a job's completed pages, in page order, into the given outputs; returns the sink.
+    The export stops after the first short page (the end of the results) or before the first
+    page that is not done (pending, leased or failed), so pages past a gap are never written.
+    """
+    query = queue.query(job_id)
+    if query is None:
+        raise ValueError(f"No job {job_id}")
+    last_page = queue.last_page(job_id)
+    with open_sinks(outputs, query["country"], query) as sink:
+        expected, reached_end = 1, False
+        for page, listings in queue.pages(job_id):
+            if page != expected:
+                break
+            sink.write(listings)
+            # Without a short page, the end is the last page page 1 planned, unless that was MAX_PAGES
+            if len(listings) < MAX_PROPERTIES_PER_PAGE or page == last_page < MAX_PAGES:
+                reached_end = True
+                break
+            expected += 1
+        sink.finish_crawl(reached_end)
+    return sink
+
+
+def _format_progress(counts):
+    return ", ".join(f"{counts[status]} {status}" for status in STATUSES if counts[status])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Crawl through a shared work queue with any number of workers")
+    parser.add_argument("--queue", default=WORK_QUEUE_PATH, help=f"queue path or <scheme>:<target> (default: {WORK_QUEUE_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    enqueue = commands.add_parser("enqueue", help="add queries to the queue")
+    add_query_args(enqueue)
+    work = commands.add_parser("work", help="run a worker until the queue is drained")
+    work.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="pages in flight in this worker")
+    work.add_argument("--lease", type=float, default=LEASE_SECONDS, help="seconds a claimed page stays leased")
+    work.add_argument("--worker-id", help="name recorded with each lease (default: host:pid)")
+    work.add_argument("--follow", action="store_true", help="keep waiting for new jobs instead of exiting")
+    commands.add_parser("status", help="progress of every job")
+    export = commands.add_parser("export", help="write a job's results to outputs")
+    export.add_argument("job_id", type=int)
+    export.add_argument(
+        "--output", action="append", metavar="TARGET",
+        help="'sheet' (default), 'sheet:<tab>', 'store', 'geo:<path>', or a .ndjson/.csv/.sqlite/.parquet path; "
+             "repeat for several"
+    )
+    args = parser.parse_args()
+    if args.command == "enqueue" and not args.spec and not args.country:
+        parser.error("give --spec FILE or --country")
+    return args
+
+
+def main(args):
+    with open_queue(args.queue) as queue:
+        if args.command == "enqueue":
+            for query in queries_from_args(args):
+                print(f"  job {queue.add_job(query)}: {describe_query(query)}")
+        elif args.command == "work":
+            start_time = time.time()
+            stats = asyncio.run(run_worker(queue, args.worker_id, args.concurrency, args.lease, args.follow))
+            print(
+                f"✔ Worker done in {time.time() - start_time:.1f}s — {stats['pages']} pages, "
+                f"{stats['listings']} listings, {stats['failed']} failed attempts, {stats['lost_leases']} lost leases, "
+                f"{stats['errors']} errors"
+            )
+        elif args.command == "status":
+            for job_id, query, counts in queue.jobs():
+                print(f"  job {job_id}: {describe_query(query)} — {_format_progress(counts)}")
+            print(f"Total: {_format_progress(queue.progress())}")
+        else:
+            counts = queue.progress(args.job_id)
+            if counts["pending"] or counts["leased"]:
+                print(f"⚠ Job {args.job_id} is not finished ({_format_progress(counts)}); exporting the pages done so far")
+            elif counts["failed"]:
+                print(f"⚠ Job {args.job_id} has failed pages; exporting the pages before the first of them")
+            sink = export_job(queue, args.job_id, args.output or ["sheet"])
+            print(f"✔ Exported — {sink.summary()}")
+
+
+if __name__ == "__main__":
+    main(parse_args())